@@ -0,0 +1,59 @@
+"""
+命令分发基准：比较前缀树一次匹配与逐个检查每个命令关键字的延迟。
+
+用法: python benchmarks/command_dispatch.py [命令数] [重复次数]
+"""
+import importlib.util
+import sys
+import time
+from pathlib import Path
+
+# 直接加载command_trie.py，避免导入util时初始化NoneBot
+spec = importlib.util.spec_from_file_location("command_trie", Path(__file__).parent.parent / "src" / "util" / "command_trie.py")
+command_trie = importlib.util.module_from_spec(spec) # type: ignore
+spec.loader.exec_module(command_trie) # type: ignore
+
+def build(count: int):
+    """
+    构造count个命令，每个命令有两个别名和一个带别名的子命令。
+    """
+    trie = command_trie.CommandTrie(["/"], ["-"])
+    linear: list[tuple[str, str]] = []
+    for index in range(count // 2):
+        keywords = [f"cmd{index}", f"c{index}", f"alias{index}"]
+        node = trie.insert(f"Cmd{index}", keywords)
+        sub_keywords = [f"sub{index}", f"s{index}"]
+        trie.insert(f"Cmd{index}.Sub", sub_keywords, node)
+        # 旧的实现为每个命令注册一个匹配器，子命令使用父子别名的笛卡尔积
+        linear.extend((f"/{keyword}", f"Cmd{index}") for keyword in keywords)
+        linear.extend((f"/{keyword}-{sub}", f"Cmd{index}.Sub") for keyword in keywords for sub in sub_keywords)
+    return trie, linear
+
+def match_linear(linear: list[tuple[str, str]], text: str) -> str | None:
+    result = None
+    for command, name in linear:
+        if text.startswith(command) and (len(text) == len(command) or text[len(command)].isspace()):
+            result = name
+    return result
+
+def measure(func, messages: list[str], repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for message in messages:
+            func(message)
+    return (time.perf_counter() - start) / (repeat * len(messages))
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    trie, linear = build(count)
+    messages = [f"/alias{count // 2 - 1}-s{count // 2 - 1} 参数", "/c0 参数", "普通聊天消息，不是命令", f"/cmd{count // 4} 参数"]
+    for message in messages:
+        matched = trie.match(message)
+        assert (matched.name if matched else None) == match_linear(linear, message)
+    trie_time = measure(trie.match, messages, repeat)
+    linear_time = measure(lambda message: match_linear(linear, message), messages, repeat)
+    print(f"{count}个命令（{len(linear)}个关键字组合）")
+    print(f"逐个检查: {linear_time * 1e6:.2f} us/消息")
+    print(f"前缀树:   {trie_time * 1e6:.2f} us/消息")
+    print(f"加速比:   {linear_time / trie_time:.2f}x")
@@ -0,0 +1,69 @@
+"""
+会话窗口基准：比较旧的list.pop(1)淘汰方式与deque滑动窗口在长会话上的耗时。
+
+用法: python benchmarks/conversation_window.py [消息数] [窗口令牌数]
+"""
+import importlib
+import sys
+import time
+import types
+from pathlib import Path
+
+# 不执行插件的__init__.py，避免导入插件时初始化NoneBot
+package = types.ModuleType("chat_plugin")
+package.__path__ = [str(Path(__file__).parent.parent / "src" / "plugins" / "chat")]
+sys.modules["chat_plugin"] = package
+chat = importlib.import_module("chat_plugin.chat")
+
+class ListConversation():
+    """
+    旧的基于list的实现，淘汰时对两个列表执行pop(1)。
+    """
+    def __init__(self, max_tokens: int):
+        self.max_tokens = max_tokens
+        self.conversation: list = [{"role": "system", "content": "preset"}]
+        self.tokens: list[int] = [10]
+        self.current_token = 10
+
+    def add(self, message: dict, token: int):
+        self.tokens.append(token)
+        self.current_token += token
+        while self.current_token > self.max_tokens and len(self.conversation) > 1:
+            self.current_token -= self.tokens.pop(1)
+            self.conversation.pop(1)
+        self.conversation.append(message)
+
+    def get_conversation(self) -> list:
+        return self.conversation
+
+def run_list(count: int, max_tokens: int) -> float:
+    conversation = ListConversation(max_tokens)
+    start = time.perf_counter()
+    for index in range(count):
+        conversation.add({"role": "user", "content": str(index)}, 10)
+    # 一条长消息挤掉大半历史
+    conversation.add({"role": "user", "content": "long"}, max_tokens // 2)
+    conversation.get_conversation()
+    return time.perf_counter() - start
+
+def run_deque(count: int, max_tokens: int) -> float:
+    conversation = chat.Conversation("model", max_tokens)
+    conversation.set_preset({"role": "system", "content": "preset"}, 10)
+    start = time.perf_counter()
+    # 与插件一样通过add_text_message直接创建紧凑消息，不先构造字典再转换
+    for index in range(count):
+        conversation.add_text_message(str(index), "user", 10)
+    conversation.add_text_message("long", "user", max_tokens // 2)
+    conversation.get_conversation()
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    max_tokens = int(sys.argv[2]) if len(sys.argv) > 2 else count * 10
+    # 先填满窗口，再让每条新消息都触发淘汰，最后写入一条长消息
+    list_time = run_list(count * 2, max_tokens)
+    deque_time = run_deque(count * 2, max_tokens)
+    print(f"{count}条消息的窗口，写入{count * 2}条消息")
+    print(f"list.pop(1): {list_time * 1000:.2f} ms")
+    print(f"deque:       {deque_time * 1000:.2f} ms")
+    print(f"加速比:      {list_time / deque_time:.2f}x")
@@ -0,0 +1,70 @@
+"""
+消息内存基准：比较每轮保存OpenAI格式字典（每个会话一份预设副本）与紧凑的StoredMessage表示，
+统计每条保存的消息占用的字节数。
+
+用法: python benchmarks/message_memory.py [用户数] [每个用户的会话数] [每个会话的消息数]
+"""
+import importlib
+import sys
+import tracemalloc
+import types
+from pathlib import Path
+
+# 不执行插件的__init__.py，避免导入插件时初始化NoneBot
+package = types.ModuleType("chat_plugin")
+package.__path__ = [str(Path(__file__).parent.parent / "src" / "plugins" / "chat")]
+sys.modules["chat_plugin"] = package
+chat = importlib.import_module("chat_plugin.chat")
+
+PRESET = "你是一个乐于助人的助手，请用简洁的中文回答用户的问题。" * 4
+
+def build_dicts(users: int, conversations: int, turns: int) -> list:
+    """
+    旧的表示：每条消息是带name字段的字典，每个会话复制一份预设。
+    """
+    result = []
+    for user in range(users):
+        for _ in range(conversations):
+            # 从设置中读取的预设在每个会话中都是新的字符串
+            messages = [{"role": "system", "content": "".join(list(PRESET)), "name": ""}]
+            for turn in range(turns):
+                # 每个事件的用户ID都是新的字符串
+                role = "user" if turn % 2 == 0 else "assistant"
+                messages.append({"role": role, "content": f"第{turn}条消息", "name": str(100000 + user)})
+            result.append(messages)
+    return result
+
+def build_compact(users: int, conversations: int, turns: int) -> list:
+    """
+    新的表示：Conversation中的StoredMessage，预设共享。
+    """
+    result = []
+    for user in range(users):
+        for _ in range(conversations):
+            conversation = chat.Conversation("model", 10 ** 9)
+            conversation.set_preset({"role": "system", "content": "".join(list(PRESET)), "name": ""})
+            for turn in range(turns):
+                role = "user" if turn % 2 == 0 else "assistant"
+                conversation.add_text_message(f"第{turn}条消息", role, 1, str(100000 + user))
+            result.append(conversation)
+    return result
+
+def measure(build, users: int, conversations: int, turns: int) -> int:
+    tracemalloc.start()
+    data = build(users, conversations, turns)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return size
+
+if __name__ == "__main__":
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    conversations = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    turns = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    stored = users * conversations * turns
+    dict_bytes = measure(build_dicts, users, conversations, turns)
+    compact_bytes = measure(build_compact, users, conversations, turns)
+    print(f"{users}个用户，每个用户{conversations}个会话，每个会话{turns}条消息")
+    print(f"字典:     {dict_bytes / stored:.1f} 字节/条")
+    print(f"紧凑表示: {compact_bytes / stored:.1f} 字节/条")
+    print(f"节省:     {1 - compact_bytes / dict_bytes:.1%}")
@@ -0,0 +1,34 @@
+"""
+分词微基准：比较逐段调用tokenizer.encode与一次encode_batch调用的耗时。
+
+用法: python benchmarks/tokenizer_batch.py [tokenizer目录] [段数] [重复次数]
+"""
+import sys
+import time
+from transformers import AutoTokenizer # type: ignore
+
+def per_part(tokenizer, parts: list[str]) -> int:
+    return sum(len(tokenizer.encode(part)) for part in parts)
+
+def batched(tokenizer, parts: list[str]) -> int:
+    return sum(len(encoding.ids) for encoding in tokenizer.backend_tokenizer.encode_batch(parts))
+
+def measure(func, tokenizer, parts: list[str], repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(tokenizer, parts)
+    return (time.perf_counter() - start) / repeat
+
+if __name__ == "__main__":
+    tokenizer_dir = sys.argv[1] if len(sys.argv) > 1 else "./src/external/deepseek"
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_dir, trust_remote_code=True)
+    parts = [f"第{index}段：这是一段用于测试分词速度的长文本。The quick brown fox jumps over the lazy dog. " * 20 for index in range(count)]
+    assert per_part(tokenizer, parts) == batched(tokenizer, parts)
+    loop_time = measure(per_part, tokenizer, parts, repeat)
+    batch_time = measure(batched, tokenizer, parts, repeat)
+    print(f"{count}段文本，重复{repeat}次")
+    print(f"逐段encode:   {loop_time * 1000:.2f} ms")
+    print(f"encode_batch: {batch_time * 1000:.2f} ms")
+    print(f"加速比:       {loop_time / batch_time:.2f}x")
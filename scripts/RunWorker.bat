@@ -0,0 +1 @@
+call .\venv\Scripts\activate && set "PORT=%~1" && python .\src\bot.py
\ No newline at end of file
@@ -1,23 +1,54 @@
 import nonebot
-from nonebot.adapters.onebot import V12Adapter as NoneBotAdapter # type: ignore
-from nonebot.adapters.console import Adapter as ConsoleAdapter # type: ignore
-from nonebot.adapters.qq import Adapter as QQAdapter # type: ignore
+import importlib
+import pkgutil
+import time
 from pathlib import Path
 from os import chdir
+from util.profiler import StartupProfiler
+
+# 适配器名称到模块的映射，只导入配置了的适配器
+ADAPTERS = {
+    "onebot.v12": "nonebot.adapters.onebot.v12",
+    "qq": "nonebot.adapters.qq",
+    "console": "nonebot.adapters.console"
+}
+DEFAULT_ADAPTERS = ["onebot.v12", "qq"]
 
 if __name__ == "__main__":
+    profiler = StartupProfiler()
+
     # 初始化NoneBot
-    nonebot.init()
+    # 环境变量优先于.env：多个进程共享SQLite会话存储时，用PORT为每个进程指定不同的端口，见scripts/RunWorker.bat
+    with profiler.measure("nonebot.init"):
+        nonebot.init()
 
     # 初始化配置
     driver = nonebot.get_driver()
-    driver.register_adapter(NoneBotAdapter)
-    driver.register_adapter(QQAdapter)
+    # 通过ADAPTERS配置项选择适配器，例如ADAPTERS=["onebot.v12", "qq"]
+    adapters: list[str] = getattr(driver.config, "adapters", DEFAULT_ADAPTERS)
+    for name in adapters:
+        with profiler.measure(f"adapter {name}"):
+            driver.register_adapter(importlib.import_module(ADAPTERS.get(name, name)).Adapter)
 
     # 修改当前工作目录为该文件所在目录
     chdir(Path(__file__).parent)
 
-    # 加载插件
-    nonebot.load_plugins("./plugins")
-    
+    # 加载插件，分别记录每个插件的导入和初始化时间
+    startup_begin = 0.0
+    @driver.on_startup
+    async def _():
+        global startup_begin
+        startup_begin = time.perf_counter()
+
+    for module in pkgutil.iter_modules(["plugins"]):
+        if module.name.startswith("_"): continue
+        with profiler.measure(f"plugin {module.name}"):
+            nonebot.load_plugin(f"plugins.{module.name}")
+
+    # 在所有插件的启动钩子之后执行
+    @driver.on_startup
+    async def _():
+        profiler.add("startup hooks", time.perf_counter() - startup_begin)
+        nonebot.logger.info(profiler.report())
+
     nonebot.run()
@@ -1,9 +1,22 @@
-from openai import OpenAI
-from openai.types.chat import ChatCompletionMessageParam, ChatCompletion
-from typing import Protocol, List, runtime_checkable
-from transformers import AutoTokenizer # type: ignore
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletionMessageParam, ChatCompletion, ChatCompletionChunk
+from openai.types import CompletionUsage
+from typing import Protocol, List, AsyncGenerator, runtime_checkable
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import threading
+import httpx
 
-from .chat import Conversation, Messages
+from .chat import Conversation, Messages, StoredMessage
+from .limiter import KeyPool, KeySlot, estimate_tokens
+from .token_cache import TokenCache
+from .tokenizer import TokenizerBackend, ApproximateCounter, create_tokenizer
+from util.metrics import registry, Counter, Gauge
+
+# 分词在线程池中执行，避免长文本阻塞事件循环
+tokenizer_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tokenizer")
+# 没有配置分词器和近似计数时使用的默认估计
+DEFAULT_APPROXIMATE = ApproximateCounter()
 
 @runtime_checkable
 class AIClientProtocol(Protocol):
@@ -11,90 +24,318 @@ class AIClientProtocol(Protocol):
     AIClientProtocol接口定义了与AI客户端交互的方法。
     """
     
-    def chat_completion(self, messages: List[ChatCompletionMessageParam], model:str) -> ChatCompletion:
+    async def chat_completion(self, messages: List[ChatCompletionMessageParam], model:str) -> ChatCompletion:
+        ...
+
+    def chat_completion_stream(self, messages: List[ChatCompletionMessageParam], model:str) -> AsyncGenerator[ChatCompletionChunk, None]:
+        ...
+
+    def get_token(self, message: str) -> int:
+        ...
+
+    async def get_tokens(self, messages: List[str]) -> List[int]:
         ...
 
-    def get_token(self, messages: str) -> int:
+    def approximate_tokens(self, messages: List[str], used: int, limit: int) -> List[int] | None:
         ...
 
-    def new_chat(self, model: str, preset: str = "") -> Conversation:
+    async def new_chat(self, model: str, preset: str = "") -> Conversation:
         ...
 
+def create_http_client(max_connections: int = 100, max_keepalive_connections: int = 20, keepalive_expiry: float = 30.0, timeout: float = 120.0) -> httpx.AsyncClient:
+    """
+    创建供所有AI客户端共享的异步HTTP连接池。
+
+    :params max_connections: 最大并发连接数。
+    :params max_keepalive_connections: 最大保持的空闲连接数。
+    :params keepalive_expiry: 空闲连接的保持时间（秒）。
+    :params timeout: 请求超时时间（秒）。
+    :return: httpx.AsyncClient实例。
+    """
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        ),
+        timeout=httpx.Timeout(timeout)
+    )
+
+class ModelSpec():
+    """
+    单个模型的配置。
+
+    Attributes:
+        name (str): 模型名称。
+        preset (str): 默认预设消息。
+        max_input_tokens (int): 会话的最大令牌数。
+        max_output_tokens (int): 回复的最大令牌数。
+    """
+    __slots__ = ("name", "preset", "max_input_tokens", "max_output_tokens")
+    name: str
+    preset: str
+    max_input_tokens: int
+    max_output_tokens: int
+
+    def __init__(self, name: str, preset: str, max_input_tokens: int, max_output_tokens: int):
+        self.name = name
+        self.preset = preset
+        self.max_input_tokens = max_input_tokens
+        self.max_output_tokens = max_output_tokens
+
+def build_specs(models: List[str], preset: List[str], max_input_tokens: List[int], max_output_tokens: List[int]) -> dict[str, ModelSpec]:
+    """
+    把配置中按下标对应的列表转换为以模型名称为键的配置表。
+
+    :params models: 模型名称列表。
+    :params preset: 默认预设列表。
+    :params max_input_tokens: 最大输入令牌数列表。
+    :params max_output_tokens: 最大输出令牌数列表。
+    :return: 模型配置表。
+    """
+    if not len(models) == len(preset) == len(max_input_tokens) == len(max_output_tokens):
+        raise ValueError("models、preset、max_input_tokens和max_output_tokens的长度必须相同")
+    specs: dict[str, ModelSpec] = {}
+    for name, model_preset, input_tokens, output_tokens in zip(models, preset, max_input_tokens, max_output_tokens):
+        specs[name] = ModelSpec(name, model_preset, input_tokens, output_tokens)
+    return specs
+
 class AIClient():
     """
-    AIClient类用于与AI API进行交互的客户端。
+    AIClient类是OpenAI兼容接口的通用客户端。
     它包含API密钥、模型和基本URL等信息。
-    会初始化OpenAI客户端。
+    会为每个API密钥初始化AsyncOpenAI客户端，请求不会阻塞事件循环，
+    并通过KeyPool在多个密钥之间按限额分配请求。
+    配置了分词器目录时使用分词器计算令牌数，否则按字符数估计。
+    新的提供商只需继承该类并扩展configure等方法。
     """
-    models: List[str] = []
-    preset: List[str] = []
-    max_input_tokens: List[int] = []
-    max_output_tokens: List[int] = []
-    api_key: str = ""
+    specs: dict[str, ModelSpec] = {}
+    api_keys: List[str] = []
     base_url: str = ""
-    client: OpenAI
+    pool: KeyPool
+    token_cache: TokenCache
+    evict_ratio: float = 0.0
+    approximate: ApproximateCounter | None = None
+    approximate_below: float = 0.0
+    tokenizer: TokenizerBackend | None = None
+    tokenizer_dir: str | None = None
+    tokenizer_backend: str = "transformers"
+    tokenizer_lock: threading.Lock
 
-    def __init__(self, models: List[str], preset: List[str], max_input_tokens: List[int], max_output_tokens: List[int], api_key: str, base_url: str):
+    def __init__(self, specs: dict[str, ModelSpec], api_keys: List[str], base_url: str, http_client: httpx.AsyncClient | None = None, rpm: int = 0, tpm: int = 0, token_cache_size: int = 4096, evict_ratio: float = 0.0):
         """
         初始化AIClient实例。
 
         Args:
-            model (str): AI模型的名称。
-            preset (str): 预设消息。
-            max_tokens (int): 最大令牌数。
-            api_key (str): API密钥。
+            specs (dict[str, ModelSpec]): 模型配置表，键为模型名称。
+            api_keys (List[str]): API密钥列表。
             base_url (str): API的基本URL。
+            http_client (httpx.AsyncClient | None): 共享的HTTP连接池，为None时使用OpenAI默认连接池。
+            rpm (int): 每个密钥每分钟的请求数上限，0表示不限制。
+            tpm (int): 每个密钥每分钟的令牌数上限，0表示不限制。
+            token_cache_size (int): 令牌数缓存的最大条目数。
+            evict_ratio (float): 新会话按块移除消息的比例，0表示逐条移除。
         """
-        self.models = models
-        self.preset = preset
-        self.max_input_tokens = max_input_tokens
-        self.max_output_tokens = max_output_tokens
-        self.api_key = api_key
+        self.specs = specs
+        self.api_keys = api_keys
         self.base_url = base_url
-        self.client = OpenAI(
-            api_key=self.api_key,
-            base_url=self.base_url
-        )
+        # 429由KeyPool换用其他密钥重试，关闭OpenAI自带的重试
+        self.pool = KeyPool([
+            KeySlot(key, AsyncOpenAI(api_key=key, base_url=self.base_url, http_client=http_client, max_retries=0), rpm, tpm)
+            for key in api_keys
+        ])
+        self.token_cache = TokenCache(token_cache_size)
+        self.evict_ratio = evict_ratio
+        self.tokenizer_lock = threading.Lock()
 
     def get_models(self) -> List[str]:
-        return self.models
+        return list(self.specs)
 
-class DeepSeekClient(AIClient):
-    """
-    DeepSeekClient类用于与DeepSeek AI API进行交互。
-    它继承自AIClient类，并实现了get_model和chat_completion方法。
-    """
-    tokenizer = None
-
-    def __init__(self, models: List[str], preset: List[str], max_input_tokens: List[int], max_output_tokens: List[int], api_key: str, base_url: str):
-        super().__init__(models, preset, max_input_tokens, max_output_tokens, api_key, base_url)
-    
-    def init_tokenizer(self, chat_tokenizer_dir: str):
-        self.tokenizer = AutoTokenizer.from_pretrained(chat_tokenizer_dir, trust_remote_code=True)
+    def get_spec(self, model: str) -> ModelSpec:
+        """
+        获取模型的配置。
 
-    def new_chat(self, model: str, preset: str = "") -> Conversation:
-        if model not in self.models:
+        :params model: 模型名称。
+        :return: 模型配置。
+        """
+        spec = self.specs.get(model)
+        if spec is None:
             raise ValueError(f"模型 {model} 不在可用模型列表中。")
-        conversation = Conversation(model, self.max_input_tokens[self.models.index(model)])
-        preset_text = self.preset[self.models.index(model)] if preset == "" else preset
-        conversation.set_preset(Messages.system_message(preset_text), self.get_token(preset_text))
+        return spec
+
+    def configure(self, extra: dict[str, str]):
+        """
+        应用提供商相关的额外配置，子类可以扩展。
+
+        :params extra: ModelData.extra中的配置。
+        """
+        approximate_below = float(extra.get("approximate_below", "0"))
+        if approximate_below > 0:
+            self.set_approximate(
+                ApproximateCounter(float(extra.get("ascii_ratio", "0.3")), float(extra.get("other_ratio", "0.6")), float(extra.get("approximate_margin", "1.2"))),
+                approximate_below
+            )
+        if "tokenizer_dir" in extra:
+            self.init_tokenizer(extra["tokenizer_dir"], extra.get("tokenizer_backend", "transformers"))
+
+    def init_tokenizer(self, chat_tokenizer_dir: str, backend: str = "transformers"):
+        """
+        设置分词器目录和后端。分词器在第一次使用或预热时才加载。
+
+        :param chat_tokenizer_dir: 分词器目录。
+        :param backend: 分词器后端，transformers或tokenizers。
+        """
+        self.tokenizer_dir = chat_tokenizer_dir
+        self.tokenizer_backend = backend
+
+    def load_tokenizer(self) -> TokenizerBackend | ApproximateCounter:
+        """
+        加载分词器，只加载一次。分词库在此时才导入，避免拖慢启动。
+        没有配置分词器目录时返回按字符数估计的计数器。
+        """
+        if self.tokenizer is not None:
+            return self.tokenizer
+        if self.tokenizer_dir is None:
+            return self.approximate or DEFAULT_APPROXIMATE
+        with self.tokenizer_lock:
+            if self.tokenizer is None:
+                self.tokenizer = create_tokenizer(self.tokenizer_backend, self.tokenizer_dir)
+        return self.tokenizer
+
+    def warm_up_token_cache(self):
+        """
+        加载分词器，并预先计算所有默认预设的令牌数并写入缓存。
+        耗时较长，应在线程池中执行。
+        """
+        self.load_tokenizer()
+        for spec in self.specs.values():
+            self.get_token(spec.preset)
+
+    def set_approximate(self, approximate: ApproximateCounter, approximate_below: float):
+        """
+        启用近似令牌计数。
+
+        :param approximate: 按字符数估计令牌数的计数器。
+        :param approximate_below: 会话加入新消息后的令牌数低于最大令牌数的该比例时使用近似值。
+        """
+        self.approximate = approximate
+        self.approximate_below = approximate_below
+
+    def approximate_tokens(self, messages: List[str], used: int, limit: int) -> List[int] | None:
+        """
+        估计多段文本的令牌数。只有远离会话令牌上限时才返回估计值，接近上限时应精确计算。
+
+        :param messages: 文本列表。
+        :param used: 会话已使用的令牌数。
+        :param limit: 会话的最大令牌数。
+        :return: 每段文本的估计令牌数，未启用或接近上限时返回None。
+        """
+        if self.approximate is None or self.approximate_below <= 0:
+            return None
+        tokens = [self.approximate.count(message) for message in messages]
+        if used + sum(tokens) > limit * self.approximate_below:
+            return None
+        return tokens
+
+    async def new_chat(self, model: str, preset: str = "") -> Conversation:
+        """
+        创建新会话。预设的令牌数通过get_tokens计算，缓存未命中或分词器尚未加载时在线程池中分词，不阻塞事件循环。
+
+        :param model: 模型名称。
+        :param preset: 预设消息，为空时使用模型的默认预设。
+        :return: 只包含预设的会话。
+        """
+        spec = self.get_spec(model)
+        conversation = Conversation(model, spec.max_input_tokens, self.evict_ratio)
+        preset_text = spec.preset if preset == "" else preset
+        conversation.set_preset(Messages.system_message(preset_text), (await self.get_tokens([preset_text]))[0])
         return conversation
-        
-    def chat_completion(self, messages: List[ChatCompletionMessageParam], model: str) -> ChatCompletion:
-        if model not in self.models:
-            raise ValueError(f"模型 {model} 不在可用模型列表中。")
-        response = self.client.chat.completions.create(
+
+    async def chat_completion(self, messages: List[ChatCompletionMessageParam], model: str) -> ChatCompletion:
+        spec = self.get_spec(model)
+        estimate = estimate_tokens(messages)
+        slot, response = await self.pool.request(estimate, lambda client: client.chat.completions.create(
             model=model,
             messages=messages,
-            max_tokens=self.max_output_tokens[self.models.index(model)]
-        )
+            max_tokens=spec.max_output_tokens
+        ))
+        self.pool.settle(slot, estimate, response.usage.total_tokens if response.usage is not None else estimate)
         return response
-    
+
+    async def chat_completion_stream(self, messages: List[ChatCompletionMessageParam], model: str) -> AsyncGenerator[ChatCompletionChunk, None]:
+        spec = self.get_spec(model)
+        estimate = estimate_tokens(messages)
+        slot, stream = await self.pool.request(estimate, lambda client: client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=spec.max_output_tokens,
+            stream=True,
+            # 最后一个片段携带令牌用量
+            stream_options={"include_usage": True}
+        ))
+        actual = estimate
+        try:
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    actual = chunk.usage.total_tokens
+                yield chunk
+        finally:
+            self.pool.settle(slot, estimate, actual)
+            # 提前结束或出错时关闭响应，释放连接池中的连接
+            await stream.close()
+
     def get_token(self, message: str) -> int:
-        if self.tokenizer is None:
-            raise ValueError("Tokenizer未初始化，请先调用init_tokenizer方法。")
-        result = self.tokenizer.encode(message)
-        return len(result)
+        token = self.token_cache.get(message)
+        if token is None:
+            token = self.load_tokenizer().count(message)
+            self.token_cache.put(message, token)
+        return token
+
+    def encode_batch(self, messages: List[str]) -> List[int]:
+        """
+        一次性计算多段文本的令牌数，不经过缓存。
+
+        :param messages: 文本列表。
+        :return: 每段文本的令牌数。
+        """
+        tokenizer = self.load_tokenizer()
+        if isinstance(tokenizer, ApproximateCounter):
+            return [tokenizer.count(message) for message in messages]
+        return tokenizer.count_batch(messages)
+
+    async def get_tokens(self, messages: List[str]) -> List[int]:
+        """
+        批量获取多段文本的令牌数。缓存在事件循环中读写，未命中的文本在线程池中一次性分词。
+
+        :param messages: 文本列表。
+        :return: 每段文本的令牌数。
+        """
+        tokens = [self.token_cache.get(message) for message in messages]
+        missing = [index for index, token in enumerate(tokens) if token is None]
+        if len(missing) > 0:
+            texts = [messages[index] for index in missing]
+            counts = await asyncio.get_running_loop().run_in_executor(tokenizer_executor, self.encode_batch, texts)
+            for index, text, count in zip(missing, texts, counts):
+                tokens[index] = count
+                self.token_cache.put(text, count)
+        return [token or 0 for token in tokens]
+
+class DeepSeekClient(AIClient):
+    """
+    DeepSeekClient类用于与DeepSeek AI API进行交互。
+    请求逻辑继承自AIClient，额外要求配置DeepSeek的分词器目录。
+    """
+
+    def configure(self, extra: dict[str, str]):
+        if "tokenizer_dir" not in extra:
+            raise ValueError("DeepSeek需要在extra中配置tokenizer_dir")
+        super().configure(extra)
+
+# 提供商名称到客户端类的映射，新的提供商只需在此添加一项
+PROVIDERS: dict[str, type[AIClient]] = {
+    "DeepSeek": DeepSeekClient,
+    "OpenAI": AIClient
+}
 
 class ClientManager:
     """
@@ -102,11 +343,28 @@ class ClientManager:
     它提供了获取模型名称、与AI进行对话和获取令牌数的方法。
     """
     clients: dict[str, AIClient] = {}
-    all_models: List[str]
+    routes: dict[str, tuple[str, AIClient]]
+    tokens: Counter
+    token_cache_requests: Counter
+    token_cache_entries: Gauge
 
     def __init__(self):
         self.clients = {}
-        self.all_models = []
+        self.routes = {}
+        self.tokens = registry.counter("chat_tokens_total", "模型请求使用的令牌数", ("provider", "model", "kind"))
+        self.token_cache_requests = registry.counter("chat_token_cache_total", "令牌数缓存的查询次数", ("provider", "result"))
+        self.token_cache_entries = registry.gauge("chat_token_cache_entries", "令牌数缓存的条目数", ("provider",))
+        registry.collect(self.collect_token_cache)
+
+    def collect_token_cache(self):
+        """
+        把各客户端令牌数缓存的统计信息写入指标。
+        """
+        for name, client in self.clients.items():
+            stats = client.token_cache.stats()
+            self.token_cache_requests.set((name, "hit"), stats["hits"])
+            self.token_cache_requests.set((name, "miss"), stats["misses"])
+            self.token_cache_entries.set((name,), stats["size"])
     
     def add_client(self, name: str, client: AIClient):
         """
@@ -116,7 +374,10 @@ class ClientManager:
         :params client: AIClient实例。
         """
         self.clients[name] = client
-        self.all_models.extend(client.get_models())
+        for model in client.get_models():
+            # 多个客户端提供同一模型时，先添加的客户端优先
+            if model not in self.routes:
+                self.routes[model] = (name, client)
     
     def get_client_with_model(self, model: str) -> AIClient | None:
         """
@@ -125,14 +386,47 @@ class ClientManager:
         :params model: 模型名称。
         :return: AIClient实例或None。
         """
-        if model not in self.all_models:
-            return None
-        for client in self.clients.values():
-            if model in client.get_models():
-                return client
-        return None
+        route = self.routes.get(model)
+        return route[1] if route is not None else None
+
+    def get_provider_with_model(self, model: str) -> str | None:
+        """
+        获取提供指定模型的客户端名称。
 
-def chat_completion(client: AIClientProtocol, messages: list[ChatCompletionMessageParam], model:str) -> ChatCompletion:
+        :params model: 模型名称。
+        :return: 客户端名称或None。
+        """
+        route = self.routes.get(model)
+        return route[0] if route is not None else None
+
+    def record_usage(self, model: str, usage: CompletionUsage | None):
+        """
+        按提供者和模型记录请求的令牌用量。
+
+        :params model: 模型名称。
+        :params usage: 响应中的用量，为None时不记录。
+        """
+        if usage is None:
+            return
+        provider = self.get_provider_with_model(model) or ""
+        self.tokens.inc((provider, model, "prompt"), usage.prompt_tokens)
+        self.tokens.inc((provider, model, "completion"), usage.completion_tokens)
+        self.tokens.inc((provider, model, "cached"), get_cached_tokens(usage))
+
+def get_cached_tokens(usage: CompletionUsage) -> int:
+    """
+    获取命中提供者前缀缓存的提示令牌数。
+    OpenAI格式在prompt_tokens_details中，DeepSeek使用额外字段prompt_cache_hit_tokens。
+
+    :params usage: 响应中的用量。
+    :return: 命中缓存的令牌数。
+    """
+    if usage.prompt_tokens_details is not None and usage.prompt_tokens_details.cached_tokens is not None:
+        return usage.prompt_tokens_details.cached_tokens
+    extra = usage.model_extra or {}
+    return int(extra.get("prompt_cache_hit_tokens") or 0)
+
+async def chat_completion(client: AIClientProtocol, messages: list[ChatCompletionMessageParam], model:str) -> ChatCompletion:
     """
     与AI进行对话并获取响应。
     
@@ -140,9 +434,19 @@ def chat_completion(client: AIClientProtocol, messages: list[ChatCompletionMessa
     :params messages: 消息列表，包含用户和AI的消息。
     :return: AI的响应。
     """
-    return client.chat_completion(messages, model)
+    return await client.chat_completion(messages, model)
+
+def chat_completion_stream(client: AIClientProtocol, messages: list[ChatCompletionMessageParam], model:str) -> AsyncGenerator[ChatCompletionChunk, None]:
+    """
+    与AI进行对话并以流的形式获取响应。
+    
+    :params client: 实现了AIClientProtocol的客户端实例。
+    :params messages: 消息列表，包含用户和AI的消息。
+    :return: AI响应片段的异步迭代器，最后一个片段包含令牌用量。
+    """
+    return client.chat_completion_stream(messages, model)
 
-def new_chat(client: AIClientProtocol, model: str, preset: str = "") -> Conversation:
+async def new_chat(client: AIClientProtocol, model: str, preset: str = "") -> Conversation:
     """
     创建一个新的对话实例。
     
@@ -151,36 +455,43 @@ def new_chat(client: AIClientProtocol, model: str, preset: str = "") -> Conversa
     :params preset: 预设消息，默认为空字符串。
     :return: Conversation实例。
     """
-    return client.new_chat(model, preset)
+    return await client.new_chat(model, preset)
 
-def get_text_token(client: AIClientProtocol, messages: str) -> int:
+def get_message_texts(messages: ChatCompletionMessageParam | StoredMessage) -> List[str]:
     """
-    获取消息的令牌数。
+    获取消息中的所有文本段。
     
-    :params client: 实现了AIClientProtocol的客户端实例。
-    :params messages: 消息列表，包含用户和AI的消息。
-    :return: 消息的令牌数。
+    :params messages: 消息对象或会话中的紧凑消息。
+    :return: 文本列表。
     """
-    return client.get_token(messages)
+    content = messages.content if isinstance(messages, StoredMessage) else messages.get("content")
+    match content:
+        case str():
+            return [content]
+        case list() | tuple():
+            return [text for message in content if (text := message.get("text")) is not None]
+    return []
 
-def get_message_token(client: AIClientProtocol, messages: ChatCompletionMessageParam) -> int:
+async def get_messages_token(client: AIClientProtocol, messages: List[ChatCompletionMessageParam], conversation: Conversation | None = None) -> List[int]:
     """
-    获取消息的令牌数。
+    批量获取多条消息的令牌数，所有文本段在一次分词调用中完成。
+    指定会话且客户端启用了近似计数时，远离会话令牌上限的消息只做估计，不调用分词器。
     
     :params client: 实现了AIClientProtocol的客户端实例。
-    :params messages: 消息列表，包含用户和AI的消息。
-    :return: 消息的令牌数。
+    :params messages: 消息列表。
+    :params conversation: 消息将要加入的会话。
+    :return: 每条消息的令牌数。
     """
-    token = 0
-    content = messages.get("content")
-    match content:
-        # 获取单段消息的令牌数
-        case str():
-            token += client.get_token(content)
-        # 获取多段消息的令牌数
-        case list():
-            for message in content:
-                text =  message.get("text")
-                if text is not None:
-                    token += client.get_token(text)
-    return token
\ No newline at end of file
+    texts = [get_message_texts(message) for message in messages]
+    flat = [text for parts in texts for text in parts]
+    counts = None
+    if conversation is not None:
+        counts = client.approximate_tokens(flat, conversation.current_token, conversation.max_tokens)
+    if counts is None:
+        counts = await client.get_tokens(flat)
+    tokens: List[int] = []
+    offset = 0
+    for parts in texts:
+        tokens.append(sum(counts[offset:offset + len(parts)]))
+        offset += len(parts)
+    return tokens
@@ -1,20 +1,51 @@
-from typing import Iterable, List, Literal
-from pydantic.dataclasses import dataclass
+from typing import Any, Deque, Iterable, Iterator, List, Literal
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+import asyncio
+import copy
+import sys
+import time
+import weakref
 import dataclasses
 from openai.types.chat import ChatCompletionMessageParam, ChatCompletionContentPartParam, ChatCompletionSystemMessageParam
 from openai.types.chat import ChatCompletionUserMessageParam, ChatCompletionAssistantMessageParam, ChatCompletionContentPartTextParam, ChatCompletionContentPartRefusalParam
 
-@dataclass
+from .storage import ConversationStore, SharedConversationStore
+
+@dataclasses.dataclass(slots=True)
 class UserSetting:
     """
     用户设置类，用于定义用户的基本信息。
+    使用标准库的slots数据类，修改设置时不做校验，字符串字段由ConversationManager驻留。
     
     Attributes:
         current_model (str): 当前使用的模型名称。
         preset (dict[str, str]): 预设配置，键为模型名称，值为预设内容。
+        route_policy (str): 路由策略（fixed、fallback或fastest），为空时使用默认策略。
     """
     current_model: str = ""
     preset: dict[str, str] = dataclasses.field(default_factory=lambda: {})
+    route_policy: str = ""
+
+def estimate_size(obj: Any) -> int:
+    """
+    估计消息对象占用的内存字节数，递归统计字典、列表和字符串。
+    
+    :param obj: 消息或消息内容。
+    :return: 估计的字节数。
+    """
+    if isinstance(obj, StoredMessage):
+        # 每次加入和移除消息都会调用：对象大小固定，角色和名称是驻留的字符串，不计入；
+        # 字符串不被垃圾回收跟踪，__sizeof__与sys.getsizeof相同但快得多
+        content = obj.content
+        return STORED_MESSAGE_SIZE + (content.__sizeof__() if isinstance(content, str) else estimate_size(content))
+    size = sys.getsizeof(obj)
+    match obj:
+        case dict():
+            size += sum(estimate_size(value) for value in obj.values())
+        case list() | tuple():
+            size += sum(estimate_size(value) for value in obj)
+    return size
 
 class Messages:
     @classmethod
@@ -47,21 +78,143 @@ class Messages:
         """
         return ChatCompletionAssistantMessageParam(role="assistant", content=content, name=name)
 
+class StoredMessage():
+    """
+    会话中保存的紧凑消息，发送请求时才转换为OpenAI格式的字典。
+    角色和名称使用驻留的字符串，多段内容保存为元组。
+
+    Attributes:
+        role (str): 消息角色。
+        content (str | tuple[Any, ...]): 消息内容。
+        name (str): 消息发送者的名称，为空时转换后的字典不包含name字段。
+    """
+    __slots__ = ("role", "content", "name", "__weakref__")
+    role: str
+    content: str | tuple[Any, ...]
+    name: str
+
+    def __init__(self, role: str, content: str | Iterable[Any], name: str = ""):
+        self.role = sys.intern(role)
+        self.content = content if isinstance(content, str) else tuple(content)
+        self.name = sys.intern(name) if name != "" else ""
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, StoredMessage):
+            return NotImplemented
+        return self.role == other.role and self.content == other.content and self.name == other.name
+
+    @classmethod
+    def from_param(cls, message: "ChatCompletionMessageParam | StoredMessage") -> "StoredMessage":
+        """
+        从OpenAI格式的消息创建紧凑消息，已经是紧凑消息时直接返回。
+
+        :param message: 消息对象。
+        :return: 紧凑消息。
+        """
+        if isinstance(message, StoredMessage):
+            return message
+        return cls(message["role"], message.get("content") or "", message.get("name") or "") # type: ignore
+
+    def to_param(self) -> ChatCompletionMessageParam:
+        """
+        转换为OpenAI格式的消息。
+
+        :return: 消息字典。
+        """
+        param: dict[str, Any] = {"role": self.role, "content": self.content if isinstance(self.content, str) else list(self.content)}
+        if self.name != "":
+            param["name"] = self.name
+        return param # type: ignore
+
+# 紧凑消息对象本身的字节数，与内容无关
+STORED_MESSAGE_SIZE = sys.getsizeof(StoredMessage("user", ""))
+
+# 相同内容的预设在所有会话之间共享同一个对象，没有会话引用时自动释放
+shared_presets: weakref.WeakValueDictionary[str, StoredMessage] = weakref.WeakValueDictionary()
+
+def share_preset(preset: StoredMessage) -> StoredMessage:
+    """
+    获取与预设内容相同的共享对象，不存在时登记该预设。
+
+    :param preset: 预设消息。
+    :return: 共享的预设消息。
+    """
+    if not isinstance(preset.content, str) or preset.name != "":
+        return preset
+    return shared_presets.setdefault(preset.content, preset)
+
 class Conversation():
+    """
+    Conversation类用于保存一个会话的消息。
+    预设消息单独保存，其余消息保存在滑动窗口中，超过最大令牌数时从窗口头部移除，
+    移除操作为均摊O(1)。
+    evict_ratio大于0时按块移除：一次移除到只占用最大令牌数的(1 - evict_ratio)，
+    之后的若干轮只在末尾追加消息，发送给模型的前缀保持不变，可以命中提供者的前缀缓存。
+    开启压缩时，被移除的消息暂存在evicted中，由后台任务总结为一条固定在预设之后的摘要消息，
+    摘要的令牌数计入current_token。
+    消息以StoredMessage保存，相同内容的预设在会话之间共享，get_conversation时才生成OpenAI格式的字典。
+    生成的列表按窗口版本缓存，会话变化后才重新生成；请求结束后由ConversationManager释放，空闲的会话只保留紧凑消息。
+    """
     model:str = ""
     max_tokens:int
-    conversation:List[ChatCompletionMessageParam]
-    tokens:List[int]
+    evict_ratio:float
+    preset:StoredMessage | None
+    preset_token:int
+    messages:Deque[StoredMessage]
+    tokens:Deque[int]
     current_token:int
+    size:int
+    cache_hit_tokens:int
+    cache_miss_tokens:int
+    compact:bool
+    summary:StoredMessage | None
+    summary_token:int
+    evicted:List[StoredMessage]
+    compacting:bool
+    cache:list[ChatCompletionMessageParam] | None
     
-    def __init__(self, model: str, max_tokens: int):
+    def __init__(self, model: str, max_tokens: int, evict_ratio: float = 0.0, compact: bool = False):
         self.model = model
         self.max_tokens = max_tokens
-        self.tokens = []
-        self.conversation = []
+        self.evict_ratio = evict_ratio
+        self.preset = None
+        self.preset_token = 0
+        self.messages = deque()
+        self.tokens = deque()
         self.current_token = 0
+        self.size = 0
+        self.cache_hit_tokens = 0
+        self.cache_miss_tokens = 0
+        self.compact = compact
+        self.summary = None
+        self.summary_token = 0
+        self.evicted = []
+        self.compacting = False
+        self.cache = None
+
+    def append_message(self, msg: ChatCompletionMessageParam | StoredMessage, token: int) -> StoredMessage:
+        """
+        将消息加入窗口。超过最大令牌数时，移除最旧的消息，新消息本身不会被移除。
+        按块移除时，窗口开头的助手消息会一并移除，使历史总是从用户消息开始。
+        
+        :param msg: 消息对象。
+        :param token: 消息的令牌数。
+        :return: 加入的紧凑消息。
+        """
+        if not isinstance(msg, StoredMessage):
+            msg = StoredMessage.from_param(msg)
+        self.cache = None
+        self.current_token += token
+        if self.current_token > self.max_tokens:
+            self.remove_oldest_messages(self.max_tokens * (1 - self.evict_ratio))
+            while self.evict_ratio > 0 and len(self.messages) > 0 and self.messages[0].role == "assistant":
+                self.remove_oldest_message()
+        self.messages.append(msg)
+        self.tokens.append(token)
+        self.size += estimate_size(msg)
+        return msg
 
-    def add_text_message(self, message: str | Iterable[ChatCompletionContentPartTextParam], role: Literal["user", "assistant", "system"], token:int = 0, name: str = "") -> ChatCompletionMessageParam:
+    def add_text_message(self, message: str | Iterable[ChatCompletionContentPartTextParam], role: Literal["user", "assistant", "system"], token:int = 0, name: str = "") -> StoredMessage:
         """
         添加文本消息到会话中。超过最大令牌数时，移除最旧的消息。
         
@@ -70,22 +223,10 @@ class Conversation():
         :param token: 消息的令牌数。
         :param name: 消息发送者的名称。
         """
-        self.tokens.append(token)
-        self.current_token += token
-        while self.current_token > self.max_tokens:
-            self.remove_oldest_message()
-        match role:
-            case "user":
-                msg = Messages.user_message(content=message, name=name)
-            case "assistant":
-                msg = Messages.assistant_message(content=message, name=name)
-            case "system":
-                msg = Messages.system_message(content=message, name=name)
-        self.conversation.append(msg)
-        return msg
+        return self.append_message(StoredMessage(role, message, name), token)
 
     
-    def add_rich_message(self, message: str | Iterable[ChatCompletionContentPartParam], role: Literal["user"], token:int = 0, name: str = "") -> ChatCompletionMessageParam:
+    def add_rich_message(self, message: str | Iterable[ChatCompletionContentPartParam], role: Literal["user"], token:int = 0, name: str = "") -> StoredMessage:
         """
         添加富文本消息到会话中。超过最大令牌数时，移除最旧的消息。
         
@@ -94,65 +235,628 @@ class Conversation():
         :param token: 消息的令牌数。
         :param name: 消息发送者的名称。
         """
-        self.tokens.append(token)
-        self.current_token += token
-        while self.current_token > self.max_tokens:
-            self.remove_oldest_message()
         # 暂时不支持assistant和system消息
-        match role:
-            case "user":
-                msg = Messages.user_message(content=message, name=name)
-        self.conversation.append(msg)
-        return msg
+        return self.append_message(StoredMessage("user", message, name), token)
 
-    # TODO: 图片消息
-    # def add_image(self, url:str):
-    #     local_url = fs.save_file(url)
-    #     base64_image = fs.read_file_as_base64(local_url)
-    #     self.conversation[self.index]["content"].append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}})
-    #     fs.remove_file(local_url)
+    def remove_oldest_messages(self, target: float):
+        """
+        从窗口头部移除消息，直到令牌数不超过target或窗口为空，预设消息和摘要不会被移除。
+        在一个循环中移除，不逐条调用remove_oldest_message。
+
+        :param target: 移除后的令牌数上限。
+        """
+        messages = self.messages
+        tokens = self.tokens
+        current = self.current_token
+        if current <= target or len(messages) == 0:
+            return
+        self.cache = None
+        removed = 0
+        while current > target and len(messages) > 0:
+            current -= tokens.popleft()
+            msg = messages.popleft()
+            if self.compact:
+                # 等待总结的消息仍占用内存
+                self.evicted.append(msg)
+            else:
+                removed += estimate_size(msg)
+        self.current_token = current
+        self.size -= removed
 
     def remove_oldest_message(self):
         """
-        移除最旧的消息。
+        移除最旧的消息，预设消息和摘要不会被移除。
         """
-        if len(self.conversation) > 1:
-            self.current_token -= self.tokens.pop(1)
-            self.conversation.pop(1)
+        if len(self.messages) > 0:
+            self.cache = None
+            self.current_token -= self.tokens.popleft()
+            msg = self.messages.popleft()
+            if self.compact:
+                # 等待总结的消息仍占用内存
+                self.evicted.append(msg)
+            else:
+                self.size -= estimate_size(msg)
+
+    def rollback(self, message: StoredMessage):
+        """
+        撤回指定消息及其之后的所有消息，用于请求被取消时恢复会话。
+        消息已被移除时不做任何操作。
+
+        :param message: 要撤回的消息对象。
+        """
+        if not any(msg is message for msg in reversed(self.messages)):
+            return
+        self.cache = None
+        while len(self.messages) > 0:
+            self.current_token -= self.tokens.pop()
+            msg = self.messages.pop()
+            self.size -= estimate_size(msg)
+            if msg is message:
+                return
 
     def get_conversation(self) -> list[ChatCompletionMessageParam]:
-        return self.conversation
+        """
+        获取发送给模型的消息列表，包含预设消息。
+        列表会被缓存，只有会话变化时才从紧凑消息重新生成，调用方不应修改返回的列表。
+
+        :return: 消息列表。
+        """
+        if self.cache is None:
+            self.cache = [message.to_param() for message in (self.preset, self.summary) if message is not None]
+            self.cache.extend(message.to_param() for message in self.messages)
+        return self.cache
+
+    def snapshot(self) -> "Conversation":
+        """
+        复制会话的当前状态，用于在线程池中序列化。
+        消息对象不会被修改，只复制保存消息的容器。
+
+        :return: 会话副本。
+        """
+        conversation = copy.copy(self)
+        conversation.messages = self.messages.copy()
+        conversation.tokens = self.tokens.copy()
+        conversation.evicted = list(self.evicted)
+        conversation.cache = None
+        return conversation
+
+    def release_cache(self):
+        """
+        释放缓存的OpenAI格式消息列表，下次get_conversation时重新生成。
+        """
+        self.cache = None
+
+    def needs_compaction(self) -> bool:
+        """
+        是否有等待总结的消息且没有正在进行的总结。
+        """
+        return self.compact and len(self.evicted) > 0 and not self.compacting
+
+    def set_summary(self, summary: ChatCompletionMessageParam | StoredMessage, summary_token: int, consumed: int):
+        """
+        用新的摘要替换旧摘要，并移除已被总结的消息。
+        摘要使会话超过最大令牌数时，继续从窗口头部移除消息，这些消息会在下次压缩时并入摘要。
+
+        :param summary: 摘要消息。
+        :param summary_token: 摘要的令牌数。
+        :param consumed: 已被总结的消息数，从evicted的头部计算。
+        """
+        summary = StoredMessage.from_param(summary)
+        self.cache = None
+        for msg in self.evicted[:consumed]:
+            self.size -= estimate_size(msg)
+        del self.evicted[:consumed]
+        self.size += estimate_size(summary) - (estimate_size(self.summary) if self.summary is not None else 0)
+        self.current_token += summary_token - self.summary_token
+        self.summary = summary
+        self.summary_token = summary_token
+        self.remove_oldest_messages(self.max_tokens)
     
-    def set_preset(self, preset:ChatCompletionMessageParam, preset_token:int = 0):
+    def set_preset(self, preset:ChatCompletionMessageParam | StoredMessage, preset_token:int = 0):
         """
-        设置预设消息。
+        设置预设消息。预设消息与当前相同时不做任何操作，避免改变前缀。
+        相同内容的预设使用共享对象，其内存只按一份计入会话。
         
         :param preset: 预设消息内容。
         :param preset_token: 预设消息的令牌数。
         """
         if preset_token > self.max_tokens:
             raise ValueError("预设消息的令牌数超过最大令牌数")
-        if len(self.conversation) > 0:
-            self.current_token -= self.tokens.pop(0)
-            self.conversation.pop(0)
-        self.conversation.insert(0, preset)
-        self.tokens.insert(0, preset_token)
-        self.current_token += preset_token
+        preset = share_preset(StoredMessage.from_param(preset))
+        if preset == self.preset:
+            return
+        self.cache = None
+        self.current_token += preset_token - self.preset_token
+        # 共享的预设只计入对象本身
+        self.size += sys.getsizeof(preset) - (sys.getsizeof(self.preset) if self.preset is not None else 0)
+        self.preset = preset
+        self.preset_token = preset_token
 
     def get_model(self):
         return self.model
 
+    def record_cache(self, hit_tokens: int, prompt_tokens: int):
+        """
+        记录一次请求中命中和未命中提供者前缀缓存的提示令牌数。
+
+        :param hit_tokens: 命中缓存的提示令牌数。
+        :param prompt_tokens: 提示令牌总数。
+        """
+        self.cache_hit_tokens += hit_tokens
+        self.cache_miss_tokens += max(prompt_tokens - hit_tokens, 0)
+
+    def get_cache_stats(self) -> dict[str, float]:
+        """
+        获取会话的前缀缓存统计。
+
+        :return: 包含命中、未命中令牌数和命中率的字典。
+        """
+        total = self.cache_hit_tokens + self.cache_miss_tokens
+        return {
+            "hit_tokens": self.cache_hit_tokens,
+            "miss_tokens": self.cache_miss_tokens,
+            "hit_rate": self.cache_hit_tokens / total if total > 0 else 0.0
+        }
+
+    def to_dict(self) -> dict[str, Any]:
+        """
+        将会话转换为可序列化的字典。
+
+        :return: 会话字典。
+        """
+        return {
+            "model": self.model,
+            "max_tokens": self.max_tokens,
+            "evict_ratio": self.evict_ratio,
+            "cache_hit_tokens": self.cache_hit_tokens,
+            "cache_miss_tokens": self.cache_miss_tokens,
+            "compact": self.compact,
+            "summary": self.summary.to_param() if self.summary is not None else None,
+            "summary_token": self.summary_token,
+            "evicted": [msg.to_param() for msg in self.evicted],
+            "preset": self.preset.to_param() if self.preset is not None else None,
+            "preset_token": self.preset_token,
+            "messages": [msg.to_param() for msg in self.messages],
+            "tokens": list(self.tokens)
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "Conversation":
+        """
+        从字典恢复会话。
+
+        :param data: to_dict生成的会话字典。
+        :return: 会话对象。
+        """
+        conversation = cls(data["model"], data["max_tokens"], data.get("evict_ratio", 0.0), data.get("compact", False))
+        conversation.cache_hit_tokens = data.get("cache_hit_tokens", 0)
+        conversation.cache_miss_tokens = data.get("cache_miss_tokens", 0)
+        if data.get("summary") is not None:
+            conversation.set_summary(data["summary"], data["summary_token"], 0)
+        conversation.evicted = [StoredMessage.from_param(msg) for msg in data.get("evicted", [])]
+        conversation.size += sum(estimate_size(msg) for msg in conversation.evicted)
+        if data["preset"] is not None:
+            conversation.set_preset(data["preset"], data["preset_token"])
+        for message, token in zip(data["messages"], data["tokens"]):
+            message = StoredMessage.from_param(message)
+            conversation.messages.append(message)
+            conversation.tokens.append(token)
+            conversation.current_token += token
+            conversation.size += estimate_size(message)
+        return conversation
+
 class ConversationManager():
     """
     ConversationManager类用于管理多个会话。
     它提供了添加、获取和删除会话的方法。
+    所有用户的会话共享一个内存预算，超出时按最近访问时间淘汰最久未活跃用户的会话；
+    长时间未活跃的用户会被整体移除。
+    配置了持久化后端时，用户在第一次访问时才从后端加载，淘汰时只从内存中卸载，
+    修改过的用户由flush批量写入后端。
+    后端可被多个进程共享时，处理指令前通过refresh在线程池中检查用户的版本号，其他进程修改过的用户会被重新加载；
+    写入时版本冲突的用户会丢弃本进程的修改并在下次访问时重新加载。
+    开启群聊共享会话时，用户ID也可以是群聊或频道的会话ID，群成员共享其会话和设置。
+    有请求正在使用的用户通过pin固定，淘汰时跳过，避免回复写入已被移除的会话。
     """
-    conversations: dict[str, List[Conversation]]
+    conversations: dict[str, Deque[Conversation]]
     user_setting: dict[str,UserSetting]
+    last_access: OrderedDict[str, float]
+    user_bytes: dict[str, int]
+    total_bytes: int
+    max_bytes: int
+    idle_ttl: float
+    max_conversations: int
+    store: ConversationStore | None
+    dirty: set[str]
+    pending: dict[str, dict[str, Any] | None]
+    versions: dict[str, int]
+    writing: set[str]
+    pinned: dict[str, int]
+    flush_lock: asyncio.Lock
+
+    def __init__(self, max_bytes: int = 0, idle_ttl: float = 0, max_conversations: int = 10, store: ConversationStore | None = None):
+        """
+        初始化ConversationManager实例。
 
-    def __init__(self):
-        self.conversations: dict[str, List[Conversation]] = {}
+        :param max_bytes: 所有会话的内存预算（字节），0表示不限制。
+        :param idle_ttl: 用户未活跃多久后被移除（秒），0表示不移除。
+        :param max_conversations: 每个用户保留的最大会话数。
+        :param store: 持久化后端，为None时不持久化。
+        """
+        self.conversations: dict[str, Deque[Conversation]] = {}
         self.user_setting: dict[str, UserSetting] = {}
+        self.last_access = OrderedDict()
+        self.user_bytes = {}
+        self.total_bytes = 0
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.max_conversations = max_conversations
+        self.store = store
+        self.dirty = set()
+        self.pending = {}
+        self.versions = {}
+        self.writing = set()
+        self.pinned = {}
+        self.flush_lock = asyncio.Lock()
+
+    @contextmanager
+    def pin(self, user_id: str) -> Iterator[None]:
+        """
+        在代码块执行期间固定用户，其会话不会因超出内存预算被淘汰。可以嵌套使用。
+        最外层结束时释放其会话缓存的消息列表。
+
+        :param user_id: 用户ID。
+        """
+        self.pinned[user_id] = self.pinned.get(user_id, 0) + 1
+        try:
+            yield
+        finally:
+            self.pinned[user_id] -= 1
+            if self.pinned[user_id] == 0:
+                del self.pinned[user_id]
+                # 最后一个请求结束后释放生成的消息列表，空闲用户只占用紧凑消息的内存
+                for conversation in self.conversations.get(user_id, ()):
+                    conversation.release_cache()
+
+    def is_shared(self) -> bool:
+        """
+        持久化后端是否可被多个进程共享。
+
+        :return: 是否共享。
+        """
+        return isinstance(self.store, SharedConversationStore)
+
+    def access(self, user_id: str):
+        """
+        记录用户的访问时间，并移除长时间未活跃的用户。
+        用户未加载时先从持久化后端加载。不检查其他进程的修改，由refresh在处理请求前检查。
+
+        :param user_id: 用户ID。
+        """
+        if user_id not in self.last_access:
+            self.load_user(user_id)
+        self.touch(user_id)
+
+    def touch(self, user_id: str):
+        """
+        记录已加载用户的访问时间，并移除长时间未活跃的用户。
+
+        :param user_id: 用户ID。
+        """
+        self.last_access[user_id] = time.monotonic()
+        self.last_access.move_to_end(user_id)
+        self.expire()
+
+    async def refresh(self, user_id: str):
+        """
+        在线程池中读取持久化后端，加载未加载的用户，或重新加载已被其他进程修改的用户，不阻塞事件循环。
+        有请求正在使用的用户不会被重新加载，留到请求结束后的下一次refresh。
+        应在处理用户的指令之前调用，之后的access不再读取后端。
+
+        :param user_id: 用户ID。
+        """
+        if self.store is None:
+            return
+        loop = asyncio.get_running_loop()
+        if user_id not in self.last_access:
+            # 待写入的记录在内存中，由access直接加载
+            if user_id in self.pending:
+                return
+            record = await loop.run_in_executor(None, self.read_user, user_id)
+            # 等待期间用户可能已被加载
+            if user_id not in self.last_access:
+                self.load_user(user_id, record)
+                self.touch(user_id)
+            return
+        if not self.can_reload(user_id):
+            return
+        assert isinstance(self.store, SharedConversationStore)
+        version = await loop.run_in_executor(None, self.store.version, user_id)
+        if version == self.versions.get(user_id, 0):
+            return
+        record = await loop.run_in_executor(None, self.read_user, user_id)
+        # 等待期间用户可能已被修改、固定或卸载
+        if self.can_reload(user_id):
+            self.remove_user(user_id)
+            self.load_user(user_id, record)
+            self.touch(user_id)
+
+    def expire(self):
+        """
+        移除超过空闲时间未活跃的用户，包括其会话和设置。
+        """
+        if self.idle_ttl <= 0:
+            return
+        deadline = time.monotonic() - self.idle_ttl
+        while len(self.last_access) > 0:
+            user_id, last = next(iter(self.last_access.items()))
+            if last >= deadline:
+                break
+            if user_id in self.pinned:
+                # 请求仍在使用的用户视为刚刚访问
+                self.last_access[user_id] = time.monotonic()
+                self.last_access.move_to_end(user_id)
+                continue
+            self.unload_user(user_id)
+
+    def read_user(self, user_id: str) -> tuple[dict[str, Any] | None, int]:
+        """
+        从持久化后端读取用户记录，不修改内存中的状态，可以在线程池中执行。
+
+        :param user_id: 用户ID。
+        :return: 用户记录和版本号，后端不共享时版本号为0。
+        """
+        if isinstance(self.store, SharedConversationStore):
+            return self.store.load_versioned(user_id)
+        return (self.store.load(user_id) if self.store is not None else None), 0
+
+    def load_user(self, user_id: str, record: tuple[dict[str, Any] | None, int] | None = None):
+        """
+        从持久化后端加载用户的会话和设置，尚未写入后端的记录优先。
+
+        :param user_id: 用户ID。
+        :param record: 已经读取的用户记录和版本号，为None时在此读取。
+        """
+        if self.store is None:
+            return
+        if user_id in self.pending:
+            data = self.pending[user_id]
+        else:
+            data, version = record if record is not None else self.read_user(user_id)
+            if self.is_shared():
+                self.versions[user_id] = version
+        if data is None:
+            return
+        if len(data["conversations"]) > 0:
+            self.conversations[user_id] = deque((Conversation.from_dict(conversation) for conversation in data["conversations"]), maxlen=self.max_conversations)
+            self.user_bytes[user_id] = sum(conversation.size for conversation in self.conversations[user_id])
+            self.total_bytes += self.user_bytes[user_id]
+        if data["setting"] is not None:
+            self.user_setting[user_id] = UserSetting(**data["setting"])
+            self.intern_setting(self.user_setting[user_id])
+
+    def can_reload(self, user_id: str) -> bool:
+        """
+        已加载的用户能否按其他进程的修改重新加载。
+        本进程有未写入的修改或正在写入时不重新加载，由写入时的版本号冲突处理；
+        有请求正在使用的用户不重新加载，避免回复写入已被替换的会话。
+
+        :param user_id: 用户ID。
+        :return: 能否重新加载。
+        """
+        return (
+            self.is_shared()
+            and user_id in self.last_access
+            and user_id not in self.pinned
+            and user_id not in self.dirty
+            and user_id not in self.writing
+            and user_id not in self.pending
+        )
+
+    def dump_user(self, user_id: str) -> dict[str, Any] | None:
+        """
+        将用户的会话和设置转换为可序列化的字典。
+
+        :param user_id: 用户ID。
+        :return: 用户记录，用户没有任何数据时返回None。
+        """
+        return self.dump_snapshot(self.snapshot_user(user_id))
+
+    def snapshot_user(self, user_id: str) -> tuple[List[Conversation], UserSetting | None]:
+        """
+        复制用户的会话和设置。只复制容器，开销与消息数成正比但不生成字典，
+        之后可以在线程池中用dump_snapshot序列化，不受事件循环中修改的影响。
+
+        :param user_id: 用户ID。
+        :return: 会话副本列表和设置副本。
+        """
+        setting = self.user_setting.get(user_id)
+        return (
+            [conversation.snapshot() for conversation in self.conversations.get(user_id, ())],
+            dataclasses.replace(setting, preset=dict(setting.preset)) if setting is not None else None
+        )
+
+    @staticmethod
+    def dump_snapshot(snapshot: tuple[List[Conversation], UserSetting | None]) -> dict[str, Any] | None:
+        """
+        将snapshot_user生成的副本转换为可序列化的字典。
+
+        :param snapshot: 会话副本列表和设置副本。
+        :return: 用户记录，用户没有任何数据时返回None。
+        """
+        conversations, setting = snapshot
+        if len(conversations) == 0 and setting is None:
+            return None
+        return {
+            "conversations": [conversation.to_dict() for conversation in conversations],
+            "setting": dataclasses.asdict(setting) if setting is not None else None
+        }
+
+    def mark_dirty(self, user_id: str):
+        """
+        标记用户数据已修改，等待下次flush写入持久化后端。未加载的用户不会被标记。
+
+        :param user_id: 用户ID。
+        """
+        if self.store is not None and user_id in self.last_access:
+            self.dirty.add(user_id)
+
+    def unload_user(self, user_id: str):
+        """
+        从内存中卸载用户。有持久化后端时，修改过的数据会先保存为待写入记录。
+
+        :param user_id: 用户ID。
+        """
+        if user_id in self.dirty:
+            self.pending[user_id] = self.dump_user(user_id)
+            self.dirty.discard(user_id)
+        self.remove_user(user_id)
+
+    def remove_user(self, user_id: str):
+        """
+        移除用户的所有会话和设置。
+
+        :param user_id: 用户ID。
+        """
+        self.conversations.pop(user_id, None)
+        self.user_setting.pop(user_id, None)
+        self.last_access.pop(user_id, None)
+        self.total_bytes -= self.user_bytes.pop(user_id, 0)
+        self.dirty.discard(user_id)
+        # 待写入的记录仍需要读取时的版本号
+        if user_id not in self.pending:
+            self.versions.pop(user_id, None)
+
+    def update_usage(self, user_id: str):
+        """
+        重新计算用户会话占用的内存，超出预算时淘汰会话。
+        会话内容变化后应调用此方法。用户已被卸载时不做任何操作。
+
+        :param user_id: 用户ID。
+        """
+        if user_id not in self.last_access:
+            return
+        size = sum(conversation.size for conversation in self.conversations.get(user_id, ()))
+        self.total_bytes += size - self.user_bytes.get(user_id, 0)
+        if size > 0:
+            self.user_bytes[user_id] = size
+        else:
+            self.user_bytes.pop(user_id, None)
+        self.mark_dirty(user_id)
+        self.enforce_budget()
+
+    def enforce_budget(self):
+        """
+        按最近访问时间从旧到新淘汰会话，直到总内存不超过预算。
+        最近访问的用户至少保留当前会话，被固定的用户不会被淘汰。
+        有持久化后端时整体卸载用户，之后访问时重新加载；被固定的用户不会被卸载。
+        """
+        if self.max_bytes <= 0 or self.total_bytes <= self.max_bytes:
+            return
+        users = list(self.last_access)
+        if self.store is not None:
+            for user_id in users[:-1]:
+                if self.total_bytes <= self.max_bytes:
+                    return
+                if user_id not in self.pinned:
+                    self.unload_user(user_id)
+            return
+        for user_id in users:
+            if self.total_bytes <= self.max_bytes:
+                return
+            conversations = self.conversations.get(user_id)
+            # 请求可能正在使用其任意一个会话
+            if conversations is None or user_id in self.pinned:
+                continue
+            keep = 1 if user_id == users[-1] else 0
+            while len(conversations) > keep and self.total_bytes > self.max_bytes:
+                conversation = conversations.popleft()
+                self.total_bytes -= conversation.size
+                self.user_bytes[user_id] = self.user_bytes.get(user_id, 0) - conversation.size
+            if len(conversations) == 0:
+                del self.conversations[user_id]
+                self.total_bytes -= self.user_bytes.pop(user_id, 0)
+                if user_id not in self.user_setting:
+                    self.last_access.pop(user_id, None)
+
+    def write_records(self, records: dict[str, dict[str, Any] | None], snapshots: dict[str, tuple[List[Conversation], UserSetting | None]], versions: dict[str, int]) -> dict[str, int | None]:
+        """
+        序列化用户副本并与待写入记录一起写入持久化后端，在线程池中执行。
+
+        :param records: 已经序列化的待写入记录。
+        :param snapshots: 修改过的已加载用户的副本，同一用户优先于待写入记录。
+        :param versions: 读取时的版本号，只用于共享后端。
+        :return: 共享后端中每个用户的新版本号，冲突时为None；后端不共享时为空字典。
+        """
+        records = dict(records)
+        for user_id, snapshot in snapshots.items():
+            records[user_id] = self.dump_snapshot(snapshot)
+        if isinstance(self.store, SharedConversationStore):
+            return self.store.write_versioned({user_id: (data, versions[user_id]) for user_id, data in records.items()})
+        assert self.store is not None
+        self.store.write(records)
+        return {}
+
+    async def flush(self) -> List[str]:
+        """
+        把修改过的用户数据批量写入持久化后端。
+        事件循环中只复制修改过的用户，序列化和写入在线程池中执行。
+        多次调用依次执行：并发的写入会使用过期的版本号，把本进程的修改误判为其他进程的修改。
+        写入期间用户的修改会重新标记为已修改，由下次写入使用新的版本号写入。
+
+        :return: 因版本冲突写入失败的用户ID列表。
+        """
+        if self.store is None:
+            return []
+        async with self.flush_lock:
+            records = dict(self.pending)
+            snapshots = {}
+            for user_id in self.dirty:
+                # 未加载的用户没有内存中的数据，写入None会删除其持久化记录
+                if user_id in self.last_access:
+                    snapshots[user_id] = self.snapshot_user(user_id)
+            self.dirty.clear()
+            users = set(records) | set(snapshots)
+            if len(users) == 0:
+                return []
+            versions = {user_id: self.versions.get(user_id, 0) for user_id in users}
+            conflicts: List[str] = []
+            self.writing.update(users)
+            try:
+                results = await asyncio.get_running_loop().run_in_executor(None, self.write_records, records, snapshots, versions)
+                for user_id, version in results.items():
+                    if version is None:
+                        conflicts.append(user_id)
+                    elif user_id in self.last_access or user_id in self.pending:
+                        self.versions[user_id] = version
+            except BaseException:
+                # 写入失败时保留修改，等待下次写入
+                self.dirty.update(user_id for user_id in users if user_id in self.last_access)
+                raise
+            finally:
+                self.writing.difference_update(users)
+            # 已写入的待写入记录不再需要，写入期间被再次卸载的用户保留新的待写入记录
+            for user_id, data in records.items():
+                if user_id in self.pending and self.pending[user_id] is data:
+                    del self.pending[user_id]
+                    if user_id not in self.last_access:
+                        self.versions.pop(user_id, None)
+            # 版本冲突的用户以其他进程的数据为准，下次访问时重新加载
+            for user_id in conflicts:
+                self.remove_user(user_id)
+            return conflicts
+
+    def get_stats(self) -> dict[str, int]:
+        """
+        获取会话管理器的统计信息。
+
+        :return: 包含用户数、会话数和估计内存字节数的字典。
+        """
+        return {
+            "users": len(self.last_access),
+            "conversations": sum(len(conversations) for conversations in self.conversations.values()),
+            "bytes": self.total_bytes
+        }
 
     def get_user_setting(self, user_id: str) -> UserSetting | None:
         """
@@ -161,8 +865,20 @@ class ConversationManager():
         :param user_id: 用户ID。
         :return: 用户设置对象，如果没有设置，则返回None。
         """
+        self.access(user_id)
         return self.user_setting.get(user_id, None)
     
+    @staticmethod
+    def intern_setting(setting: UserSetting):
+        """
+        驻留用户设置中的字符串，使大量用户共享相同的模型名称、策略和预设。
+
+        :param setting: 用户设置。
+        """
+        setting.current_model = sys.intern(setting.current_model)
+        setting.route_policy = sys.intern(setting.route_policy)
+        setting.preset = {sys.intern(model): sys.intern(preset) for model, preset in setting.preset.items()}
+
     def change_model(self, user_id: str, model: str):
         """
         更改指定用户的模型。
@@ -170,10 +886,28 @@ class ConversationManager():
         :param user_id: 用户ID。
         :param model: 新模型名称。
         """
+        model = sys.intern(model)
+        self.access(user_id)
         if user_id in self.user_setting:
             self.user_setting[user_id].current_model = model
         else:
             self.user_setting[user_id] = UserSetting(current_model=model)
+        self.mark_dirty(user_id)
+    
+    def change_route_policy(self, user_id: str, policy: str):
+        """
+        更改指定用户的路由策略。
+        
+        :param user_id: 用户ID。
+        :param policy: 路由策略。
+        """
+        policy = sys.intern(policy)
+        self.access(user_id)
+        if user_id in self.user_setting:
+            self.user_setting[user_id].route_policy = policy
+        else:
+            self.user_setting[user_id] = UserSetting(route_policy=policy)
+        self.mark_dirty(user_id)
     
     def change_preset(self, user_id: str, model: str, preset: str):
         """
@@ -183,19 +917,21 @@ class ConversationManager():
         :param model: 模型名称。
         :param preset: 新预设内容。
         """
+        model, preset = sys.intern(model), sys.intern(preset)
+        self.access(user_id)
         if user_id in self.user_setting:
             self.user_setting[user_id].preset[model] = preset
         else:
             self.user_setting[user_id] = UserSetting(preset={model: preset})
+        self.mark_dirty(user_id)
     
     def add_conversation(self, user_id: str, conversation: Conversation):
-        if user_id in self.conversations:
-            self.conversations[user_id].append(conversation)
-            # 仅保留最近10条会话记录
-            if len(self.conversations[user_id]) > 10:
-                self.conversations[user_id].pop(0)
-        else:
-            self.conversations[user_id] = [conversation]
+        self.access(user_id)
+        if user_id not in self.conversations:
+            # 仅保留最近max_conversations条会话记录，超出时自动丢弃最旧的会话
+            self.conversations[user_id] = deque(maxlen=self.max_conversations)
+        self.conversations[user_id].append(conversation)
+        self.update_usage(user_id)
     
     def current_conversation(self, user_id: str) -> Conversation | None:
         """
@@ -205,6 +941,7 @@ class ConversationManager():
         :param user_id: 用户ID
         :return: 会话对象，如果没有会话，则返回None。
         """
+        self.access(user_id)
         if user_id in self.conversations and len(self.conversations[user_id]) > 0:
             return self.conversations[user_id][-1]
         return None
@@ -219,10 +956,13 @@ class ConversationManager():
         :param update: 是否更新会话，默认为False。
         :return: 会话对象，如果没有会话，则返回None。
         """
+        self.access(user_id)
         if user_id in self.conversations and len(self.conversations[user_id]) > 0 and index < len(self.conversations[user_id]):
             if not update:
                 return self.conversations[user_id][index]
-            conversation = self.conversations[user_id].pop(index)
+            conversation = self.conversations[user_id][index]
+            del self.conversations[user_id][index]
             self.conversations[user_id].append(conversation)
+            self.mark_dirty(user_id)
             return conversation
         return None
@@ -2,61 +2,548 @@ from .config import Config
 from util import get_command
 from nonebot.adapters import Message, Event
 from nonebot.params import CommandArg
-from nonebot import get_plugin_config
+from nonebot import get_plugin_config, get_driver, get_app
 from nonebot.internal.matcher import Matcher
-from .chat import ConversationManager, Messages
-from .AI import ClientManager, DeepSeekClient, AIClientProtocol, new_chat, chat_completion, get_message_token
+from .chat import ConversationManager, Conversation, Messages, StoredMessage
+from .AI import ClientManager, AIClientProtocol, PROVIDERS, build_specs, new_chat, get_messages_token, create_http_client, get_cached_tokens, get_message_texts, tokenizer_executor
+from .stream import StreamChunker
+from .scheduler import RequestScheduler, RequestSuperseded
+from .storage import create_store
+from .compaction import Compactor
+from .response_cache import ResponseCache, response_key
+from .router import ModelRouter, POLICIES
+import asyncio
+import time
+from contextlib import aclosing, contextmanager
 from nonebot import logger
 from util import file_system as fs
-from typing import List
-from openai.types.chat import ChatCompletionContentPartParam 
+from util.media_cache import MediaCache
+from util.metrics import registry
+from typing import Iterator, List
+from openai.types import CompletionUsage
+from openai.types.chat import ChatCompletionContentPartParam
 
 # Get the plugin config
 plugin_config = get_plugin_config(Config).chat
 command_list: dict[str, type[Matcher]] = get_command(plugin_config.commands)
 
 
-conversation_manager = ConversationManager()
+store = create_store(plugin_config.storage.backend, plugin_config.storage.path)
+conversation_manager = ConversationManager(plugin_config.memory.max_bytes, plugin_config.memory.idle_ttl, plugin_config.memory.max_conversations, store)
 client_manager = ClientManager()
+scheduler = RequestScheduler(supersede=plugin_config.scheduler.supersede)
+# 所有模型客户端共享的HTTP连接池
+http_client = create_http_client(
+    plugin_config.http.max_connections,
+    plugin_config.http.max_keepalive_connections,
+    plugin_config.http.keepalive_expiry,
+    plugin_config.http.timeout
+)
+
+media_cache = MediaCache(plugin_config.image.cache_dir, plugin_config.image.cache_memory_bytes, plugin_config.image.cache_disk_bytes)
+
+# 各阶段的耗时，分位数由Prometheus根据分桶计算
+stage_latency = registry.histogram("chat_stage_seconds", "聊天请求各阶段的耗时（秒）", ("stage", "provider", "model"))
+conversation_stats = registry.gauge("chat_conversation_manager", "内存中的用户数、会话数和估计的会话字节数", ("stat",))
+
+def collect_conversation_stats():
+    for stat, value in conversation_manager.get_stats().items():
+        conversation_stats.set((stat,), value)
+
+registry.collect(collect_conversation_stats)
+
+def stage(name: str, model: str):
+    """
+    记录代码块的耗时。
+
+    :param name: 阶段名称。
+    :param model: 模型名称。
+    :return: 计时的上下文管理器。
+    """
+    return stage_latency.time((name, client_manager.get_provider_with_model(model) or "", model))
+
+# 在FastAPI驱动器上提供Prometheus格式的指标接口
+if plugin_config.metrics.enable:
+    if get_driver().type.startswith("fastapi"):
+        import hmac
+        from fastapi import Request
+        from fastapi.responses import PlainTextResponse
+        if plugin_config.metrics.token == "":
+            logger.warning("指标接口没有设置访问令牌，任何能访问机器人端口的人都可以读取")
+        @get_app().get(plugin_config.metrics.path, response_class=PlainTextResponse)
+        async def _(request: Request):
+            token = plugin_config.metrics.token
+            if token != "" and not hmac.compare_digest(request.headers.get("authorization", "").encode(), f"Bearer {token}".encode()):
+                return PlainTextResponse("Unauthorized", status_code=401)
+            return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+    else:
+        logger.warning(f"驱动器 {get_driver().type} 不是FastAPI，无法提供指标接口")
+
+response_cache = ResponseCache(plugin_config.response_cache.ttl, plugin_config.response_cache.max_bytes) if plugin_config.response_cache.enable else None
+router = ModelRouter(client_manager, plugin_config.router.fallbacks, plugin_config.router.hedge, plugin_config.router.hedge_min_delay, error_threshold=plugin_config.router.error_threshold, cooldown=plugin_config.router.cooldown)
+compactor = Compactor(client_manager, plugin_config.compact.model, plugin_config.compact.prompt, plugin_config.compact.cache_size)
+
+flush_task: asyncio.Task | None = None
+warm_up_task: asyncio.Task | None = None
+cleanup_task: asyncio.Task | None = None
+# 保存后台总结任务的引用，避免任务被垃圾回收
+compact_tasks: set[asyncio.Task] = set()
+# 群聊共享会话中等待加入会话的消息：发送者、消息内容和令牌数
+group_pending: dict[str, List[tuple[str, List[ChatCompletionContentPartParam], int]]] = {}
+# 私聊中等待加入会话的用户消息，被新请求取代的请求的消息由新请求一并加入
+user_pending: dict[str, List[Message]] = {}
+
+async def flush_loop():
+    """
+    定期把修改过的会话写入持久化后端。
+    """
+    while True:
+        await asyncio.sleep(plugin_config.storage.flush_interval)
+        await flush()
+
+async def flush():
+    """
+    把修改过的会话写入持久化后端，记录失败和版本冲突。
+    """
+    try:
+        conflicts = await conversation_manager.flush()
+    except Exception as e:
+        logger.error(f"保存会话失败: {e}")
+        return
+    for user_id in conflicts:
+        logger.warning(f"用户 {user_id} 的会话已被其他进程修改，本次修改被丢弃")
+
+async def cleanup_loop():
+    """
+    定期清理没有引用的图片缓存文件，并保存URL映射。
+    """
+    while True:
+        await asyncio.sleep(plugin_config.image.cleanup_interval)
+        try:
+            removed = await media_cache.cleanup()
+            await media_cache.save()
+        except Exception as e:
+            logger.error(f"清理图片缓存失败: {e}")
+            continue
+        logger.info(f"清理了 {removed} 个图片缓存文件，缓存状态: {media_cache.get_stats()}")
+
+async def warm_up():
+    """
+    在线程池中加载各客户端的分词器并预热令牌数缓存，不阻塞启动。
+    """
+    loop = asyncio.get_running_loop()
+    for name, client in client_manager.clients.items():
+        try:
+            await loop.run_in_executor(tokenizer_executor, client.warm_up_token_cache)
+        except Exception as e:
+            logger.error(f"加载 {name} 的分词器失败: {e}")
+
+@get_driver().on_startup
+async def _():
+    global flush_task, cleanup_task, warm_up_task
+    warm_up_task = asyncio.create_task(warm_up())
+    try:
+        await media_cache.load()
+    except Exception as e:
+        logger.error(f"加载图片缓存索引失败: {e}")
+    if store is not None:
+        flush_task = asyncio.create_task(flush_loop())
+    cleanup_task = asyncio.create_task(cleanup_loop())
+
+@get_driver().on_shutdown
+async def _():
+    await http_client.aclose()
+    if flush_task is not None:
+        flush_task.cancel()
+    if cleanup_task is not None:
+        cleanup_task.cancel()
+    try:
+        await media_cache.save()
+    except Exception as e:
+        logger.error(f"保存图片缓存索引失败: {e}")
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+    for task in compact_tasks:
+        task.cancel()
+    if store is not None:
+        await flush()
+        store.close()
+
 # 初始化管理器
 for name, data in plugin_config.model.items():
-    if plugin_config.key.get(name) is None:
+    key = plugin_config.key.get(name)
+    if key is None or len(key.get_keys()) == 0:
         logger.warning(f"模型 {name} 没有密钥，无法使用")
         continue
-    match name:
-        case "DeepSeek":
-            client = DeepSeekClient(data.models, data.preset, data.max_input_tokens, data.max_output_tokens, plugin_config.key[name].key, data.base_url)
-            client.init_tokenizer(data.extra["tokenizer_dir"])
-            client_manager.add_client(name, client)
-        case _:
-            logger.warning(f"模型 {name} 不支持，无法使用")
-            continue
+    client_class = PROVIDERS.get(name)
+    if client_class is None:
+        logger.warning(f"模型 {name} 不支持，无法使用")
+        continue
+    specs = build_specs(data.models, data.preset, data.max_input_tokens, data.max_output_tokens)
+    client = client_class(specs, key.get_keys(), data.base_url, http_client, key.rpm, key.tpm, plugin_config.token_cache_size, data.evict_ratio)
+    client.configure(data.extra)
+    client_manager.add_client(name, client)
+    scheduler.set_limit(name, data.max_concurrency)
+    router.set_limits(name, data.timeout, data.retries)
 
-def process_message(args: Message) -> List[ChatCompletionContentPartParam]:
+async def get_image(url: str) -> str | None:
+    """
+    通过图片缓存获取图片的data URL，未缓存时下载。
+    
+    :param url: 图片的URL地址。
+    :return: data URL，下载失败时返回None。
+    """
+    return await media_cache.get(url, lambda: fs.fetch_image(http_client, url, plugin_config.image.max_bytes, plugin_config.image.timeout))
+
+async def process_message(args: Message) -> List[ChatCompletionContentPartParam]:
     """
     处理消息，将消息转换为ChatCompletionContentPartParam格式。
+    消息中的图片会并发下载并以data URL的形式附加。
     
     :param args: 消息对象。
     :return: 处理后的消息列表。
     """
-    message:List[ChatCompletionContentPartParam] = []
+    message:List[ChatCompletionContentPartParam | None] = []
+    images: dict[int, str] = {}
     for msgSegment in args:
         match msgSegment.type:
             case "image":
-                # TODO: 图片消息
-                url = msgSegment.data["url"]
-                # local_url = fs.save_file(url)
-                # base64_image = fs.read_file_as_base64(local_url)
-                # fs.remove_file(local_url)
+                url = msgSegment.data.get("url")
+                if url is None or len(images) >= plugin_config.image.max_images:
+                    continue
+                # 先占位，下载完成后按原顺序填入
+                images[len(message)] = url
+                message.append(None)
             case "text":
                 message.append({"type":"text", "text":msgSegment.data.get("text")})
-    return message
+    if len(images) > 0:
+        results = await asyncio.gather(*(get_image(url) for url in images.values()))
+        for index, data_url in zip(images.keys(), results):
+            if data_url is not None:
+                message[index] = {"type": "image_url", "image_url": {"url": data_url}}
+    return [part for part in message if part is not None]
+
+def record_usage(conversation: Conversation, usage: CompletionUsage | None, model: str | None = None):
+    """
+    记录请求的令牌用量和会话的前缀缓存命中情况。
+
+    :param conversation: 当前会话。
+    :param usage: 响应中的用量，为None时不记录。
+    :param model: 实际使用的模型，为None时使用会话的模型。
+    """
+    client_manager.record_usage(model or conversation.model, usage)
+    if usage is None:
+        return
+    conversation.record_cache(get_cached_tokens(usage), usage.prompt_tokens)
+    logger.debug(f"会话前缀缓存: {conversation.get_cache_stats()}")
+
+def get_cache_key(conversation: Conversation, message: List[ChatCompletionContentPartParam]) -> bytes | None:
+    """
+    计算新会话中用户消息的回复缓存键，只有纯文本消息可以缓存。
+
+    :param conversation: 只包含预设的新会话。
+    :param message: 处理后的用户消息。
+    :return: 缓存键，未启用缓存或消息不可缓存时返回None。
+    """
+    if response_cache is None or len(message) == 0 or any(part["type"] != "text" for part in message):
+        return None
+    preset = "".join(get_message_texts(conversation.preset)) if conversation.preset is not None else ""
+    return response_key(conversation.model, preset, "".join(part["text"] for part in message)) # type: ignore
+
+def get_group_session(event: Event) -> str | None:
+    """
+    获取群聊或频道的会话ID，私聊时返回None。
+    会话ID只包含字母、数字和下划线，可以作为消息的name字段。
+
+    :param event: 消息事件。
+    :return: 会话ID。
+    """
+    # OneBot V12的群聊和频道事件，以及QQ官方的群聊和频道事件
+    if (group_id := getattr(event, "group_id", None) or getattr(event, "group_openid", None)):
+        return f"group_{group_id}"
+    if (channel_id := getattr(event, "channel_id", None)):
+        return f"channel_{getattr(event, 'guild_id', None) or ''}_{channel_id}"
+    return None
+
+def get_owner(event: Event) -> str:
+    """
+    获取会话和设置的所有者。开启群聊共享会话时，群聊和频道中的消息属于其会话ID，否则属于发送者。
+
+    :param event: 消息事件。
+    :return: 所有者ID。
+    """
+    if plugin_config.group.enable and (session := get_group_session(event)) is not None:
+        return session
+    return str(event.get_user_id())
+
+def get_policy(id: str) -> str:
+    """
+    获取用户的路由策略，未设置时使用默认策略。
+
+    :param id: 用户ID。
+    :return: 路由策略。
+    """
+    setting = conversation_manager.get_user_setting(id)
+    return setting.route_policy if setting is not None and setting.route_policy != "" else plugin_config.router.policy
+
+async def reply_cached(matcher: type[Matcher], conversation: Conversation, id: str, key: bytes):
+    """
+    通过回复缓存回复用户，相同的并发请求只调用一次模型。
+    
+    :param matcher: 当前指令的匹配器。
+    :param conversation: 当前会话。
+    :param id: 用户ID。
+    :param key: 回复缓存键。
+    """
+    assert response_cache is not None
+    async def fetch() -> tuple[str, int, bool] | None:
+        model, result = await router.complete(conversation.model, conversation.get_conversation(), get_policy(id))
+        record_usage(conversation, result.usage, model)
+        if result.choices[0].message.content is None:
+            return None
+        # 缓存键使用会话的模型，备用模型的回复不写入缓存
+        return result.choices[0].message.content, result.usage.completion_tokens if result.usage is not None else 0, model == conversation.model
+    try:
+        with stage("request", conversation.model):
+            entry = await response_cache.get(key, fetch)
+    except Exception as e:
+        logger.error(f"调用模型失败: {e}")
+        await matcher.finish(f"调用模型失败，请截图此报错给开发者: {e}")
+    if entry is None:
+        await matcher.finish("模型返回空消息，请让开发者检查")
+    conversation.add_text_message(entry.content, "assistant", entry.token, id)
+    with stage("send", conversation.model):
+        await matcher.send(entry.content)
+    await matcher.finish()
+
+async def reply(matcher: type[Matcher], conversation: Conversation, id: str, key: bytes | None = None):
+    """
+    通过路由器调用模型并回复用户，根据配置选择一次性回复或流式回复。
+    有回复缓存键时通过回复缓存一次性回复。
+    
+    :param matcher: 当前指令的匹配器。
+    :param conversation: 当前会话。
+    :param id: 用户ID。
+    :param key: 回复缓存键。
+    """
+    if key is not None:
+        await reply_cached(matcher, conversation, id, key)
+        return
+    if plugin_config.stream.enable:
+        await reply_stream(matcher, conversation, id)
+        return
+    # 处理消息
+    try:
+        # 获取返回消息
+        with stage("request", conversation.model):
+            model, result = await router.complete(conversation.model, conversation.get_conversation(), get_policy(id))
+    except Exception as e:
+        # 处理异常
+        logger.error(f"调用模型失败: {e}")
+        await matcher.finish(f"调用模型失败，请截图此报错给开发者: {e}")
+    record_usage(conversation, result.usage, model)
+    # 处理返回消息
+    respond = result.choices[0].message.content
+    token = result.usage.completion_tokens if result.usage is not None else 0
+    if respond is None:
+        await matcher.finish("模型返回空消息，请让开发者检查")
+    conversation.add_text_message(respond, "assistant", token, id)
+    with stage("send", conversation.model):
+        await matcher.send(respond)
+    await matcher.finish()
+
+async def reply_stream(matcher: type[Matcher], conversation: Conversation, id: str):
+    """
+    以流的形式调用模型，按句子或段落分段发送回复。
+    完整的回复在结束后一次性写入会话，令牌数取自最后一个片段的用量。
+    
+    :param matcher: 当前指令的匹配器。
+    :param conversation: 当前会话。
+    :param id: 用户ID。
+    """
+    chunker = StreamChunker(plugin_config.stream.min_chunk_size, plugin_config.stream.max_chunk_size, plugin_config.stream.flush_interval)
+    parts: List[str] = []
+    token = 0
+    usage = None
+    model = conversation.model
+    start = time.perf_counter()
+    try:
+        with stage("request", conversation.model):
+            # 发送失败或请求被取消时立即关闭流，不等待垃圾回收
+            async with aclosing(router.stream(conversation.model, conversation.get_conversation(), get_policy(id))) as chunks:
+                async for model, chunk in chunks:
+                    if chunk.usage is not None:
+                        usage = chunk.usage
+                        token = chunk.usage.completion_tokens
+                    if len(chunk.choices) == 0 or not chunk.choices[0].delta.content:
+                        continue
+                    if len(parts) == 0:
+                        stage_latency.observe(time.perf_counter() - start, ("first_token", client_manager.get_provider_with_model(model) or "", model))
+                    parts.append(chunk.choices[0].delta.content)
+                    for piece in chunker.feed(chunk.choices[0].delta.content):
+                        with stage("send", conversation.model):
+                            await matcher.send(piece)
+    except Exception as e:
+        # 处理异常，已发送的部分不写入会话
+        logger.error(f"调用模型失败: {e}")
+        await matcher.finish(f"调用模型失败，请截图此报错给开发者: {e}")
+    record_usage(conversation, usage, model)
+    respond = "".join(parts)
+    if respond == "":
+        await matcher.finish("模型返回空消息，请让开发者检查")
+    conversation.add_text_message(respond, "assistant", token, id)
+    rest = chunker.flush().strip("\n")
+    await matcher.finish(rest if rest.strip() != "" else None)
+
+async def prepare_message(client: AIClientProtocol, conversation: Conversation, args: Message) -> tuple[List[ChatCompletionContentPartParam], int]:
+    """
+    处理用户消息并计算其令牌数。
+    
+    :param client: 实现了AIClientProtocol的客户端实例。
+    :param conversation: 消息将要加入的会话。
+    :param args: 用户消息。
+    :return: 处理后的消息内容和令牌数。
+    """
+    with stage("process_message", conversation.model):
+        message = await process_message(args)
+    with stage("tokenize", conversation.model):
+        token = (await get_messages_token(client, [Messages.user_message(content=message)], conversation))[0]
+    return message, token
+
+@contextmanager
+def take_pending(id: str) -> Iterator[List[Message]]:
+    """
+    取出用户所有等待中的消息，包括排队期间被取代的请求的消息。
+    代码块被取消时把消息放回等待队列，由下一个请求加入会话。
+
+    :param id: 用户ID。
+    """
+    pending = user_pending.pop(id, [])
+    try:
+        yield pending
+    except asyncio.CancelledError:
+        user_pending[id] = pending + user_pending.get(id, [])
+        raise
+
+async def run_turn(matcher: type[Matcher], client: AIClientProtocol, conversation: Conversation, id: str, pending: List[Message], fresh: bool = False):
+    """
+    将用户消息依次加入会话并只回复一次。请求被取消时撤回本轮消息。
+    
+    :param matcher: 当前指令的匹配器。
+    :param client: 实现了AIClientProtocol的客户端实例。
+    :param conversation: 当前会话。
+    :param id: 用户ID。
+    :param pending: 本轮的用户消息。
+    :param fresh: 会话是否为没有历史的新会话，只有新会话可以使用回复缓存。
+    """
+    messages = [await prepare_message(client, conversation, args) for args in pending]
+    # 合并了多条消息时不使用回复缓存
+    key = get_cache_key(conversation, messages[0][0]) if fresh and len(messages) == 1 else None
+    first = None
+    for message, token in messages:
+        msg = conversation.add_rich_message(message, "user", token, id)
+        first = first or msg
+    await answer(matcher, client, conversation, id, first, key)
+
+async def run_group_turn(matcher: type[Matcher], client: AIClientProtocol, conversation: Conversation, id: str, name: str, args: Message):
+    """
+    群聊共享会话的一轮对话。群成员的消息先进入等待队列，请求开始执行时全部加入共享会话，
+    使回复进行中到达的消息排在该回复之后。排队中的请求合并为一次，共享的历史只发送一次，
+    被合并的请求不单独回复。
+    
+    :param matcher: 当前指令的匹配器。
+    :param client: 实现了AIClientProtocol的客户端实例。
+    :param conversation: 共享会话。
+    :param id: 群聊或频道的会话ID。
+    :param name: 消息发送者的用户ID。
+    :param args: 用户消息。
+    """
+    message, token = await prepare_message(client, conversation, args)
+    group_pending.setdefault(id, []).append((name, message, token))
+    async def job():
+        for sender, content, count in group_pending.pop(id, []):
+            conversation.add_rich_message(content, "user", count, sender)
+        # 共享会话中的消息属于所有群成员，取消时不撤回
+        await answer(matcher, client, conversation, id, None)
+    await schedule(matcher, id, conversation.model, job, supersede=False)
+
+async def answer(matcher: type[Matcher], client: AIClientProtocol, conversation: Conversation, id: str, msg: StoredMessage | None, key: bytes | None = None):
+    """
+    回复会话中的最新消息。请求被取消时撤回指定消息及其之后的消息，之后在后台总结被移除的消息。
+    
+    :param matcher: 当前指令的匹配器。
+    :param client: 实现了AIClientProtocol的客户端实例。
+    :param conversation: 当前会话。
+    :param id: 会话所有者ID。
+    :param msg: 取消时撤回的消息，为None时不撤回。
+    :param key: 回复缓存键。
+    """
+    try:
+        await reply(matcher, conversation, id, key)
+    except asyncio.CancelledError:
+        if msg is not None:
+            conversation.rollback(msg)
+        raise
+    finally:
+        # 回复发送之后在后台总结被移除的消息
+        if conversation.needs_compaction():
+            task = asyncio.create_task(compact(client, conversation, id))
+            compact_tasks.add(task)
+            task.add_done_callback(compact_tasks.discard)
+
+async def compact(client: AIClientProtocol, conversation: Conversation, id: str):
+    """
+    总结会话中被移除的消息，完成后重新统计用户的内存占用。
+    
+    :param client: 会话使用的客户端。
+    :param conversation: 会话。
+    :param id: 用户ID。
+    """
+    try:
+        # 替换摘要时持有用户的调度锁，不与该用户正在进行的对话交错
+        if not await compactor.compact(client, conversation, scheduler.locked(id)):
+            return
+    except Exception as e:
+        logger.error(f"总结会话失败: {e}")
+        return
+    # 总结期间用户可能已被卸载，此时不再修改其记录
+    if any(current is conversation for current in conversation_manager.conversations.get(id, ())):
+        conversation_manager.update_usage(id)
+
+async def schedule(matcher: type[Matcher], id: str, model: str, job, supersede: bool | None = None):
+    """
+    通过调度器执行请求。被同一用户的新请求取代时不再单独回复，其消息由新请求一并加入会话。
+    
+    :param matcher: 当前指令的匹配器。
+    :param id: 用户ID。
+    :param model: 模型名称。
+    :param job: 请求的执行函数。
+    :param supersede: 是否取消正在执行的请求，为None时使用配置。
+    """
+    # 请求执行期间用户的会话不会被淘汰
+    with conversation_manager.pin(id):
+        try:
+            # 总耗时包含排队等待的时间
+            with stage("total", model):
+                await scheduler.submit(id, client_manager.get_provider_with_model(model) or "", job, supersede)
+        except RequestSuperseded:
+            logger.info(f"用户 {id} 的请求已被新的请求取代，消息并入新的请求")
+            await matcher.finish()
+        finally:
+            # 会话内容已变化，重新统计内存占用
+            conversation_manager.update_usage(id)
+            # 多进程共享存储时立即写入，让其他进程看到最新的会话
+            if conversation_manager.is_shared():
+                await flush()
 
 # 默认聊天指令
 chat = command_list["Chat"]
 @chat.handle()
 async def _(event: Event, args: Message = CommandArg()):
-    id = str(event.get_user_id())
+    id = get_owner(event)
+    # 在线程池中加载用户或检查其他进程的修改，之后的访问不再读取持久化后端
+    await conversation_manager.refresh(id)
+    user = str(event.get_user_id())
     # 获取用户设置
     setting = conversation_manager.get_user_setting(id)
     model = setting.current_model if setting is not None and setting.current_model != "" else plugin_config.default_model
@@ -65,55 +552,58 @@ async def _(event: Event, args: Message = CommandArg()):
     if not isinstance(client,AIClientProtocol):
         await chat.finish(f"模型 {model} 暂未支持")
     preset = setting.preset[model] if setting is not None and model in setting.preset else ""
-    # 创建会话
-    conversation = new_chat(client, model, preset)
-    conversation_manager.add_conversation(id, conversation)
-    message = process_message(args)
-    conversation.add_rich_message(message, "user", get_message_token(client,Messages.user_message(content=message)), id)
-    # 处理消息
-    try:
-    # 获取返回消息
-        result = chat_completion(client, conversation.get_conversation(), model)
-    except Exception as e:
-    # 处理异常
-        logger.error(f"调用模型失败: {e}")
-        await chat.finish(f"调用模型失败，请截图此报错给开发者: {e}")
-    # 处理返回消息
-    respond = result.choices[0].message.content
-    token = result.usage.completion_tokens if result.usage is not None else 0
-    if respond is None:
-        await chat.finish("模型返回空消息，请让开发者检查")
-    conversation.add_text_message(respond, "assistant", token, id)
-    await chat.finish(respond)
+    if id != user:
+        # 群聊共享会话：新会话立即替换群聊的当前会话
+        with conversation_manager.pin(id):
+            conversation = await new_chat(client, model, preset)
+            conversation.compact = plugin_config.compact.enable
+            conversation_manager.add_conversation(id, conversation)
+            await run_group_turn(chat, client, conversation, id, user, args)
+        return
+    async def job():
+        with take_pending(id) as pending:
+            # 消息已由之前的请求一并回复
+            if len(pending) == 0:
+                return
+            # 创建会话
+            conversation = await new_chat(client, model, preset)
+            conversation.compact = plugin_config.compact.enable
+            conversation_manager.add_conversation(id, conversation)
+            await run_turn(chat, client, conversation, id, pending, fresh=True)
+    user_pending.setdefault(id, []).append(args)
+    await schedule(chat, id, model, job)
     
 # 继续聊天指令
 continue_chat = command_list["Chat.Continue"]
 @continue_chat.handle()
 async def _(event: Event, args: Message = CommandArg()):
-    id = str(event.get_user_id())
-    conversation = conversation_manager.current_conversation(id)
-    if conversation is None:
+    id = get_owner(event)
+    await conversation_manager.refresh(id)
+    user = str(event.get_user_id())
+    current = conversation_manager.current_conversation(id)
+    if current is None:
         await continue_chat.finish("未找到上次的会话，请先使用指令开始新的会话")
-    client = client_manager.get_client_with_model(conversation.model)
-    if not isinstance(client,AIClientProtocol):
-        await continue_chat.finish(f"模型 {conversation.model} 暂未支持")
-    message = process_message(args)
-    conversation.add_rich_message(message, "user", get_message_token(client,Messages.user_message(content=message)), id)
-    # 处理消息
-    try:
-        # 获取返回消息
-        result = chat_completion(client, conversation.get_conversation(), conversation.model)
-    except Exception as e:
-        # 处理异常
-        logger.error(f"调用模型失败: {e}")
-        await continue_chat.finish(f"调用模型失败，请截图此报错给开发者: {e}")
-    # 处理返回消息
-    respond = result.choices[0].message.content
-    token = result.usage.completion_tokens if result.usage is not None else 0
-    if respond is None:
-        await continue_chat.finish("模型返回空消息，请让开发者检查")
-    conversation.add_text_message(respond, "assistant", token, id)
-    await continue_chat.finish(respond)
+    model = current.model
+    if id != user:
+        client = client_manager.get_client_with_model(model)
+        if not isinstance(client,AIClientProtocol):
+            await continue_chat.finish(f"模型 {model} 暂未支持")
+        # 消息在排队期间加入的会话不会被淘汰
+        with conversation_manager.pin(id):
+            await run_group_turn(continue_chat, client, current, id, user, args)
+        return
+    async def job():
+        with take_pending(id) as pending:
+            if len(pending) == 0:
+                return
+            # 排队期间会话可能已变化，执行时重新获取
+            conversation = conversation_manager.current_conversation(id) or current
+            client = client_manager.get_client_with_model(conversation.model)
+            if not isinstance(client,AIClientProtocol):
+                await continue_chat.finish(f"模型 {conversation.model} 暂未支持")
+            await run_turn(continue_chat, client, conversation, id, pending)
+    user_pending.setdefault(id, []).append(args)
+    await schedule(continue_chat, id, model, job)
     
 model_chat = command_list["Chat.Model"]
 @model_chat.handle()
@@ -123,10 +613,11 @@ async def _(event: Event, args: Message = CommandArg()):
     
     :param args: 消息对象。
     """
-    id = str(event.get_user_id())
+    id = get_owner(event)
+    await conversation_manager.refresh(id)
     # 获取用户设置
     model = args.extract_plain_text().strip()
-    if model not in client_manager.all_models:
+    if client_manager.get_client_with_model(model) is None:
         await model_chat.finish(f"未找到 {model} 模型")
     conversation_manager.change_model(id, model)
     await model_chat.finish(f"默认使用模型修改为 {model}")
@@ -139,10 +630,31 @@ async def _(event: Event, args: Message = CommandArg()):
     
     :param args: 消息对象。
     """
-    id = str(event.get_user_id())
+    id = get_owner(event)
+    await conversation_manager.refresh(id)
     # 获取用户设置
     preset = args.extract_plain_text().strip()
     setting = conversation_manager.get_user_setting(id)
     model = setting.current_model if setting is not None else plugin_config.default_model
     conversation_manager.change_preset(id, model, preset)
-    await model_chat.finish(f"修改{model}的默认系统消息为 {preset}")
\ No newline at end of file
+    await model_chat.finish(f"修改{model}的默认系统消息为 {preset}")
+
+# 旧配置中没有路由策略子命令时不注册该指令，所有用户使用默认策略
+route_chat = command_list.get("Chat.Route")
+if route_chat is None:
+    logger.warning("CHAT__COMMANDS中没有配置Chat.Route子命令，路由策略指令不可用")
+else:
+    @route_chat.handle()
+    async def _(matcher: Matcher, event: Event, args: Message = CommandArg()):
+        """
+        设置路由策略指令。
+
+        :param args: 消息对象。
+        """
+        id = get_owner(event)
+        await conversation_manager.refresh(id)
+        policy = args.extract_plain_text().strip()
+        if policy not in POLICIES:
+            await matcher.finish(f"未知的路由策略 {policy}，可用的策略有：{', '.join(POLICIES)}")
+        conversation_manager.change_route_policy(id, policy)
+        await matcher.finish(f"路由策略修改为 {policy}")
@@ -0,0 +1,133 @@
+import hashlib
+from collections import OrderedDict
+from contextlib import AbstractAsyncContextManager, nullcontext
+from typing import Any, List
+
+from .chat import Conversation, Messages, StoredMessage
+from .AI import AIClientProtocol, ClientManager, chat_completion, get_message_texts, get_messages_token
+
+# 摘要消息的前缀，使模型能区分摘要和预设
+SUMMARY_PREFIX = "以下是之前对话的摘要：\n"
+
+class SummaryCache():
+    """
+    SummaryCache类以总结输入的哈希为键缓存摘要，相同的历史不会被重复总结。
+
+    Attributes:
+        capacity (int): 最大缓存条目数。
+        entries (OrderedDict[bytes, str]): 输入哈希到摘要文本的映射。
+    """
+    capacity: int
+    entries: OrderedDict[bytes, str]
+
+    def __init__(self, capacity: int = 1024):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+
+    @staticmethod
+    def key(model: str, text: str) -> bytes:
+        return hashlib.blake2b(f"{model}\0{text}".encode("utf-8"), digest_size=16).digest()
+
+    def get(self, model: str, text: str) -> str | None:
+        key = self.key(model, text)
+        summary = self.entries.get(key)
+        if summary is not None:
+            self.entries.move_to_end(key)
+        return summary
+
+    def put(self, model: str, text: str, summary: str):
+        if self.capacity <= 0:
+            return
+        key = self.key(model, text)
+        self.entries[key] = summary
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+def render_history(summary: StoredMessage | None, messages: List[StoredMessage]) -> str:
+    """
+    把旧摘要和被移除的消息转换为总结模型的输入文本，图片等非文本内容被省略。
+
+    :param summary: 旧摘要消息。
+    :param messages: 被移除的消息。
+    :return: 输入文本。
+    """
+    lines: List[str] = []
+    if summary is not None:
+        lines.append("历史摘要：" + "".join(get_message_texts(summary)).removeprefix(SUMMARY_PREFIX))
+    lines.append("对话：")
+    for message in messages:
+        lines.append(f"{message.role}: {''.join(get_message_texts(message))}")
+    return "\n".join(lines)
+
+class Compactor():
+    """
+    Compactor类把会话中被移除的消息连同旧摘要总结为一条新的摘要。
+    总结在回复发送之后于后台执行，可以使用比会话更便宜的模型。
+    """
+    client_manager: ClientManager
+    model: str
+    prompt: str
+    cache: SummaryCache
+
+    def __init__(self, client_manager: ClientManager, model: str, prompt: str, cache_size: int = 1024):
+        """
+        初始化Compactor实例。
+
+        :param client_manager: 客户端管理器，用于查找总结模型。
+        :param model: 总结模型，为空时使用会话自身的模型。
+        :param prompt: 总结时使用的系统消息。
+        :param cache_size: 摘要缓存的最大条目数。
+        """
+        self.client_manager = client_manager
+        self.model = model
+        self.prompt = prompt
+        self.cache = SummaryCache(cache_size)
+
+    async def summarize(self, model: str, text: str) -> str:
+        """
+        总结文本，已缓存时直接返回。
+
+        :param model: 总结模型。
+        :param text: 输入文本。
+        :return: 摘要文本。
+        """
+        summary = self.cache.get(model, text)
+        if summary is not None:
+            return summary
+        client = self.client_manager.get_client_with_model(model)
+        if not isinstance(client, AIClientProtocol):
+            raise ValueError(f"总结模型 {model} 暂未支持")
+        result = await chat_completion(client, [Messages.system_message(self.prompt), Messages.user_message(text)], model)
+        self.client_manager.record_usage(model, result.usage)
+        summary = (result.choices[0].message.content or "").strip()
+        if summary == "":
+            raise ValueError("总结模型返回空消息")
+        self.cache.put(model, text, summary)
+        return summary
+
+    async def compact(self, client: AIClientProtocol, conversation: Conversation, lock: AbstractAsyncContextManager[Any] | None = None) -> bool:
+        """
+        总结会话中等待压缩的消息，并把摘要固定在预设之后。
+        同一会话同时只进行一次总结，总结期间新移除的消息留到下次。
+        总结请求不持有锁，只有替换摘要时持有lock，避免与正在进行的对话交错修改会话。
+
+        :param client: 会话使用的客户端，用于计算摘要的令牌数。
+        :param conversation: 会话。
+        :param lock: 修改会话时持有的锁，为None时不加锁。
+        :return: 是否更新了摘要。
+        """
+        if not conversation.needs_compaction():
+            return False
+        conversation.compacting = True
+        try:
+            consumed = len(conversation.evicted)
+            text = render_history(conversation.summary, conversation.evicted[:consumed])
+            summary = await self.summarize(self.model or conversation.model, text)
+            message = Messages.system_message(SUMMARY_PREFIX + summary)
+            token = (await get_messages_token(client, [message]))[0]
+            async with lock or nullcontext():
+                conversation.set_summary(message, token, consumed)
+            return True
+        finally:
+            conversation.compacting = False
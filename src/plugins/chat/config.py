@@ -12,6 +12,17 @@ class ModelData:
     Attributes:
         models (List[str]): 可用模型列表。
         base_url (str): 基础URL。
+        max_concurrency (int): 该提供商同时执行的最大请求数。
+        evict_ratio (float): 会话超过最大令牌数时一次移除的比例，大于0时前缀在多轮之间保持不变，
+            可以命中提供者的前缀缓存；0表示每次只移除最旧的消息。
+        timeout (float): 单次请求的超时时间（秒），0表示只使用HTTP连接池的超时。
+        retries (int): 请求失败后在同一模型上重试的次数。
+        extra (dict[str, str]): 提供商相关的额外配置：
+            tokenizer_dir: 分词器目录，DeepSeek必须配置，其他提供商未配置时按字符数估计令牌数。
+            tokenizer_backend: 分词器后端，transformers（默认）或tokenizers（直接加载tokenizer.json）。
+            approximate_below: 会话令牌数低于最大令牌数的该比例时按字符数估计令牌数，默认0表示总是精确计算。
+            ascii_ratio、other_ratio: 每个ASCII字符和其他字符的估计令牌数，默认0.3和0.6。
+            approximate_margin: 估计值的安全系数，默认1.2。
     """
     models: List[str] = dataclasses.field(default_factory=lambda: [])
     preset: List[str] = dataclasses.field(default_factory=lambda: [])
@@ -19,6 +30,179 @@ class ModelData:
     max_input_tokens: List[int] = dataclasses.field(default_factory=lambda: [])
     max_output_tokens: List[int] = dataclasses.field(default_factory=lambda: [])
     extra: dict[str,str] = dataclasses.field(default_factory=lambda: {})
+    max_concurrency: int = 8
+    evict_ratio: float = 0.0
+    timeout: float = 0.0
+    retries: int = 0
+
+@dataclass
+class HttpData:
+    """
+    HTTP连接池配置类，所有模型客户端共享同一个连接池。
+
+    Attributes:
+        max_connections (int): 最大并发连接数。
+        max_keepalive_connections (int): 最大保持的空闲连接数。
+        keepalive_expiry (float): 空闲连接的保持时间（秒）。
+        timeout (float): 请求超时时间（秒）。
+    """
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    timeout: float = 120.0
+
+@dataclass
+class StreamData:
+    """
+    流式回复配置类。
+
+    Attributes:
+        enable (bool): 是否启用流式回复。
+        min_chunk_size (int): 每个片段的最小字符数，达到后在句子或段落边界处发送。
+        max_chunk_size (int): 每个片段的最大字符数，超过后直接发送。
+        flush_interval (float): 两次发送之间的最大时间间隔（秒），超过后在边界处发送。
+    """
+    enable: bool = False
+    min_chunk_size: int = 80
+    max_chunk_size: int = 500
+    flush_interval: float = 3.0
+
+@dataclass
+class SchedulerData:
+    """
+    请求调度配置类。
+
+    Attributes:
+        supersede (bool): 新请求是否取消同一用户正在执行的请求，被取消的请求的消息并入新请求。
+    """
+    supersede: bool = False
+
+@dataclass
+class CompactData:
+    """
+    会话压缩配置类。
+
+    Attributes:
+        enable (bool): 是否把超出最大令牌数而被移除的消息总结为摘要。
+        model (str): 用于总结的模型，应选择较便宜的模型，为空时使用会话自身的模型。
+        prompt (str): 总结时使用的系统消息。
+        cache_size (int): 摘要缓存的最大条目数。
+    """
+    enable: bool = False
+    model: str = ""
+    prompt: str = "你是对话摘要助手。请把给出的历史摘要和对话合并为一段简洁的摘要，保留用户的需求、关键事实和结论，不超过300字，只输出摘要。"
+    cache_size: int = 1024
+
+@dataclass
+class ResponseCacheData:
+    """
+    回复缓存配置类。只缓存没有历史的新会话中纯文本提示的回复。
+
+    Attributes:
+        enable (bool): 是否启用回复缓存。
+        ttl (float): 缓存条目的有效时间（秒）。
+        max_bytes (int): 回复缓存的字节预算。
+    """
+    enable: bool = False
+    ttl: float = 3600
+    max_bytes: int = 16 * 1024 * 1024
+
+@dataclass
+class RouterData:
+    """
+    模型路由配置类。
+
+    Attributes:
+        policy (str): 默认路由策略：fixed只使用选择的模型，fallback失败时使用备用模型，fastest优先使用最快的健康模型。
+        fallbacks (dict[str, List[str]]): 每个模型的备用模型列表。
+        hedge (bool): 主请求超过其p95耗时仍未完成时，是否向备用模型发出对冲请求。
+        hedge_min_delay (float): 对冲请求的最短等待时间（秒）。
+        error_threshold (float): 失败率的移动平均超过该值的模型进入冷却。
+        cooldown (float): 冷却时间（秒），冷却中的模型排在备用模型之后。
+    """
+    policy: str = "fallback"
+    fallbacks: dict[str, List[str]] = dataclasses.field(default_factory=lambda: {})
+    hedge: bool = False
+    hedge_min_delay: float = 1.0
+    error_threshold: float = 0.5
+    cooldown: float = 30.0
+
+@dataclass
+class GroupData:
+    """
+    群聊共享会话配置类。
+
+    Attributes:
+        enable (bool): 是否让群聊或频道中的所有成员共享会话和设置。
+            开启后消息以发送者的用户ID作为name字段加入共享会话，
+            回复进行中时到达的消息合并为一次请求，使用共享的历史一起回复。
+    """
+    enable: bool = False
+
+@dataclass
+class MemoryData:
+    """
+    会话内存配置类。
+
+    Attributes:
+        max_bytes (int): 所有会话的内存预算（字节），0表示不限制。
+        idle_ttl (float): 用户未活跃多久后移除其会话和设置（秒），0表示不移除。
+        max_conversations (int): 每个用户保留的最大会话数。
+    """
+    max_bytes: int = 256 * 1024 * 1024
+    idle_ttl: float = 7 * 24 * 3600
+    max_conversations: int = 10
+
+@dataclass
+class StorageData:
+    """
+    会话持久化配置类。
+
+    Attributes:
+        backend (str): 持久化后端，为空时不持久化，"log"为msgpack追加日志，
+            "sqlite"为可被多个进程共享的SQLite数据库。
+        path (str): 存储目录。
+        flush_interval (float): 批量写入的时间间隔（秒）。
+    """
+    backend: str = ""
+    path: str = "../data/chat"
+    flush_interval: float = 5.0
+
+@dataclass
+class ImageData:
+    """
+    图片消息配置类。
+
+    Attributes:
+        max_images (int): 每条消息最多处理的图片数。
+        max_bytes (int): 每张图片的最大字节数。
+        timeout (float): 每张图片下载的最长时间（秒）。
+        cache_dir (str): 图片缓存的存储目录。
+        cache_memory_bytes (int): 图片缓存内存层的字节预算。
+        cache_disk_bytes (int): 图片缓存磁盘层的字节预算。
+        cleanup_interval (float): 清理无引用缓存文件的时间间隔（秒）。
+    """
+    max_images: int = 4
+    max_bytes: int = 10 * 1024 * 1024
+    timeout: float = 20.0
+    cache_dir: str = "files/media"
+    cache_memory_bytes: int = 64 * 1024 * 1024
+    cache_disk_bytes: int = 512 * 1024 * 1024
+    cleanup_interval: float = 3600
+
+@dataclass
+class MetricsData:
+    """
+    性能指标配置类。
+
+    Attributes:
+        enable (bool): 是否在FastAPI驱动器上提供指标接口，接口与机器人监听在同一地址上，默认关闭。
+        path (str): 指标接口的路径，输出Prometheus文本格式。
+        token (str): 访问令牌，非空时请求需携带Authorization: Bearer <token>请求头。
+    """
+    enable: bool = False
+    path: str = "/metrics"
+    token: str = ""
 
 @dataclass
 class KeyData:
@@ -27,8 +211,22 @@ class KeyData:
 
     Attributes:
         key (str): 密钥。
+        keys (List[str]): 额外的密钥，请求会在所有密钥之间分配。
+        rpm (int): 每个密钥每分钟的请求数上限，0表示不限制。
+        tpm (int): 每个密钥每分钟的令牌数上限，0表示不限制。
     """
     key: str = ""
+    keys: List[str] = dataclasses.field(default_factory=lambda: [])
+    rpm: int = 0
+    tpm: int = 0
+
+    def get_keys(self) -> List[str]:
+        """
+        获取所有非空密钥。
+
+        :return: 密钥列表。
+        """
+        return [key for key in [self.key] + self.keys if key != ""]
 
 class ChatConfig(DConfig):
     """
@@ -37,11 +235,35 @@ class ChatConfig(DConfig):
     Attributes:
         model (dict[str, ModelData]): 模型列表，键为模型名称，值为ModelData对象。
         key (dict[str, KeyData]): 密钥列表，键为密钥名称，值为KeyData对象。
-        preset (str): 预设配置。
+        default_model (str): 默认模型。
+        http (HttpData): HTTP连接池配置。
+        stream (StreamData): 流式回复配置。
+        scheduler (SchedulerData): 请求调度配置。
+        token_cache_size (int): 每个客户端令牌数缓存的最大条目数。
+        memory (MemoryData): 会话内存配置。
+        storage (StorageData): 会话持久化配置。
+        image (ImageData): 图片消息配置。
+        metrics (MetricsData): 性能指标配置。
+        compact (CompactData): 会话压缩配置。
+        response_cache (ResponseCacheData): 回复缓存配置。
+        router (RouterData): 模型路由配置。
+        group (GroupData): 群聊共享会话配置。
     """
     model: dict[str, ModelData] = {}
     key: dict[str, KeyData] = {}
     default_model: str = ""
+    http: HttpData = HttpData()
+    stream: StreamData = StreamData()
+    scheduler: SchedulerData = SchedulerData()
+    token_cache_size: int = 4096
+    memory: MemoryData = MemoryData()
+    storage: StorageData = StorageData()
+    image: ImageData = ImageData()
+    metrics: MetricsData = MetricsData()
+    compact: CompactData = CompactData()
+    response_cache: ResponseCacheData = ResponseCacheData()
+    router: RouterData = RouterData()
+    group: GroupData = GroupData()
 
 class Config(BaseModel):
     chat: ChatConfig
\ No newline at end of file
@@ -0,0 +1,230 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Iterable, List, TypeVar
+from openai import AsyncOpenAI, RateLimitError
+from openai.types.chat import ChatCompletionMessageParam
+
+T = TypeVar("T")
+
+class TokenBucket():
+    """
+    令牌桶，按每分钟的额度匀速补充。额度为0时表示不限制。
+    允许结算时出现负数余额，之后的请求会等待余额补足。
+    """
+    capacity: float
+    rate: float
+    tokens: float
+    updated: float
+
+    def __init__(self, per_minute: int):
+        """
+        初始化TokenBucket实例。
+
+        :param per_minute: 每分钟的额度，0表示不限制。
+        """
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, factor: float = 1.0):
+        """
+        按经过的时间补充令牌。
+
+        :param factor: 补充速率的缩放系数。
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate * factor)
+        self.updated = now
+
+    def wait_time(self, amount: float, factor: float = 1.0) -> float:
+        """
+        计算获取指定数量的令牌需要等待的时间。
+
+        :param amount: 需要的令牌数。
+        :param factor: 补充速率的缩放系数。
+        :return: 等待时间（秒），0表示可以立即获取。
+        """
+        if self.capacity <= 0:
+            return 0
+        self.refill(factor)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0
+        return (amount - self.tokens) / (self.rate * factor)
+
+    def consume(self, amount: float):
+        """
+        扣除令牌，不检查余额。
+
+        :param amount: 扣除的令牌数，负数表示退还。
+        """
+        if self.capacity <= 0:
+            return
+        self.tokens = min(self.capacity, self.tokens - min(amount, self.capacity))
+
+class KeySlot():
+    """
+    单个API密钥及其限流状态。
+
+    Attributes:
+        key (str): API密钥。
+        client (AsyncOpenAI): 使用该密钥的客户端。
+        requests (TokenBucket): 每分钟请求数的令牌桶。
+        tokens (TokenBucket): 每分钟令牌数的令牌桶。
+        factor (float): 自适应的速率系数，遇到429时减半，成功时逐步恢复。
+        cooldown_until (float): 冷却结束的时间。
+        failures (int): 连续遇到429的次数。
+    """
+    key: str
+    client: AsyncOpenAI
+    requests: TokenBucket
+    tokens: TokenBucket
+    factor: float
+    cooldown_until: float
+    failures: int
+
+    def __init__(self, key: str, client: AsyncOpenAI, rpm: int = 0, tpm: int = 0):
+        self.key = key
+        self.client = client
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.factor = 1.0
+        self.cooldown_until = 0.0
+        self.failures = 0
+
+    def wait_time(self, estimate: int) -> float:
+        """
+        计算该密钥可以发送请求前需要等待的时间。
+
+        :param estimate: 请求预计消耗的令牌数。
+        :return: 等待时间（秒）。
+        """
+        return max(
+            self.cooldown_until - time.monotonic(),
+            self.requests.wait_time(1, self.factor),
+            self.tokens.wait_time(estimate, self.factor),
+            0
+        )
+
+class KeyPool():
+    """
+    KeyPool类用于在多个API密钥之间分配请求。
+    每个密钥都有独立的请求数和令牌数令牌桶，请求总是分配给最快可用的密钥；
+    遇到429时该密钥进入指数退避冷却，并换用其他密钥重试。
+    """
+    slots: List[KeySlot]
+    max_attempts: int
+    base_backoff: float
+    max_backoff: float
+
+    def __init__(self, slots: List[KeySlot], max_attempts: int = 3, base_backoff: float = 1.0, max_backoff: float = 60.0):
+        """
+        初始化KeyPool实例。
+
+        :param slots: 密钥列表。
+        :param max_attempts: 遇到429时的最大尝试次数。
+        :param base_backoff: 第一次遇到429时的冷却时间（秒）。
+        :param max_backoff: 最长冷却时间（秒）。
+        """
+        if len(slots) == 0:
+            raise ValueError("至少需要一个API密钥")
+        self.slots = slots
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+    async def acquire(self, estimate: int) -> KeySlot:
+        """
+        等待并获取一个可用的密钥，同时扣除请求数和预计的令牌数。
+
+        :param estimate: 请求预计消耗的令牌数。
+        :return: 可用的密钥。
+        """
+        while True:
+            waits = [(slot.wait_time(estimate), index) for index, slot in enumerate(self.slots)]
+            wait, index = min(waits)
+            if wait <= 0:
+                slot = self.slots[index]
+                slot.requests.consume(1)
+                slot.tokens.consume(estimate)
+                return slot
+            await asyncio.sleep(wait)
+
+    def rate_limited(self, slot: KeySlot, retry_after: float | None = None):
+        """
+        记录密钥遇到429，降低速率系数并进入冷却。
+
+        :param slot: 遇到429的密钥。
+        :param retry_after: 服务端返回的重试等待时间（秒）。
+        """
+        slot.failures += 1
+        slot.factor = max(slot.factor / 2, 0.1)
+        backoff = min(self.base_backoff * 2 ** (slot.failures - 1), self.max_backoff)
+        slot.cooldown_until = time.monotonic() + max(backoff, retry_after or 0)
+
+    def settle(self, slot: KeySlot, estimate: int, actual: int):
+        """
+        请求完成后按实际用量结算令牌数，并逐步恢复速率系数。
+
+        :param slot: 使用的密钥。
+        :param estimate: 请求前预计的令牌数。
+        :param actual: 实际消耗的令牌数。
+        """
+        slot.tokens.consume(actual - estimate)
+        slot.failures = 0
+        slot.factor = min(slot.factor + 0.1, 1.0)
+
+    async def request(self, estimate: int, call: Callable[[AsyncOpenAI], Awaitable[T]]) -> tuple[KeySlot, T]:
+        """
+        使用可用的密钥发送请求，遇到429时换用其他密钥重试。
+
+        :param estimate: 请求预计消耗的令牌数。
+        :param call: 使用客户端发送请求的函数。
+        :return: 使用的密钥和请求结果，调用方需在获得实际用量后调用settle结算。
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            slot = await self.acquire(estimate)
+            try:
+                return slot, await call(slot.client)
+            except RateLimitError as e:
+                slot.tokens.consume(-estimate)
+                self.rate_limited(slot, get_retry_after(e))
+                if attempt >= self.max_attempts:
+                    raise
+            except BaseException:
+                # 其他错误不消耗令牌额度
+                slot.tokens.consume(-estimate)
+                raise
+
+def get_retry_after(error: RateLimitError) -> float | None:
+    """
+    从429响应中读取Retry-After头。
+
+    :param error: 429异常。
+    :return: 重试等待时间（秒），没有时返回None。
+    """
+    try:
+        return float(error.response.headers.get("retry-after", ""))
+    except ValueError:
+        return None
+
+def estimate_tokens(messages: Iterable[ChatCompletionMessageParam]) -> int:
+    """
+    粗略估计消息的令牌数，用于限流时预扣额度，请求完成后会按实际用量结算。
+
+    :param messages: 消息列表。
+    :return: 估计的令牌数。
+    """
+    total = 0
+    for message in messages:
+        content = message.get("content")
+        match content:
+            case str():
+                total += len(content)
+            case list():
+                for part in content:
+                    total += len(part.get("text") or "")
+    return total
@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import sys
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from util.metrics import registry, Counter
+
+class CachedResponse():
+    """
+    缓存的模型回复。
+
+    Attributes:
+        content (str): 回复内容。
+        token (int): 回复的令牌数。
+        expires (float): 过期时间（time.monotonic）。
+        size (int): 估计占用的字节数。
+    """
+    __slots__ = ("content", "token", "expires", "size")
+    content: str
+    token: int
+    expires: float
+    size: int
+
+    def __init__(self, content: str, token: int, expires: float):
+        self.content = content
+        self.token = token
+        self.expires = expires
+        self.size = sys.getsizeof(content) + 64
+
+def response_key(model: str, preset: str, message: str) -> bytes:
+    """
+    计算回复缓存的键。用户消息去除首尾空白并合并连续空白后参与哈希。
+
+    :param model: 模型名称。
+    :param preset: 预设消息内容。
+    :param message: 用户消息的文本。
+    :return: 缓存键。
+    """
+    preset_hash = hashlib.blake2b(preset.encode("utf-8"), digest_size=16).hexdigest()
+    normalized = " ".join(message.split())
+    return hashlib.blake2b(f"{model}\0{preset_hash}\0{normalized}".encode("utf-8"), digest_size=16).digest()
+
+class ResponseCache():
+    """
+    ResponseCache类缓存没有历史的新会话对相同提示的回复。
+    条目超过TTL后失效，总字节数超过预算时按LRU淘汰。
+    同一个键的并发请求只向提供者发出一次，其他请求等待其结果；
+    该请求失败或被取消时，等待的请求各自重新请求。
+    """
+    ttl: float
+    max_bytes: int
+    entries: OrderedDict[bytes, CachedResponse]
+    total_bytes: int
+    inflight: dict[bytes, asyncio.Future]
+    hits: int
+    misses: int
+    coalesced: int
+    requests: Counter
+
+    def __init__(self, ttl: float = 3600, max_bytes: int = 16 * 1024 * 1024):
+        """
+        初始化ResponseCache实例。
+
+        :param ttl: 条目的有效时间（秒）。
+        :param max_bytes: 缓存的字节预算。
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.requests = registry.counter("chat_response_cache_total", "回复缓存的查询次数", ("result",))
+
+    def lookup(self, key: bytes) -> CachedResponse | None:
+        """
+        查找未过期的条目，过期的条目被删除。
+
+        :param key: 缓存键。
+        :return: 缓存的回复或None。
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires <= time.monotonic():
+            self.remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def remove(self, key: bytes):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+
+    def put(self, key: bytes, content: str, token: int) -> CachedResponse:
+        """
+        写入条目，超出预算时淘汰最久未使用的条目。
+
+        :param key: 缓存键。
+        :param content: 回复内容。
+        :param token: 回复的令牌数。
+        :return: 写入的条目。
+        """
+        self.remove(key)
+        entry = CachedResponse(content, token, time.monotonic() + self.ttl)
+        self.entries[key] = entry
+        self.total_bytes += entry.size
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= evicted.size
+        return entry
+
+    def record(self, result: str):
+        self.requests.inc((result,))
+
+    async def get(self, key: bytes, fetch: Callable[[], Awaitable[tuple[str, int, bool] | None]]) -> CachedResponse | None:
+        """
+        获取键对应的回复，未缓存时调用fetch请求提供者。
+
+        :param key: 缓存键。
+        :param fetch: 请求函数，返回回复内容、令牌数和是否写入缓存，回复为空时返回None。
+            不写入缓存的回复仍会交给正在等待的相同请求。
+        :return: 回复，提供者返回空消息时为None。
+        """
+        while True:
+            entry = self.lookup(key)
+            if entry is not None:
+                self.hits += 1
+                self.record("hit")
+                return entry
+            future = self.inflight.get(key)
+            if future is None:
+                break
+            entry = await asyncio.shield(future)
+            if entry is not None:
+                self.coalesced += 1
+                self.record("coalesced")
+                return entry
+        self.misses += 1
+        self.record("miss")
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        entry = None
+        try:
+            result = await fetch()
+            if result is not None:
+                content, token, store = result
+                entry = self.put(key, content, token) if store else CachedResponse(content, token, time.monotonic())
+            return entry
+        finally:
+            # 请求失败或被取消时，等待的请求得到None后重新请求
+            del self.inflight[key]
+            future.set_result(entry)
+
+    def get_stats(self) -> dict[str, float]:
+        """
+        获取缓存的统计信息。
+
+        :return: 包含命中、合并、未命中次数、命中率和占用字节数的字典。
+        """
+        total = self.hits + self.coalesced + self.misses
+        return {
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.coalesced) / total if total > 0 else 0.0,
+            "entries": len(self.entries),
+            "bytes": self.total_bytes
+        }
@@ -0,0 +1,266 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import AsyncGenerator, Deque, List
+from openai.types.chat import ChatCompletionMessageParam, ChatCompletion, ChatCompletionChunk
+
+from .AI import ClientManager, AIClientProtocol, chat_completion, chat_completion_stream
+
+# 用户可选择的路由策略
+POLICIES = ("fixed", "fallback", "fastest")
+
+class ModelHealth():
+    """
+    单个模型的健康状况估计。
+
+    Attributes:
+        latency (float | None): 请求耗时的指数移动平均（秒），没有成功请求时为None。
+        error_rate (float): 失败率的指数移动平均。
+        samples (Deque[float]): 最近成功请求的耗时，用于计算p95。
+        cooldown_until (float): 冷却结束的时间（time.monotonic），冷却期间视为不健康。
+    """
+    __slots__ = ("latency", "error_rate", "samples", "cooldown_until")
+    latency: float | None
+    error_rate: float
+    samples: Deque[float]
+    cooldown_until: float
+
+    def __init__(self, window: int = 100):
+        self.latency = None
+        self.error_rate = 0.0
+        self.samples = deque(maxlen=window)
+        self.cooldown_until = 0.0
+
+    def p95(self) -> float | None:
+        """
+        计算最近成功请求耗时的p95，没有样本时返回None。
+        """
+        if len(self.samples) == 0:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, math.ceil(len(ordered) * 0.95) - 1)]
+
+class ModelRouter():
+    """
+    ModelRouter类在ClientManager之上为请求选择模型。
+    它为每个模型维护耗时和失败率的指数移动平均，失败率超过阈值的模型进入冷却。
+    路由策略：
+        fixed: 只使用用户选择的模型。
+        fallback: 优先使用用户选择的模型，失败时依次使用健康的备用模型。
+        fastest: 在用户选择的模型和备用模型中，优先使用平均耗时最短的健康模型。
+    开启对冲时，主请求超过其p95耗时仍未完成，会向下一个模型发出对冲请求，先完成的结果被采用，另一个请求被取消。
+    """
+    client_manager: ClientManager
+    fallbacks: dict[str, List[str]]
+    hedge: bool
+    hedge_min_delay: float
+    alpha: float
+    error_threshold: float
+    cooldown: float
+    timeouts: dict[str, float]
+    retries: dict[str, int]
+    health: dict[str, ModelHealth]
+
+    def __init__(self, client_manager: ClientManager, fallbacks: dict[str, List[str]] | None = None, hedge: bool = False, hedge_min_delay: float = 1.0, alpha: float = 0.2, error_threshold: float = 0.5, cooldown: float = 30.0):
+        """
+        初始化ModelRouter实例。
+
+        :param client_manager: 客户端管理器。
+        :param fallbacks: 每个模型的备用模型列表。
+        :param hedge: 是否发出对冲请求。
+        :param hedge_min_delay: 对冲请求的最短等待时间（秒），样本不足时使用该值。
+        :param alpha: 指数移动平均的平滑系数。
+        :param error_threshold: 失败率超过该值的模型进入冷却。
+        :param cooldown: 冷却时间（秒）。
+        """
+        self.client_manager = client_manager
+        self.fallbacks = fallbacks or {}
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.alpha = alpha
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+        self.timeouts = {}
+        self.retries = {}
+        self.health = {}
+
+    def set_limits(self, provider: str, timeout: float, retries: int):
+        """
+        设置提供者的请求超时时间和重试次数。
+
+        :param provider: 提供者名称。
+        :param timeout: 单次请求的超时时间（秒），0表示不限制。
+        :param retries: 失败后在同一模型上重试的次数。
+        """
+        self.timeouts[provider] = timeout
+        self.retries[provider] = retries
+
+    def get_health(self, model: str) -> ModelHealth:
+        health = self.health.get(model)
+        if health is None:
+            health = self.health[model] = ModelHealth()
+        return health
+
+    def record(self, model: str, latency: float | None, ok: bool):
+        """
+        记录一次请求的结果。
+
+        :param model: 模型名称。
+        :param latency: 成功请求的耗时（秒），为None时只记录成功与否。
+        :param ok: 请求是否成功。
+        """
+        health = self.get_health(model)
+        health.error_rate += self.alpha * ((0.0 if ok else 1.0) - health.error_rate)
+        if ok and latency is not None:
+            health.latency = latency if health.latency is None else health.latency + self.alpha * (latency - health.latency)
+            health.samples.append(latency)
+        if not ok and health.error_rate > self.error_threshold:
+            health.cooldown_until = time.monotonic() + self.cooldown
+            # 冷却结束后重新评估
+            health.error_rate = self.error_threshold / 2
+
+    def is_healthy(self, model: str) -> bool:
+        health = self.health.get(model)
+        return health is None or health.cooldown_until <= time.monotonic()
+
+    def candidates(self, model: str, policy: str) -> List[str]:
+        """
+        按策略生成依次尝试的模型列表。冷却中的模型排在最后，所有模型都不健康时仍会尝试。
+
+        :param model: 用户选择的模型。
+        :param policy: 路由策略。
+        :return: 模型列表。
+        """
+        if policy == "fixed":
+            return [model]
+        models = [model] + [fallback for fallback in self.fallbacks.get(model, []) if fallback != model and self.client_manager.get_client_with_model(fallback) is not None]
+        if policy == "fastest":
+            # 没有样本的模型视为与用户选择的模型同样快
+            default = self.get_health(model).latency or 0.0
+            models.sort(key=lambda candidate: self.get_health(candidate).latency or default)
+        return sorted(models, key=lambda candidate: not self.is_healthy(candidate))
+
+    def hedge_delay(self, model: str) -> float:
+        p95 = self.get_health(model).p95()
+        return max(self.hedge_min_delay, p95) if p95 is not None else self.hedge_min_delay
+
+    async def request(self, model: str, messages: List[ChatCompletionMessageParam]) -> ChatCompletion:
+        """
+        在单个模型上请求，按提供者的配置超时和重试，并记录结果。
+
+        :param model: 模型名称。
+        :param messages: 消息列表。
+        :return: 模型的响应。
+        """
+        client = self.client_manager.get_client_with_model(model)
+        if not isinstance(client, AIClientProtocol):
+            raise ValueError(f"模型 {model} 暂未支持")
+        provider = self.client_manager.get_provider_with_model(model) or ""
+        timeout = self.timeouts.get(provider, 0)
+        attempts = self.retries.get(provider, 0) + 1
+        for attempt in range(attempts):
+            start = time.monotonic()
+            try:
+                result = await asyncio.wait_for(chat_completion(client, messages, model), timeout if timeout > 0 else None)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.record(model, None, False)
+                if attempt == attempts - 1:
+                    raise
+                continue
+            self.record(model, time.monotonic() - start, True)
+            return result
+        raise RuntimeError("unreachable")
+
+    async def complete(self, model: str, messages: List[ChatCompletionMessageParam], policy: str = "fallback") -> tuple[str, ChatCompletion]:
+        """
+        按策略依次尝试候选模型，开启对冲时同时等待下一个模型的对冲请求。
+
+        :param model: 用户选择的模型。
+        :param messages: 消息列表。
+        :param policy: 路由策略。
+        :return: 实际使用的模型和响应。
+        """
+        candidates = self.candidates(model, policy)
+        errors: List[Exception] = []
+        index = 0
+        while index < len(candidates):
+            primary = candidates[index]
+            secondary = candidates[index + 1] if self.hedge and index + 1 < len(candidates) else None
+            try:
+                if secondary is None:
+                    return primary, await self.request(primary, messages)
+                return await self.hedged(primary, secondary, messages)
+            except Exception as e:
+                errors.append(e)
+            index += 2 if secondary is not None else 1
+        raise errors[-1] if len(errors) > 0 else ValueError(f"模型 {model} 暂未支持")
+
+    async def hedged(self, primary: str, secondary: str, messages: List[ChatCompletionMessageParam]) -> tuple[str, ChatCompletion]:
+        """
+        先向主模型请求，超过对冲等待时间仍未完成时向备用模型请求，采用先成功的结果并取消另一个请求。
+        主请求在等待期间失败时直接改用备用模型。
+
+        :param primary: 主模型。
+        :param secondary: 备用模型。
+        :param messages: 消息列表。
+        :return: 实际使用的模型和响应。
+        """
+        tasks = {asyncio.create_task(self.request(primary, messages)): primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay(primary))
+            if not any(task.exception() is None for task in done):
+                tasks[asyncio.create_task(self.request(secondary, messages))] = secondary
+            error: BaseException | None = None
+            pending = set(tasks)
+            while len(pending) > 0:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return tasks[task], task.result()
+                    error = task.exception()
+            raise error if error is not None else RuntimeError("unreachable")
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def stream(self, model: str, messages: List[ChatCompletionMessageParam], policy: str = "fallback") -> AsyncGenerator[tuple[str, ChatCompletionChunk], None]:
+        """
+        按策略依次尝试候选模型的流式请求。第一个片段到达之前失败时改用下一个模型，之后的失败直接抛出。
+        流式请求不对冲，只记录成功与否。
+
+        :param model: 用户选择的模型。
+        :param messages: 消息列表。
+        :param policy: 路由策略。
+        :return: 实际使用的模型和响应片段的异步迭代器。
+        """
+        error: Exception | None = None
+        for candidate in self.candidates(model, policy):
+            client = self.client_manager.get_client_with_model(candidate)
+            if not isinstance(client, AIClientProtocol):
+                continue
+            timeout = self.timeouts.get(self.client_manager.get_provider_with_model(candidate) or "", 0)
+            iterator = chat_completion_stream(client, messages, candidate)
+            try:
+                try:
+                    first = await asyncio.wait_for(iterator.__anext__(), timeout if timeout > 0 else None)
+                except StopAsyncIteration:
+                    self.record(candidate, None, True)
+                    return
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.record(candidate, None, False)
+                    error = e
+                    continue
+                self.record(candidate, None, True)
+                yield candidate, first
+                async for chunk in iterator:
+                    yield candidate, chunk
+                return
+            finally:
+                # 放弃的候选和被调用方提前结束的流都要关闭，否则连接不会归还连接池
+                await iterator.aclose()
+        raise error if error is not None else ValueError(f"模型 {model} 暂未支持")
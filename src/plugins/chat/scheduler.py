@@ -0,0 +1,140 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
+
+T = TypeVar("T")
+
+class RequestSuperseded(Exception):
+    """
+    请求被同一用户更新的请求取代时抛出的异常。
+    """
+
+class UserState():
+    """
+    单个用户的调度状态。
+
+    Attributes:
+        lock (asyncio.Lock): 保证同一用户的请求依次执行。
+        generation (int): 最新请求的序号，用于合并排队中的请求。
+        task (asyncio.Task | None): 正在执行的请求。
+        holders (int): 排队或执行中的请求和后台任务数，为0时释放用户状态。
+    """
+    lock: asyncio.Lock
+    generation: int
+    task: asyncio.Task | None
+    holders: int
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.generation = 0
+        self.task = None
+        self.holders = 0
+
+class RequestScheduler():
+    """
+    RequestScheduler类用于调度模型请求。
+    同一用户的请求依次执行，排队中的请求只保留最新的一个；
+    每个提供商同时执行的请求数受并发上限限制；
+    开启supersede时，新请求会取消同一用户正在执行的请求。
+    """
+    users: dict[str, UserState]
+    limits: dict[str, asyncio.Semaphore]
+    default_limit: int
+    supersede: bool
+
+    def __init__(self, default_limit: int = 8, supersede: bool = False):
+        """
+        初始化RequestScheduler实例。
+
+        :param default_limit: 未单独设置的提供商的并发上限。
+        :param supersede: 新请求是否取消同一用户正在执行的请求。
+        """
+        self.users = {}
+        self.limits = {}
+        self.default_limit = default_limit
+        self.supersede = supersede
+
+    def set_limit(self, provider: str, limit: int):
+        """
+        设置提供商的并发上限。
+
+        :param provider: 提供商名称。
+        :param limit: 同时执行的最大请求数。
+        """
+        self.limits[provider] = asyncio.Semaphore(max(limit, 1))
+
+    def get_limit(self, provider: str) -> asyncio.Semaphore:
+        """
+        获取提供商的并发信号量，不存在时使用默认上限创建。
+
+        :param provider: 提供商名称。
+        :return: 提供商的信号量。
+        """
+        if provider not in self.limits:
+            self.set_limit(provider, self.default_limit)
+        return self.limits[provider]
+
+    async def submit(self, user_id: str, provider: str, job: Callable[[], Awaitable[T]], supersede: bool | None = None) -> T:
+        """
+        提交一个请求并等待其完成。
+
+        :param user_id: 用户ID。
+        :param provider: 提供商名称。
+        :param job: 请求的执行函数。
+        :param supersede: 是否取消正在执行的请求，为None时使用实例的设置。
+        :return: 请求的执行结果。
+        :raises RequestSuperseded: 请求在排队或执行时被同一用户的新请求取代。
+        """
+        state = self.users.setdefault(user_id, UserState())
+        state.holders += 1
+        state.generation += 1
+        generation = state.generation
+        if (self.supersede if supersede is None else supersede) and state.task is not None:
+            state.task.cancel()
+        try:
+            async with state.lock:
+                # 排队期间有更新的请求，直接合并到新请求
+                if generation != state.generation:
+                    raise RequestSuperseded()
+                async with self.get_limit(provider):
+                    if generation != state.generation:
+                        raise RequestSuperseded()
+                    task = asyncio.ensure_future(job())
+                    state.task = task
+                    try:
+                        return await task
+                    except asyncio.CancelledError:
+                        if generation != state.generation and task.cancelled():
+                            raise RequestSuperseded() from None
+                        raise
+                    finally:
+                        state.task = None
+        finally:
+            self.release(user_id, state)
+
+    @asynccontextmanager
+    async def locked(self, user_id: str) -> AsyncIterator[None]:
+        """
+        在用户的锁内执行后台任务，与该用户的请求依次执行。
+        不改变请求序号，不会取代排队中的请求，也不占用提供商的并发额度。
+
+        :param user_id: 用户ID。
+        """
+        state = self.users.setdefault(user_id, UserState())
+        state.holders += 1
+        try:
+            async with state.lock:
+                yield
+        finally:
+            self.release(user_id, state)
+
+    def release(self, user_id: str, state: UserState):
+        """
+        请求或后台任务结束，没有其他请求或任务使用时释放用户状态。
+
+        :param user_id: 用户ID。
+        :param state: 用户状态。
+        """
+        state.holders -= 1
+        if state.holders == 0 and self.users.get(user_id) is state:
+            del self.users[user_id]
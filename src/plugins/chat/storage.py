@@ -0,0 +1,366 @@
+import os
+import sqlite3
+import struct
+import threading
+from typing import Any, Protocol, runtime_checkable
+import msgpack # type: ignore
+
+# 每条记录的长度前缀：4字节大端无符号整数
+HEADER = struct.Struct(">I")
+
+def pack(data: Any) -> bytes:
+    """
+    用msgpack序列化数据。
+
+    :param data: 可被msgpack序列化的数据。
+    :return: 序列化后的字节串。
+    """
+    body = msgpack.packb(data)
+    # packb总是返回字节串，类型标注中的None来自Packer关闭autoreset的情况
+    assert body is not None
+    return body
+
+@runtime_checkable
+class ConversationStore(Protocol):
+    """
+    ConversationStore接口定义了会话持久化后端需要实现的方法。
+    记录以用户ID为键，值为可被msgpack序列化的字典，None表示删除。
+    """
+
+    def load(self, user_id: str) -> dict[str, Any] | None:
+        ...
+
+    def write(self, records: dict[str, dict[str, Any] | None]):
+        ...
+
+    def close(self):
+        ...
+
+@runtime_checkable
+class SharedConversationStore(ConversationStore, Protocol):
+    """
+    SharedConversationStore接口定义了可被多个进程同时使用的持久化后端。
+    每条用户记录带有版本号，写入时只有版本号与读取时一致才会成功（乐观锁）。
+    """
+
+    def version(self, user_id: str) -> int:
+        ...
+
+    def load_versioned(self, user_id: str) -> tuple[dict[str, Any] | None, int]:
+        ...
+
+    def write_versioned(self, records: dict[str, tuple[dict[str, Any] | None, int]]) -> dict[str, int | None]:
+        ...
+
+class LogStore():
+    """
+    LogStore类是基于msgpack追加日志的持久化后端。
+    每次写入都把用户的完整记录追加到日志末尾，内存中只保存用户ID到日志偏移量的索引，
+    读取时按偏移量加载单个用户，因此启动时间只与用户数有关，与历史长度无关。
+    日志中的过期记录超过一定比例时，会重写日志进行压缩。
+    写入和压缩在线程池中执行并持有lock；读取在事件循环中执行，只在查找索引和读取单条记录时持有read_lock，
+    使用独立的文件句柄，不会等待写入或压缩完成。
+    """
+    path: str
+    generation: int
+    index: dict[str, tuple[int, int]]
+    end: int
+    live_bytes: int
+    writes: int
+    index_interval: int
+    compact_ratio: float
+    compact_min_bytes: int
+    lock: threading.Lock
+    read_lock: threading.Lock
+
+    def __init__(self, path: str, index_interval: int = 20, compact_ratio: float = 2.0, compact_min_bytes: int = 16 * 1024 * 1024):
+        """
+        初始化LogStore实例，加载索引并扫描索引之后追加的记录。
+
+        :param path: 存储目录。
+        :param index_interval: 每写入多少批记录保存一次索引。
+        :param compact_ratio: 日志大小超过有效数据多少倍时压缩。
+        :param compact_min_bytes: 日志小于该大小时不压缩。
+        """
+        self.path = path
+        self.index_interval = index_interval
+        self.compact_ratio = compact_ratio
+        self.compact_min_bytes = compact_min_bytes
+        self.lock = threading.Lock()
+        self.read_lock = threading.Lock()
+        self.writes = 0
+        os.makedirs(path, exist_ok=True)
+        self.generation, self.end, self.index = self.read_index()
+        self.recover()
+        self.live_bytes = sum(length for _, length in self.index.values())
+        self.file = open(self.log_path(self.generation), "a+b")
+        self.reader = open(self.log_path(self.generation), "rb", buffering=0)
+
+    def log_path(self, generation: int) -> str:
+        return os.path.join(self.path, f"conversations.{generation}.log")
+
+    def index_path(self) -> str:
+        return os.path.join(self.path, "conversations.idx")
+
+    def read_index(self) -> tuple[int, int, dict[str, tuple[int, int]]]:
+        """
+        读取索引文件。
+
+        :return: 日志代号、索引覆盖到的日志偏移量和索引。
+        """
+        try:
+            with open(self.index_path(), "rb") as file:
+                data = msgpack.unpackb(file.read())
+            return data["generation"], data["end"], {user_id: (offset, length) for user_id, (offset, length) in data["index"].items()}
+        except FileNotFoundError:
+            return 0, 0, {}
+
+    def write_index(self):
+        """
+        原子地保存索引文件。
+        """
+        temp = self.index_path() + ".tmp"
+        with open(temp, "wb") as file:
+            file.write(pack({"generation": self.generation, "end": self.end, "index": self.index}))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp, self.index_path())
+
+    def recover(self):
+        """
+        扫描索引之后追加的记录并更新索引，末尾不完整的记录会被截断。
+        """
+        log_path = self.log_path(self.generation)
+        if not os.path.exists(log_path):
+            return
+        with open(log_path, "r+b") as file:
+            file.seek(self.end)
+            offset = self.end
+            while True:
+                header = file.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                (length,) = HEADER.unpack(header)
+                body = file.read(length)
+                if len(body) < length:
+                    break
+                user_id, data = msgpack.unpackb(body)
+                self.apply(user_id, data is not None, offset, HEADER.size + length)
+                offset += HEADER.size + length
+            file.truncate(offset)
+            self.end = offset
+
+    def apply(self, user_id: str, exists: bool, offset: int, length: int):
+        """
+        更新索引中的用户记录位置。初始化之后调用方需持有read_lock。
+        """
+        if exists:
+            self.index[user_id] = (offset, length)
+        else:
+            self.index.pop(user_id, None)
+
+    def load(self, user_id: str) -> dict[str, Any] | None:
+        """
+        加载单个用户的记录。
+
+        :param user_id: 用户ID。
+        :return: 用户记录，不存在时返回None。
+        """
+        with self.read_lock:
+            entry = self.index.get(user_id)
+            if entry is None:
+                return None
+            offset, length = entry
+            self.reader.seek(offset + HEADER.size)
+            body = self.reader.read(length - HEADER.size)
+        return msgpack.unpackb(body)[1]
+
+    def write(self, records: dict[str, dict[str, Any] | None]):
+        """
+        批量追加用户记录，一次写入磁盘。
+
+        :param records: 用户记录，值为None表示删除该用户。
+        """
+        if len(records) == 0:
+            return
+        with self.lock:
+            buffer = bytearray()
+            positions: list[tuple[str, bool, int, int]] = []
+            for user_id, data in records.items():
+                body = pack([user_id, data])
+                positions.append((user_id, data is not None, self.end + len(buffer), HEADER.size + len(body)))
+                buffer += HEADER.pack(len(body)) + body
+            self.file.seek(0, os.SEEK_END)
+            self.file.write(buffer)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.end += len(buffer)
+            with self.read_lock:
+                for user_id, exists, offset, length in positions:
+                    if user_id in self.index:
+                        self.live_bytes -= self.index[user_id][1]
+                    self.apply(user_id, exists, offset, length)
+                    if exists:
+                        self.live_bytes += length
+            self.writes += 1
+            if self.end > self.compact_min_bytes and self.end > self.live_bytes * self.compact_ratio:
+                self.compact()
+            elif self.writes % self.index_interval == 0:
+                self.write_index()
+
+    def compact(self):
+        """
+        把有效记录重写到新一代日志，切换索引后删除旧日志。调用方需持有lock。
+        重写期间读取仍使用旧日志，只有切换时短暂持有read_lock。
+        """
+        generation = self.generation + 1
+        index: dict[str, tuple[int, int]] = {}
+        offset = 0
+        with open(self.log_path(generation), "wb") as file:
+            for user_id, (old_offset, length) in self.index.items():
+                self.file.seek(old_offset)
+                file.write(self.file.read(length))
+                index[user_id] = (offset, length)
+                offset += length
+            file.flush()
+            os.fsync(file.fileno())
+        self.file.close()
+        old_path = self.log_path(self.generation)
+        with self.read_lock:
+            self.generation, self.end, self.index, self.live_bytes = generation, offset, index, offset
+            self.reader.close()
+            self.reader = open(self.log_path(generation), "rb", buffering=0)
+        # 索引切换到新日志后旧日志才可以删除
+        self.write_index()
+        os.remove(old_path)
+        self.file = open(self.log_path(generation), "a+b")
+
+    def close(self):
+        """
+        保存索引并关闭日志文件。
+        """
+        with self.lock, self.read_lock:
+            self.write_index()
+            self.file.close()
+            self.reader.close()
+
+class SQLiteStore():
+    """
+    SQLiteStore类是基于SQLite WAL模式的持久化后端，可被同一台机器上的多个进程共享。
+    SQLite的文件锁保证并发写入的正确性，每条用户记录的版本号用于检测其他进程的修改。
+    删除的用户保留一条空记录，保证版本号单调递增。
+    """
+    path: str
+    connection: sqlite3.Connection
+    lock: threading.Lock
+    reader: sqlite3.Connection
+    read_lock: threading.Lock
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        """
+        初始化SQLiteStore实例。
+
+        :param path: 存储目录。
+        :param busy_timeout: 等待其他进程释放写锁的最长时间（秒）。
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = os.path.join(path, "conversations.db")
+        self.lock = threading.Lock()
+        # 写入在线程池中执行，由lock保证串行，等待其他进程的写锁时会长时间持有lock
+        self.connection = sqlite3.connect(self.path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY, version INTEGER NOT NULL, data BLOB)")
+        # 读取在事件循环中执行，使用独立的连接和锁；WAL模式下读取不会等待写入
+        self.read_lock = threading.Lock()
+        self.reader = sqlite3.connect(self.path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+
+    def version(self, user_id: str) -> int:
+        """
+        获取用户记录的版本号。
+
+        :param user_id: 用户ID。
+        :return: 版本号，记录不存在时返回0。
+        """
+        with self.read_lock:
+            row = self.reader.execute("SELECT version FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def load_versioned(self, user_id: str) -> tuple[dict[str, Any] | None, int]:
+        """
+        加载用户记录及其版本号。
+
+        :param user_id: 用户ID。
+        :return: 用户记录和版本号，记录不存在时为(None, 0)。
+        """
+        with self.read_lock:
+            row = self.reader.execute("SELECT data, version FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return None, 0
+        return (msgpack.unpackb(row[0]) if row[0] is not None else None), row[1]
+
+    def load(self, user_id: str) -> dict[str, Any] | None:
+        return self.load_versioned(user_id)[0]
+
+    def write_versioned(self, records: dict[str, tuple[dict[str, Any] | None, int]]) -> dict[str, int | None]:
+        """
+        在一个事务中按版本号写入用户记录。
+
+        :param records: 用户记录及读取时的版本号，记录为None表示删除。
+        :return: 每个用户写入后的新版本号，版本冲突时为None。
+        """
+        results: dict[str, int | None] = {}
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                for user_id, (data, version) in records.items():
+                    body = pack(data) if data is not None else None
+                    cursor = self.connection.execute("UPDATE users SET data = ?, version = version + 1 WHERE user_id = ? AND version = ?", (body, user_id, version))
+                    if cursor.rowcount == 0 and version == 0:
+                        cursor = self.connection.execute("INSERT OR IGNORE INTO users (user_id, version, data) VALUES (?, 1, ?)", (user_id, body))
+                    results[user_id] = version + 1 if cursor.rowcount > 0 else None
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        return results
+
+    def write(self, records: dict[str, dict[str, Any] | None]):
+        """
+        不检查版本号，直接覆盖用户记录。
+
+        :param records: 用户记录，值为None表示删除该用户。
+        """
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                for user_id, data in records.items():
+                    body = pack(data) if data is not None else None
+                    self.connection.execute("INSERT INTO users (user_id, version, data) VALUES (?, 1, ?) ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, version = version + 1", (user_id, body))
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        with self.lock, self.read_lock:
+            self.connection.close()
+            self.reader.close()
+
+def create_store(backend: str, path: str) -> ConversationStore | None:
+    """
+    根据配置创建持久化后端。
+
+    :param backend: 后端名称，为空时不持久化。
+    :param path: 存储目录。
+    :return: 持久化后端实例或None。
+    """
+    match backend:
+        case "":
+            return None
+        case "log":
+            return LogStore(path)
+        case "sqlite":
+            return SQLiteStore(path)
+        case _:
+            raise ValueError(f"不支持的持久化后端 {backend}")
@@ -0,0 +1,92 @@
+import re
+import time
+from typing import List
+
+# 段落分隔符优先于句子结束符
+PARAGRAPH_BREAK = "\n\n"
+# 中文标点和换行在任何位置都是句子边界；ASCII标点之后必须是空白字符，
+# 避免在小数、网址和版本号中切分。缓冲区末尾的ASCII标点要等下一段文本到达后才能判断
+SENTENCE_ENDING = re.compile(r"[。！？；…\n]|[.!?;](?=\s)")
+
+class StreamChunker():
+    """
+    StreamChunker类用于将流式回复切分为按句子或段落发送的片段。
+    缓冲区达到最小长度或距离上次发送超过时间间隔时，在最后一个句子/段落边界处切分；
+    缓冲区超过最大长度时无论是否有边界都直接切分。
+    """
+    min_size: int
+    max_size: int
+    interval: float
+    buffer: str
+    last_flush: float
+
+    def __init__(self, min_size: int, max_size: int, interval: float):
+        """
+        初始化StreamChunker实例。
+
+        :param min_size: 片段的最小字符数。
+        :param max_size: 片段的最大字符数。
+        :param interval: 两次发送之间的最大时间间隔（秒）。
+        """
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size)
+        self.interval = interval
+        self.buffer = ""
+        self.last_flush = time.monotonic()
+
+    def find_boundary(self, limit: int | None = None) -> int:
+        """
+        查找缓冲区中最后一个段落或句子边界。
+
+        :param limit: 只在前limit个字符内查找，为None时查找整个缓冲区。
+        :return: 边界之后的位置，没有边界时返回0。
+        """
+        text = self.buffer if limit is None else self.buffer[:limit]
+        index = text.rfind(PARAGRAPH_BREAK)
+        if index != -1:
+            return index + len(PARAGRAPH_BREAK)
+        boundary = 0
+        for match in SENTENCE_ENDING.finditer(text):
+            boundary = match.end()
+        return boundary
+
+    def feed(self, text: str) -> List[str]:
+        """
+        向缓冲区添加文本，并返回可以发送的片段。
+
+        :param text: 新收到的文本。
+        :return: 可以发送的片段列表。
+        """
+        self.buffer += text
+        chunks: List[str] = []
+        while len(self.buffer) >= self.max_size:
+            boundary = self.find_boundary(self.max_size)
+            if boundary == 0:
+                boundary = self.max_size
+            chunks.append(self.take(boundary))
+        timeout = time.monotonic() - self.last_flush >= self.interval
+        if len(self.buffer) >= self.min_size or timeout:
+            boundary = self.find_boundary()
+            if boundary > 0:
+                chunks.append(self.take(boundary))
+        return [chunk.strip("\n") for chunk in chunks if chunk.strip() != ""]
+
+    def take(self, length: int) -> str:
+        """
+        从缓冲区取出指定长度的文本。
+
+        :param length: 取出的字符数。
+        :return: 取出的文本。
+        """
+        chunk = self.buffer[:length]
+        self.buffer = self.buffer[length:]
+        self.last_flush = time.monotonic()
+        return chunk
+
+    def flush(self) -> str:
+        """
+        取出缓冲区中剩余的全部文本。
+
+        :return: 剩余文本。
+        """
+        return self.take(len(self.buffer))
@@ -0,0 +1,76 @@
+import hashlib
+from collections import OrderedDict
+
+class TokenCache():
+    """
+    TokenCache类用于缓存文本的令牌数，以内容哈希为键，超过容量时淘汰最久未使用的条目。
+
+    Attributes:
+        capacity (int): 最大缓存条目数，0表示不缓存。
+        hits (int): 命中次数。
+        misses (int): 未命中次数。
+    """
+    capacity: int
+    entries: OrderedDict[bytes, int]
+    hits: int
+    misses: int
+
+    def __init__(self, capacity: int = 4096):
+        """
+        初始化TokenCache实例。
+
+        :param capacity: 最大缓存条目数，0表示不缓存。
+        """
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(text: str) -> bytes:
+        """
+        计算文本的缓存键。
+
+        :param text: 文本内容。
+        :return: 文本的哈希值。
+        """
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def get(self, text: str) -> int | None:
+        """
+        获取文本的令牌数。
+
+        :param text: 文本内容。
+        :return: 令牌数，未缓存时返回None。
+        """
+        key = self.key(text)
+        token = self.entries.get(key)
+        if token is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return token
+
+    def put(self, text: str, token: int):
+        """
+        缓存文本的令牌数。
+
+        :param text: 文本内容。
+        :param token: 令牌数。
+        """
+        if self.capacity <= 0:
+            return
+        key = self.key(text)
+        self.entries[key] = token
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> dict[str, int]:
+        """
+        获取缓存的统计信息。
+
+        :return: 包含条目数、命中次数和未命中次数的字典。
+        """
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,97 @@
+import math
+import os
+from typing import List, Protocol
+
+class TokenizerBackend(Protocol):
+    """
+    TokenizerBackend接口定义了计算令牌数的分词器后端。
+    """
+
+    def count(self, text: str) -> int:
+        ...
+
+    def count_batch(self, texts: List[str]) -> List[int]:
+        ...
+
+class TransformersBackend():
+    """
+    TransformersBackend类通过transformers的AutoTokenizer计算令牌数，支持需要自定义代码的分词器。
+    导入transformers和加载模型配置较慢且占用较多内存。
+    """
+
+    def __init__(self, tokenizer_dir: str):
+        from transformers import AutoTokenizer # type: ignore
+        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_dir, trust_remote_code=True)
+
+    def count(self, text: str) -> int:
+        return len(self.tokenizer.encode(text))
+
+    def count_batch(self, texts: List[str]) -> List[int]:
+        # 优先使用底层的快速分词器一次性分词
+        backend = getattr(self.tokenizer, "backend_tokenizer", None)
+        if backend is None:
+            return [self.count(text) for text in texts]
+        return [len(encoding.ids) for encoding in backend.encode_batch(texts)]
+
+class TokenizersBackend():
+    """
+    TokenizersBackend类直接用tokenizers库加载目录中的tokenizer.json，
+    不导入transformers，启动更快，内存占用更小。
+    """
+
+    def __init__(self, tokenizer_dir: str):
+        from tokenizers import Tokenizer # type: ignore
+        self.tokenizer = Tokenizer.from_file(os.path.join(tokenizer_dir, "tokenizer.json"))
+
+    def count(self, text: str) -> int:
+        return len(self.tokenizer.encode(text).ids)
+
+    def count_batch(self, texts: List[str]) -> List[int]:
+        return [len(encoding.ids) for encoding in self.tokenizer.encode_batch(texts)]
+
+def create_tokenizer(backend: str, tokenizer_dir: str) -> TokenizerBackend:
+    """
+    根据配置创建分词器后端。
+
+    :param backend: 后端名称，transformers或tokenizers。
+    :param tokenizer_dir: 分词器目录。
+    :return: 分词器后端实例。
+    """
+    match backend:
+        case "transformers":
+            return TransformersBackend(tokenizer_dir)
+        case "tokenizers":
+            return TokenizersBackend(tokenizer_dir)
+        case _:
+            raise ValueError(f"不支持的分词器后端 {backend}")
+
+class ApproximateCounter():
+    """
+    ApproximateCounter类按字符数估计令牌数，ASCII字符和其他字符（如中文）使用不同的比例。
+    估计值乘以安全系数后向上取整，宁可高估，使会话提前而不是过晚移除消息。
+
+    Attributes:
+        ascii_ratio (float): 每个ASCII字符的令牌数。
+        other_ratio (float): 每个非ASCII字符的令牌数。
+        margin (float): 安全系数。
+    """
+    __slots__ = ("ascii_ratio", "other_ratio", "margin")
+    ascii_ratio: float
+    other_ratio: float
+    margin: float
+
+    def __init__(self, ascii_ratio: float = 0.3, other_ratio: float = 0.6, margin: float = 1.2):
+        self.ascii_ratio = ascii_ratio
+        self.other_ratio = other_ratio
+        self.margin = margin
+
+    def count(self, text: str) -> int:
+        """
+        估计文本的令牌数。
+
+        :param text: 文本内容。
+        :return: 估计的令牌数。
+        """
+        # 纯ASCII文本的UTF-8编码长度等于字符数，可以快速得到非ASCII字符数
+        other = (len(text.encode("utf-8")) - len(text)) // 2 if not text.isascii() else 0
+        return math.ceil(((len(text) - other) * self.ascii_ratio + other * self.other_ratio) * self.margin)
@@ -1,14 +1,47 @@
-from nonebot import get_plugin_config
+import asyncio
+from nonebot import get_plugin_config, get_driver, logger
+from nonebot.adapters import Bot, Event
+from nonebot.internal.matcher import Matcher
+from nonebot.message import event_preprocessor, run_postprocessor
 
 from .config import Config
-from nonebot.adapters import Bot, Event
 from util import get_metadata
-from nonebot import on, logger
+from util.tracing import EventTracer
+
+plugin_config = get_plugin_config(Config).dice
+__plugin_meta__ = get_metadata(plugin_config)
+
+tracer = EventTracer(plugin_config.trace.sample_rate, plugin_config.trace.type_rates, plugin_config.trace.buffer_size, plugin_config.trace.path)
+trace_task: asyncio.Task | None = None
 
-__plugin_meta__ = get_metadata(get_plugin_config(Config).dice)
+async def trace_loop():
+    """
+    定期写出采样到的事件记录。
+    """
+    while True:
+        await asyncio.sleep(plugin_config.trace.flush_interval)
+        try:
+            await tracer.flush()
+        except Exception as e:
+            logger.error(f"写出事件记录失败: {e}")
 
-test = on()
-@test.handle()
+@get_driver().on_startup
+async def _():
+    global trace_task
+    trace_task = asyncio.create_task(trace_loop())
+
+@get_driver().on_shutdown
+async def _():
+    if trace_task is not None:
+        trace_task.cancel()
+    await tracer.flush()
+    logger.info(f"事件统计: {tracer.get_stats()}")
+
+# 事件预处理只做计数和采样，不占用匹配器
+@event_preprocessor
 async def _(bot: Bot, event: Event):
-    logger.info("收到消息")
-    logger.info(event)
\ No newline at end of file
+    tracer.trace(bot, event)
+
+@run_postprocessor
+async def _(matcher: Matcher):
+    tracer.count_plugin(matcher.plugin_name)
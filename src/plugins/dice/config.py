@@ -1,5 +1,28 @@
 from pydantic import BaseModel
+from pydantic.dataclasses import dataclass
+import dataclasses
 from config import DefaultPluginConfig as DConfig
 
+@dataclass
+class TraceData:
+    """
+    事件追踪配置类。
+
+    Attributes:
+        sample_rate (float): 默认采样率，0表示不采样，1表示记录所有事件。
+        type_rates (dict[str, float]): 按事件类型（message、notice、request、meta_event）覆盖的采样率。
+        buffer_size (int): 环形缓冲区的容量，缓冲区满时丢弃最旧的记录。
+        flush_interval (float): 写出记录的间隔时间（秒）。
+        path (str): 记录文件路径（JSON Lines），为空时写入日志。
+    """
+    sample_rate: float = 0.01
+    type_rates: dict[str, float] = dataclasses.field(default_factory=lambda: {})
+    buffer_size: int = 1024
+    flush_interval: float = 10.0
+    path: str = ""
+
+class DiceConfig(DConfig):
+    trace: TraceData = TraceData()
+
 class Config(BaseModel):
-    dice: DConfig
\ No newline at end of file
+    dice: DiceConfig
@@ -0,0 +1,152 @@
+from typing import Iterable
+from config.config import CommandData
+from nonebot.plugin import Plugin
+from nonebot.plugin.model import PluginMetadata
+
+def generate_help_message(commands: dict[str, CommandData], command_start: str, command_sep: str, cmd_prefix: str = "") -> str:
+    """
+    生成指令帮助信息。
+
+    :param commands: 指令数据字典，键为指令名称，值为指令数据对象。
+    :param command_start: 指令起始符。
+    :param command_sep: 指令与子指令之间的分隔符。
+    :param cmd_prefix: 父指令的前缀，顶层指令为空。
+    :return: 帮助信息字符串。
+    """
+    lines: list[str] = []
+    for command_data in commands.values():
+        prefix = f"{cmd_prefix}{command_sep if cmd_prefix != '' else ''}{command_data.prefix}"
+        display = prefix
+        if len(command_data.aliases) > 0:
+            display += f"({','.join(command_data.aliases)})"
+        args = "".join(f" {'<' if arg.required else '['}{arg.description}{'>' if arg.required else ']'}" for arg in command_data.args)
+        lines.append(f"{command_start}{display}{args}: {command_data.description}\n")
+        if len(command_data.subcommands) > 0:
+            lines.append(generate_help_message(command_data.subcommands, command_start, command_sep, prefix))
+    return "".join(lines)
+
+class HelpIndex():
+    """
+    HelpIndex类在所有插件加载后建立一次帮助查询索引。
+    插件名称、指令前缀和别名（小写）都映射到所属插件，渲染后的帮助文本按插件缓存，
+    每次查询前用changed检查已加载的插件及其元数据是否变化（重载），变化时调用invalidate使缓存失效并重建索引。
+
+    Attributes:
+        command_start (str): 指令起始符。
+        command_sep (str): 指令与子指令之间的分隔符。
+        usage (str): 插件列表末尾附加的使用说明。
+        index (dict[str, Plugin]): 查询关键字到插件的映射。
+        rendered (dict[str, tuple[PluginMetadata, str]]): 插件名到渲染时的元数据和帮助文本的映射。
+        plugin_list (str | None): 渲染后的插件列表。
+        plugins (dict[str, tuple[Plugin, PluginMetadata | None]]): 建立索引时的插件名到插件对象和元数据的映射。
+        built (bool): 索引是否已建立。
+    """
+    command_start: str
+    command_sep: str
+    usage: str
+    index: dict[str, Plugin]
+    rendered: dict[str, tuple[PluginMetadata, str]]
+    plugin_list: str | None
+    plugins: dict[str, tuple[Plugin, PluginMetadata | None]]
+    built: bool
+
+    def __init__(self, usage: str = ""):
+        self.command_start = "/"
+        self.command_sep = "."
+        self.usage = usage
+        self.index = {}
+        self.rendered = {}
+        self.plugin_list = None
+        self.plugins = {}
+        self.built = False
+
+    def build(self, plugins: Iterable[Plugin], command_start: Iterable[str], command_sep: Iterable[str]):
+        """
+        建立查询索引。同一关键字对应多个插件时，保留先出现的插件。
+
+        :param plugins: 已加载的插件。
+        :param command_start: 指令起始符，取第一个用于显示。
+        :param command_sep: 指令分隔符，取第一个用于显示。
+        """
+        self.command_start = next(iter(command_start), "")
+        self.command_sep = next(iter(command_sep), "")
+        self.index = {}
+        self.rendered = {}
+        self.plugin_list = None
+        self.plugins = {}
+        lines = ["插件列表:\n"]
+        for plugin in plugins:
+            self.plugins[plugin.name] = (plugin, plugin.metadata)
+            if plugin.metadata is None: continue
+            lines.append(f"{plugin.metadata.name}: {plugin.metadata.description}\n")
+            commands: dict[str, CommandData] = plugin.metadata.extra.get("commands", {})
+            keys = [plugin.metadata.name]
+            for command_data in commands.values():
+                keys.append(command_data.prefix)
+                keys.extend(command_data.aliases)
+            for key in keys:
+                self.index.setdefault(key.lower(), plugin)
+        lines.append(f"\n{self.usage}")
+        self.plugin_list = "".join(lines)
+        self.built = True
+
+    def changed(self, plugins: Iterable[Plugin]) -> bool:
+        """
+        检查已加载的插件是否与建立索引时不同。插件被加载、卸载或重载后，插件对象或元数据对象会被替换。
+
+        :param plugins: 当前已加载的插件。
+        :return: 插件集合或任一插件的元数据发生变化时返回True。
+        """
+        count = 0
+        for plugin in plugins:
+            count += 1
+            entry = self.plugins.get(plugin.name)
+            if entry is None or entry[0] is not plugin or entry[1] is not plugin.metadata:
+                return True
+        return count != len(self.plugins)
+
+    def invalidate(self, plugin_name: str | None = None):
+        """
+        使缓存失效。插件重载后应调用该方法。
+
+        :param plugin_name: 插件名，为None时清空所有缓存并在下次查询时重建索引。
+        """
+        if plugin_name is None:
+            self.built = False
+            self.index = {}
+            self.plugins = {}
+            self.rendered.clear()
+            self.plugin_list = None
+        else:
+            self.rendered.pop(plugin_name, None)
+
+    def render(self, plugin: Plugin) -> str:
+        """
+        渲染插件的帮助文本。
+
+        :param plugin: 插件对象，元数据不能为None。
+        :return: 帮助文本。
+        """
+        metadata: PluginMetadata = plugin.metadata # type: ignore
+        return "".join([
+            f"{metadata.name}:{metadata.description}\n{metadata.usage}\n",
+            "使用方法(缩写):\n",
+            generate_help_message(metadata.extra.get("commands", {}), self.command_start, self.command_sep)
+        ])
+
+    def lookup(self, command: str) -> str | None:
+        """
+        查询插件或指令的帮助文本。
+
+        :param command: 插件名称、指令前缀或别名，不区分大小写。
+        :return: 帮助文本，没有找到时返回None。
+        """
+        plugin = self.index.get(command.lower().strip())
+        if plugin is None or plugin.metadata is None:
+            return None
+        cached = self.rendered.get(plugin.name)
+        if cached is not None and cached[0] is plugin.metadata:
+            return cached[1]
+        text = self.render(plugin)
+        self.rendered[plugin.name] = (plugin.metadata, text)
+        return text
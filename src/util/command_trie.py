@@ -0,0 +1,126 @@
+import re
+from typing import Iterable, Sequence
+
+class TrieNode():
+    """
+    命令前缀树的节点。同一命令的前缀和所有别名指向同一个节点，子命令不会被复制。
+
+    Attributes:
+        name (str | None): 命令名称，中间节点为None。
+        children (dict[str, TrieNode]): 子节点，键为命令关键字。
+    """
+    __slots__ = ("name", "children")
+    name: str | None
+    children: dict[str, "TrieNode"]
+
+    def __init__(self, name: str | None = None):
+        self.name = name
+        self.children = {}
+
+class CommandMatch():
+    """
+    命令匹配结果。
+
+    Attributes:
+        name (str): 命令名称。
+        start (str): 匹配到的命令起始符。
+        keywords (tuple[str, ...]): 命令关键字路径。
+        raw_command (str): 消息中的原始命令文本，包含起始符。
+        rest (str): 命令之后的文本。
+        whitespace (str | None): 命令与参数之间的空白字符。
+    """
+    __slots__ = ("name", "start", "keywords", "raw_command", "rest", "whitespace")
+
+    def __init__(self, name: str, start: str, keywords: tuple[str, ...], raw_command: str, rest: str, whitespace: str | None):
+        self.name = name
+        self.start = start
+        self.keywords = keywords
+        self.raw_command = raw_command
+        self.rest = rest
+        self.whitespace = whitespace
+
+class CommandTrie():
+    """
+    CommandTrie类把所有命令及其子命令编译为一棵以关键字为边的前缀树。
+    匹配时只需把消息的第一个词按分隔符切分并沿树走一遍，耗时与命令数量无关。
+    """
+    root: TrieNode
+    starts: list[str]
+    separator: re.Pattern
+
+    def __init__(self, starts: Iterable[str] = ("/",), separators: Iterable[str] = ("-",)):
+        """
+        初始化CommandTrie实例。
+
+        :param starts: 命令起始符。
+        :param separators: 命令与子命令之间的分隔符。
+        """
+        self.root = TrieNode()
+        self.set_symbols(starts, separators)
+
+    def set_symbols(self, starts: Iterable[str], separators: Iterable[str]):
+        """
+        设置命令起始符和分隔符。
+
+        :param starts: 命令起始符。
+        :param separators: 命令与子命令之间的分隔符。
+        """
+        # 优先匹配较长的起始符
+        self.starts = sorted(starts, key=len, reverse=True)
+        self.separator = re.compile("|".join(re.escape(separator) for separator in sorted(separators, key=len, reverse=True) if separator != "") or "(?!)")
+
+    def insert(self, name: str, keywords: Sequence[str], parent: TrieNode | None = None) -> TrieNode:
+        """
+        插入一个命令。
+
+        :param name: 命令名称。
+        :param keywords: 命令的前缀和别名。
+        :param parent: 父命令的节点，为None时插入为顶层命令。
+        :return: 命令的节点，用于插入子命令。
+        """
+        parent = parent or self.root
+        node = None
+        for keyword in keywords:
+            if keyword in parent.children:
+                node = parent.children[keyword]
+                break
+        if node is None:
+            node = TrieNode()
+        node.name = name
+        for keyword in keywords:
+            parent.children[keyword] = node
+        return node
+
+    def match(self, text: str) -> CommandMatch | None:
+        """
+        匹配消息开头的命令。命令之后必须是空白字符或消息结尾。
+        与NoneBot的命令规则一致，匹配前去除开头的空白字符，例如群聊中@之后的空格。
+
+        :param text: 消息的开头文本。
+        :return: 匹配结果，没有匹配的命令时返回None。
+        """
+        text = text.lstrip()
+        for start in self.starts:
+            if not text.startswith(start):
+                continue
+            body = text[len(start):]
+            parts = body.split(maxsplit=1)
+            if len(parts) == 0:
+                continue
+            word = parts[0]
+            if not body.startswith(word):
+                continue
+            node = self.root
+            keywords = tuple(self.separator.split(word))
+            for keyword in keywords:
+                next_node = node.children.get(keyword)
+                if next_node is None:
+                    break
+                node = next_node
+            else:
+                if node.name is not None:
+                    rest = body[len(word):]
+                    stripped = rest.lstrip()
+                    whitespace = rest[:len(rest) - len(stripped)] or None
+                    return CommandMatch(node.name, start, keywords, start + word, stripped, whitespace)
+        return None
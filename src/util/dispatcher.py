@@ -0,0 +1,89 @@
+from typing import Sequence
+from nonebot import get_driver, on_message
+from nonebot.adapters import Event
+from nonebot.consts import PREFIX_KEY, CMD_KEY, RAW_CMD_KEY, CMD_ARG_KEY, CMD_START_KEY, CMD_WHITESPACE_KEY
+from nonebot.internal.matcher import Matcher
+from nonebot.message import event_preprocessor
+from nonebot.rule import Rule
+from nonebot.typing import T_State
+
+from .command_trie import CommandTrie, TrieNode
+
+# 分发结果在事件状态中的键
+DISPATCH_KEY = "_command_dispatch"
+
+class CommandDispatcher():
+    """
+    CommandDispatcher类把所有插件的命令编译到同一棵前缀树中。
+    每条消息只在事件预处理时匹配一次，各命令的匹配器只需比较命令名称。
+    """
+    trie: CommandTrie
+    configured: bool
+
+    def __init__(self):
+        self.trie = CommandTrie()
+        self.configured = False
+
+    def register(self, name: str, keywords: Sequence[str], parent: TrieNode | None = None) -> tuple[type[Matcher], TrieNode]:
+        """
+        注册命令并创建对应的匹配器。
+
+        :param name: 命令名称。
+        :param keywords: 命令的前缀和别名。
+        :param parent: 父命令的节点，为None时注册为顶层命令。
+        :return: 命令的匹配器和前缀树节点。
+        """
+        node = self.trie.insert(name, keywords, parent)
+        return on_message(Rule(DispatchRule(name)), block=True), node
+
+    def dispatch(self, event: Event, state: T_State):
+        """
+        匹配消息中的命令，把结果写入事件状态。
+
+        :param event: 事件对象。
+        :param state: 事件状态。
+        """
+        if not self.configured:
+            config = get_driver().config
+            self.trie.set_symbols(config.command_start, config.command_sep)
+            self.configured = True
+        message = event.get_message()
+        if len(message) == 0 or not message[0].is_text():
+            return
+        match = self.trie.match(str(message[0]))
+        if match is None:
+            return
+        # 与NoneBot的命令规则保持一致，使CommandArg等依赖可以正常使用
+        state[DISPATCH_KEY] = {
+            "name": match.name,
+            "prefix": {
+                CMD_KEY: match.keywords,
+                RAW_CMD_KEY: match.raw_command,
+                CMD_ARG_KEY: message.__class__(match.rest) + message[1:],
+                CMD_START_KEY: match.start,
+                CMD_WHITESPACE_KEY: match.whitespace
+            }
+        }
+
+class DispatchRule():
+    """
+    命令匹配器的规则，只检查预处理时分发的命令名称。
+    """
+    __slots__ = ("name",)
+
+    def __init__(self, name: str):
+        self.name = name
+
+    async def __call__(self, state: T_State) -> bool:
+        result = state.get(DISPATCH_KEY)
+        if result is None or result["name"] != self.name:
+            return False
+        state[PREFIX_KEY] = result["prefix"]
+        return True
+
+dispatcher = CommandDispatcher()
+
+@event_preprocessor
+async def _(event: Event, state: T_State):
+    if event.get_type() == "message":
+        dispatcher.dispatch(event, state)
@@ -4,7 +4,19 @@ import uuid
 from datetime import datetime
 import urllib
 from nonebot import logger
+import asyncio
 import base64
+import hashlib
+import httpx
+
+# 常见图片格式的文件头
+IMAGE_SIGNATURES = {
+    b"\x89PNG": "image/png",
+    b"\xff\xd8": "image/jpeg",
+    b"GIF8": "image/gif",
+    b"RIFF": "image/webp",
+    b"BM": "image/bmp",
+}
 
 def read_file(file_path):
     """
@@ -87,4 +99,71 @@ def remove_file(file_path):
     except FileNotFoundError:
         logger.error("文件未找到！")
     except IOError:
-        logger.error("删除文件时出错！")
\ No newline at end of file
+        logger.error("删除文件时出错！")
+
+def guess_image_type(header: bytes, content_type: str = "") -> str:
+    """
+    根据响应头或文件头判断图片的MIME类型。
+
+    :param header: 文件开头的字节。
+    :param content_type: 响应的Content-Type。
+    :return: MIME类型，无法判断时返回image/jpeg。
+    """
+    content_type = content_type.split(";")[0].strip().lower()
+    if content_type.startswith("image/"):
+        return content_type
+    for signature, mime in IMAGE_SIGNATURES.items():
+        if header.startswith(signature):
+            return mime
+    return "image/jpeg"
+
+async def stream_as_base64(client: httpx.AsyncClient, url: str, max_bytes: int) -> tuple[str, str, str]:
+    """
+    以流的形式下载文件，边下载边转换为Base64编码，不写入磁盘。
+
+    :param client: HTTP客户端。
+    :param url: 文件的URL地址。
+    :param max_bytes: 文件的最大字节数。
+    :return: MIME类型、Base64编码的字符串和内容的SHA-256哈希。
+    :raises ValueError: 文件超过最大字节数。
+    """
+    async with client.stream("GET", url, follow_redirects=True) as response:
+        response.raise_for_status()
+        if int(response.headers.get("content-length", 0)) > max_bytes:
+            raise ValueError(f"文件超过{max_bytes}字节")
+        encoded: list[str] = []
+        rest = b""
+        header = b""
+        size = 0
+        digest = hashlib.sha256()
+        async for chunk in response.aiter_bytes():
+            size += len(chunk)
+            digest.update(chunk)
+            if size > max_bytes:
+                raise ValueError(f"文件超过{max_bytes}字节")
+            if len(header) < 16:
+                header += chunk[:16 - len(header)]
+            # 只编码长度为3的倍数的部分，剩余字节留到下一块
+            data = rest + chunk
+            aligned = len(data) - len(data) % 3
+            encoded.append(base64.b64encode(data[:aligned]).decode("ascii"))
+            rest = data[aligned:]
+        encoded.append(base64.b64encode(rest).decode("ascii"))
+        return guess_image_type(header, response.headers.get("content-type", "")), "".join(encoded), digest.hexdigest()
+
+async def fetch_image(client: httpx.AsyncClient, url: str, max_bytes: int = 10 * 1024 * 1024, timeout: float = 20.0) -> tuple[str, str] | None:
+    """
+    下载图片并转换为data URL，同时计算内容哈希，超时或超过大小限制时返回None。
+
+    :param client: HTTP客户端。
+    :param url: 图片的URL地址。
+    :param max_bytes: 图片的最大字节数。
+    :param timeout: 下载的最长时间（秒）。
+    :return: 内容的SHA-256哈希和data URL，下载失败时返回None。
+    """
+    try:
+        mime, data, digest = await asyncio.wait_for(stream_as_base64(client, url, max_bytes), timeout)
+    except Exception as e:
+        logger.error(f"下载图片时出错：{e}")
+        return None
+    return digest, f"data:{mime};base64,{data}"
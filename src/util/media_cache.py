@@ -0,0 +1,304 @@
+import asyncio
+import base64
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+from nonebot import logger
+
+from .file_system import guess_image_type
+
+# 保存URL映射的索引文件，与缓存文件放在同一目录
+INDEX_FILE = "index.json"
+
+class MediaCache():
+    """
+    MediaCache类是按内容寻址的图片缓存。
+    URL映射到内容的哈希，相同内容只保存一份：内存层保存可直接使用的data URL，
+    磁盘层以哈希为文件名保存原始字节。两层各有字节预算，超出时按LRU淘汰。
+    没有任何URL引用的磁盘文件会被后台清理。
+    URL映射在关闭时写入索引文件，启动时扫描存储目录重建磁盘层，并恢复仍有文件的URL映射。
+    """
+    storage_path: str
+    memory_budget: int
+    disk_budget: int
+    max_urls: int
+    urls: OrderedDict[str, str]
+    memory: OrderedDict[str, str]
+    memory_bytes: int
+    disk: OrderedDict[str, int]
+    disk_bytes: int
+    inflight: dict[str, asyncio.Future]
+    memory_hits: int
+    disk_hits: int
+    misses: int
+
+    def __init__(self, storage_dir: str = "files/media", memory_budget: int = 64 * 1024 * 1024, disk_budget: int = 512 * 1024 * 1024, max_urls: int = 8192):
+        """
+        初始化MediaCache实例。
+
+        :param storage_dir: 磁盘层的存储目录。
+        :param memory_budget: 内存层的字节预算。
+        :param disk_budget: 磁盘层的字节预算。
+        :param max_urls: 最多记录的URL数。
+        """
+        self.storage_path = os.path.join('../', storage_dir)
+        os.makedirs(self.storage_path, exist_ok=True)
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.max_urls = max_urls
+        self.urls = OrderedDict()
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.disk = OrderedDict()
+        self.disk_bytes = 0
+        self.inflight = {}
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def file_path(self, digest: str) -> str:
+        return os.path.join(self.storage_path, digest)
+
+    async def load(self):
+        """
+        扫描存储目录重建磁盘层，并从索引文件恢复URL映射，文件操作在线程池中执行。
+        """
+        files, urls = await asyncio.to_thread(self.read_index)
+        for digest, size in files:
+            if digest not in self.disk:
+                self.disk[digest] = size
+                self.disk_bytes += size
+        for url, digest in urls:
+            if digest in self.disk and url not in self.urls:
+                self.urls[url] = digest
+        while len(self.urls) > self.max_urls:
+            self.urls.popitem(last=False)
+        self.evict_disk()
+
+    def read_index(self) -> tuple[list[tuple[str, int]], list[tuple[str, str]]]:
+        """
+        读取存储目录中的缓存文件和索引文件。
+
+        :return: 按修改时间从旧到新排列的内容哈希和文件大小，以及索引文件中的URL映射。
+        """
+        files: list[tuple[float, str, int]] = []
+        for entry in os.scandir(self.storage_path):
+            if not entry.is_file() or entry.name.endswith(".tmp") or entry.name == INDEX_FILE:
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, entry.name, stat.st_size))
+        files.sort()
+        urls: list[tuple[str, str]] = []
+        try:
+            with open(self.file_path(INDEX_FILE), "r", encoding="utf-8") as file:
+                urls = [(url, digest) for url, digest in json.load(file)]
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning(f"读取图片缓存索引失败：{e}")
+        return [(name, size) for _, name, size in files], urls
+
+    async def save(self):
+        """
+        把URL映射写入索引文件，文件操作在线程池中执行。
+        """
+        await asyncio.to_thread(self.write_index, list(self.urls.items()))
+
+    def write_index(self, urls: list[tuple[str, str]]):
+        """
+        写入索引文件，先写临时文件再重命名。
+
+        :param urls: 按最近使用顺序排列的URL映射。
+        """
+        temp = self.file_path(INDEX_FILE) + ".tmp"
+        with open(temp, "w", encoding="utf-8") as file:
+            json.dump(urls, file, ensure_ascii=False)
+        os.replace(temp, self.file_path(INDEX_FILE))
+
+    async def get(self, url: str, fetch: Callable[[], Awaitable[tuple[str, str] | None]]) -> str | None:
+        """
+        获取URL对应的data URL，未缓存时调用fetch下载。
+        同一URL的并发请求只下载一次。
+
+        :param url: 图片的URL地址。
+        :param fetch: 下载函数，返回内容哈希和data URL。
+        :return: data URL，下载失败时返回None。
+        """
+        digest = self.urls.get(url)
+        if digest is not None:
+            self.urls.move_to_end(url)
+            payload = await self.lookup(digest)
+            if payload is not None:
+                return payload
+            del self.urls[url]
+        if url in self.inflight:
+            return await asyncio.shield(self.inflight[url])
+        self.misses += 1
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.inflight[url] = future
+        payload = None
+        try:
+            result = await fetch()
+            if result is not None:
+                payload = await self.store(url, *result)
+            return payload
+        finally:
+            # 下载失败或被取消时，等待同一URL的请求得到None
+            del self.inflight[url]
+            future.set_result(payload)
+
+    async def lookup(self, digest: str) -> str | None:
+        """
+        按内容哈希查找data URL，磁盘命中时提升到内存层。
+
+        :param digest: 内容哈希。
+        :return: data URL，未缓存时返回None。
+        """
+        payload = self.memory.get(digest)
+        if payload is not None:
+            self.memory_hits += 1
+            self.memory.move_to_end(digest)
+            return payload
+        if digest not in self.disk:
+            return None
+        try:
+            data = await asyncio.to_thread(self.read_file, digest)
+        except OSError:
+            self.drop_disk(digest)
+            return None
+        self.disk_hits += 1
+        self.disk.move_to_end(digest)
+        payload = f"data:{guess_image_type(data[:16])};base64,{base64.b64encode(data).decode('ascii')}"
+        self.put_memory(digest, payload)
+        return payload
+
+    async def store(self, url: str, digest: str, payload: str) -> str:
+        """
+        记录URL与内容哈希的映射，并把内容写入内存层和磁盘层。
+        相同内容已缓存时复用已有的data URL。
+
+        :param url: 图片的URL地址。
+        :param digest: 内容哈希。
+        :param payload: data URL。
+        :return: 缓存中的data URL。
+        """
+        self.urls[url] = digest
+        self.urls.move_to_end(url)
+        while len(self.urls) > self.max_urls:
+            self.urls.popitem(last=False)
+        if digest in self.memory:
+            self.memory.move_to_end(digest)
+            return self.memory[digest]
+        self.put_memory(digest, payload)
+        if digest not in self.disk:
+            try:
+                size = await asyncio.to_thread(self.write_file, digest, payload)
+            except OSError as e:
+                logger.error(f"写入图片缓存时出错：{e}")
+                return payload
+            self.disk[digest] = size
+            self.disk_bytes += size
+            self.evict_disk()
+        return payload
+
+    def put_memory(self, digest: str, payload: str):
+        """
+        把data URL放入内存层，超出预算时淘汰最久未使用的条目。
+        """
+        self.memory[digest] = payload
+        self.memory_bytes += len(payload)
+        while self.memory_bytes > self.memory_budget and len(self.memory) > 1:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+    def evict_disk(self):
+        """
+        磁盘层超出预算时删除最久未使用的文件。
+        """
+        while self.disk_bytes > self.disk_budget and len(self.disk) > 1:
+            digest = next(iter(self.disk))
+            self.drop_disk(digest)
+            try:
+                os.remove(self.file_path(digest))
+            except OSError:
+                pass
+
+    def drop_disk(self, digest: str):
+        self.disk_bytes -= self.disk.pop(digest, 0)
+
+    def read_file(self, digest: str) -> bytes:
+        with open(self.file_path(digest), "rb") as file:
+            return file.read()
+
+    def write_file(self, digest: str, payload: str) -> int:
+        """
+        把data URL解码为原始字节写入磁盘，先写临时文件再重命名。
+
+        :return: 文件大小。
+        """
+        data = base64.b64decode(payload.split(",", 1)[1])
+        temp = self.file_path(digest) + ".tmp"
+        with open(temp, "wb") as file:
+            file.write(data)
+        os.replace(temp, self.file_path(digest))
+        return len(data)
+
+    async def cleanup(self, grace: float = 3600) -> int:
+        """
+        删除没有URL引用的磁盘文件和残留的临时文件，文件操作在线程池中执行。
+
+        :param grace: 修改时间在该时间（秒）以内的文件不删除。
+        :return: 删除的文件数。
+        """
+        removed = await asyncio.to_thread(self.remove_orphans, set(self.urls.values()), time.time() - grace)
+        for digest in removed:
+            self.memory_bytes -= len(self.memory.pop(digest, ""))
+            self.drop_disk(digest)
+        return len(removed)
+
+    def remove_orphans(self, referenced: set[str], deadline: float) -> list[str]:
+        """
+        删除存储目录中未被引用且早于deadline的文件。
+
+        :param referenced: 仍被URL引用的内容哈希。
+        :param deadline: 只删除修改时间早于该时间戳的文件。
+        :return: 被删除的内容哈希，不包含临时文件。
+        """
+        removed: list[str] = []
+        for entry in os.scandir(self.storage_path):
+            if not entry.is_file() or entry.name == INDEX_FILE:
+                continue
+            temporary = entry.name.endswith(".tmp")
+            if not temporary and entry.name in referenced:
+                continue
+            try:
+                if entry.stat().st_mtime > deadline:
+                    continue
+                os.remove(entry.path)
+            except OSError:
+                continue
+            if not temporary:
+                removed.append(entry.name)
+        return removed
+
+    def get_stats(self) -> dict[str, float]:
+        """
+        获取缓存的统计信息。
+
+        :return: 包含命中次数、命中率和各层占用字节数的字典。
+        """
+        total = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / total if total > 0 else 0.0,
+            "memory_bytes": self.memory_bytes,
+            "disk_bytes": self.disk_bytes,
+            "urls": len(self.urls)
+        }
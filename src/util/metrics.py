@@ -0,0 +1,222 @@
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Sequence
+
+# 默认的延迟分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    """
+    格式化Prometheus标签。
+
+    :param names: 标签名称。
+    :param values: 标签值。
+    :param extra: 额外的已格式化标签，例如直方图的le。
+    :return: 形如{a="1",b="2"}的字符串，没有标签时为空字符串。
+    """
+    parts = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra != "":
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if len(parts) > 0 else ""
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Counter():
+    """
+    Counter类是按标签区分的单调递增计数器。
+    """
+    name: str
+    description: str
+    label_names: tuple[str, ...]
+    values: dict[tuple[str, ...], float]
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.values = {}
+
+    def inc(self, labels: tuple[str, ...] = (), value: float = 1):
+        """
+        增加计数。
+
+        :param labels: 标签值，顺序与label_names一致。
+        :param value: 增加的数量。
+        """
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def set(self, labels: tuple[str, ...], value: float):
+        """
+        设置累计值，供采集函数导出其他对象中已经累计的计数。
+
+        :param labels: 标签值，顺序与label_names一致。
+        :param value: 累计值，不应小于之前设置的值。
+        """
+        self.values[labels] = value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{format_labels(self.label_names, labels)} {format_value(value)}")
+        return lines
+
+class Gauge():
+    """
+    Gauge类是按标签区分的可增可减的当前值，例如用户数和内存占用。
+    """
+    name: str
+    description: str
+    label_names: tuple[str, ...]
+    values: dict[tuple[str, ...], float]
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.values = {}
+
+    def set(self, labels: tuple[str, ...] = (), value: float = 0):
+        """
+        设置当前值。
+
+        :param labels: 标签值，顺序与label_names一致。
+        :param value: 当前值。
+        """
+        self.values[labels] = value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge"]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{format_labels(self.label_names, labels)} {format_value(value)}")
+        return lines
+
+class Histogram():
+    """
+    Histogram类是按标签区分的固定分桶直方图，分位数由Prometheus根据分桶计算。
+    每个标签组合保存各分桶的计数、观测值总和和观测次数。
+    """
+    name: str
+    description: str
+    label_names: tuple[str, ...]
+    buckets: tuple[float, ...]
+    series: dict[tuple[str, ...], list[float]]
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}
+
+    def observe(self, value: float, labels: tuple[str, ...] = ()):
+        """
+        记录一次观测值。
+
+        :param value: 观测值。
+        :param labels: 标签值，顺序与label_names一致。
+        """
+        series = self.series.get(labels)
+        if series is None:
+            # 各分桶的计数，最后一个为+Inf，之后是总和与次数
+            series = self.series[labels] = [0] * (len(self.buckets) + 3)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, labels: tuple[str, ...] = ()) -> Iterator[None]:
+        """
+        记录代码块的执行时间（秒），代码块抛出异常时也会记录。
+
+        :param labels: 标签值，顺序与label_names一致。
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for labels, series in self.series.items():
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = 'le="' + format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{format_labels(self.label_names, labels, le)} {format_value(cumulative)}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {format_value(series[-2])}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {format_value(series[-1])}")
+        return lines
+
+class MetricsRegistry():
+    """
+    MetricsRegistry类保存所有指标，并以Prometheus文本格式输出。
+    输出前会调用所有采集函数，由它们从其他对象读取统计信息并更新指标。
+    """
+    metrics: dict[str, Counter | Gauge | Histogram]
+    collectors: list[Callable[[], None]]
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+
+    def counter(self, name: str, description: str, label_names: Sequence[str] = ()) -> Counter:
+        """
+        获取或创建计数器。
+        """
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = Counter(name, description, label_names)
+        if not isinstance(metric, Counter):
+            raise ValueError(f"指标 {name} 已注册为其他类型")
+        return metric
+
+    def gauge(self, name: str, description: str, label_names: Sequence[str] = ()) -> Gauge:
+        """
+        获取或创建仪表。
+        """
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = Gauge(name, description, label_names)
+        if not isinstance(metric, Gauge):
+            raise ValueError(f"指标 {name} 已注册为其他类型")
+        return metric
+
+    def collect(self, collector: Callable[[], None]):
+        """
+        注册采集函数，每次输出指标前调用。
+
+        :param collector: 采集函数。
+        """
+        self.collectors.append(collector)
+
+    def histogram(self, name: str, description: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        """
+        获取或创建直方图。
+        """
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = Histogram(name, description, label_names, buckets)
+        if not isinstance(metric, Histogram):
+            raise ValueError(f"指标 {name} 已注册为其他类型")
+        return metric
+
+    def render(self) -> str:
+        """
+        以Prometheus文本格式输出所有指标。
+        """
+        for collector in self.collectors:
+            collector()
+        lines: list[str] = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
@@ -0,0 +1,54 @@
+import sys
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+class StartupProfiler():
+    """
+    StartupProfiler类记录启动过程中各阶段的耗时和新导入的模块数，
+    用于发现导入和初始化时间的退化。更细的导入耗时可以使用python -X importtime查看。
+
+    Attributes:
+        records (list[tuple[str, float, int]]): 阶段名称、耗时（秒）和新导入的模块数。
+        start (float): 创建实例的时间。
+    """
+    records: list[tuple[str, float, int]]
+    start: float
+
+    def __init__(self):
+        self.records = []
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def measure(self, name: str) -> Iterator[None]:
+        """
+        记录代码块的耗时和其中新导入的模块数，代码块抛出异常时也会记录。
+
+        :param name: 阶段名称。
+        """
+        modules = len(sys.modules)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.records.append((name, time.perf_counter() - start, len(sys.modules) - modules))
+
+    def add(self, name: str, seconds: float):
+        """
+        记录一个在其他地方计时的阶段。
+
+        :param name: 阶段名称。
+        :param seconds: 耗时（秒）。
+        """
+        self.records.append((name, seconds, 0))
+
+    def report(self) -> str:
+        """
+        生成按耗时从长到短排列的报告。
+
+        :return: 报告文本。
+        """
+        lines = [f"启动耗时 {time.perf_counter() - self.start:.3f}s:"]
+        for name, seconds, modules in sorted(self.records, key=lambda record: record[1], reverse=True):
+            lines.append(f"  {name}: {seconds * 1000:.1f}ms, 导入 {modules} 个模块")
+        return "\n".join(lines)
@@ -0,0 +1,189 @@
+import asyncio
+import json
+import os
+import random
+import time
+from collections import Counter, deque
+from typing import Any
+from nonebot import logger
+from nonebot.adapters import Bot, Event
+
+from . import metrics
+
+class TraceRecord():
+    """
+    采样到的事件记录。记录只保存事件对象的引用，字段在写出时才格式化。
+
+    Attributes:
+        timestamp (float): 收到事件的时间戳。
+        event_type (str): 事件类型。
+        adapter (str): 适配器名称。
+        event (Event): 事件对象。
+    """
+    __slots__ = ("timestamp", "event_type", "adapter", "event")
+    timestamp: float
+    event_type: str
+    adapter: str
+    event: Event
+
+    def __init__(self, timestamp: float, event_type: str, adapter: str, event: Event):
+        self.timestamp = timestamp
+        self.event_type = event_type
+        self.adapter = adapter
+        self.event = event
+
+    def format(self) -> dict[str, Any]:
+        """
+        格式化为结构化记录。
+
+        :return: 可被JSON序列化的字典。
+        """
+        record: dict[str, Any] = {
+            "timestamp": self.timestamp,
+            "type": self.event_type,
+            "adapter": self.adapter,
+            "name": self.event.get_event_name()
+        }
+        # 部分事件没有会话或描述
+        try:
+            record["session"] = self.event.get_session_id()
+        except Exception:
+            pass
+        try:
+            record["description"] = self.event.get_event_description()
+        except Exception:
+            pass
+        return record
+
+class EventTracer():
+    """
+    EventTracer类按采样率记录事件，并统计各事件类型、适配器和插件的事件数量。
+    采样到的记录放入有界环形缓冲区，缓冲区满时丢弃最旧的记录，
+    由后台任务定期在线程池中格式化并写出，接收事件时不做任何I/O。
+    统计信息通过指标注册表的采集函数输出到/metrics。
+    """
+    sample_rate: float
+    type_rates: dict[str, float]
+    path: str
+    records: deque[TraceRecord]
+    dropped: int
+    events: Counter[tuple[str, str]]
+    plugins: Counter[str]
+    event_metric: metrics.Counter
+    plugin_metric: metrics.Counter
+    buffered_metric: metrics.Gauge
+    dropped_metric: metrics.Counter
+
+    def __init__(self, sample_rate: float = 0.01, type_rates: dict[str, float] | None = None, buffer_size: int = 1024, path: str = ""):
+        """
+        初始化EventTracer实例。
+
+        :param sample_rate: 默认采样率，0表示不采样，1表示记录所有事件。
+        :param type_rates: 按事件类型覆盖的采样率。
+        :param buffer_size: 环形缓冲区的容量。
+        :param path: 记录文件路径（JSON Lines），为空时写入日志。
+        """
+        self.sample_rate = sample_rate
+        self.type_rates = type_rates or {}
+        self.path = path
+        self.records = deque(maxlen=buffer_size)
+        self.dropped = 0
+        self.events = Counter()
+        self.plugins = Counter()
+        self.event_metric = metrics.registry.counter("bot_events_total", "收到的事件数", ("type", "adapter"))
+        self.plugin_metric = metrics.registry.counter("bot_plugin_events_total", "各插件处理的事件数", ("plugin",))
+        self.buffered_metric = metrics.registry.gauge("bot_trace_buffered", "缓冲区中等待写出的采样记录数")
+        self.dropped_metric = metrics.registry.counter("bot_trace_dropped_total", "缓冲区满时丢弃的采样记录数")
+        metrics.registry.collect(self.collect_metrics)
+
+    def trace(self, bot: Bot, event: Event):
+        """
+        统计事件并按采样率记录。
+
+        :param bot: 收到事件的机器人。
+        :param event: 事件对象。
+        """
+        event_type = event.get_type()
+        adapter = bot.adapter.get_name()
+        self.events[(event_type, adapter)] += 1
+        rate = self.type_rates.get(event_type, self.sample_rate)
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return
+        if len(self.records) == self.records.maxlen:
+            self.dropped += 1
+        self.records.append(TraceRecord(time.time(), event_type, adapter, event))
+
+    def count_plugin(self, plugin_name: str | None):
+        """
+        统计处理事件的插件。
+
+        :param plugin_name: 运行的匹配器所属的插件名称。
+        """
+        self.plugins[plugin_name or "unknown"] += 1
+
+    def drain(self) -> list[TraceRecord]:
+        """
+        取出缓冲区中的所有记录。
+        """
+        records = list(self.records)
+        self.records.clear()
+        return records
+
+    def write(self, records: list[TraceRecord]):
+        """
+        格式化并写出记录，在线程池中执行。
+
+        :param records: 要写出的记录。
+        """
+        lines = [json.dumps(record.format(), ensure_ascii=False, default=str) for record in records]
+        if self.path == "":
+            for line in lines:
+                logger.info(f"事件追踪: {line}")
+            return
+        directory = os.path.dirname(self.path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+
+    async def flush(self) -> int:
+        """
+        异步写出缓冲区中的记录。
+
+        :return: 写出的记录数。
+        """
+        records = self.drain()
+        if len(records) > 0:
+            await asyncio.to_thread(self.write, records)
+        return len(records)
+
+    def get_stats(self) -> dict[str, Any]:
+        """
+        获取事件统计信息。
+
+        :return: 包含各事件类型、适配器和插件事件数量的字典。
+        """
+        types: Counter[str] = Counter()
+        adapters: Counter[str] = Counter()
+        for (event_type, adapter), count in self.events.items():
+            types[event_type] += count
+            adapters[adapter] += count
+        return {
+            "types": dict(types),
+            "adapters": dict(adapters),
+            "plugins": dict(self.plugins),
+            "buffered": len(self.records),
+            "dropped": self.dropped
+        }
+
+    def collect_metrics(self):
+        """
+        把事件统计信息写入指标。
+        """
+        for (event_type, adapter), count in self.events.items():
+            self.event_metric.set((event_type, adapter), count)
+        stats = self.get_stats()
+        for plugin_name, count in stats["plugins"].items():
+            self.plugin_metric.set((plugin_name,), count)
+        self.buffered_metric.set((), stats["buffered"])
+        self.dropped_metric.set((), stats["dropped"])
@@ -1,24 +1,25 @@
 from config.config import DefaultPluginConfig, CommandData
-from nonebot import CommandGroup, on_message
-from nonebot.rule import command
 from nonebot.internal.matcher import Matcher
 from nonebot.plugin.model import PluginMetadata
 
-def get_command_from_data(name:str, command_data: CommandData, priority:int, parent_keyword: tuple | None) -> dict[str, type[Matcher]]:
+from .command_trie import TrieNode
+from .dispatcher import dispatcher
+
+def get_command_from_data(name:str, command_data: CommandData, priority:int, parent_node: TrieNode | None) -> dict[str, type[Matcher]]:
     """
     获取命令列表
+    命令及其子命令会注册到全局的命令前缀树中，别名共享同一个节点。
     
     :param command_data: 命令数据对象，包含命令的基本信息。
     :return: 命令列表，键为命令名称，值为命令匹配器类型。
 
     """
     command_list: dict[str, type[Matcher]] = {}
-    child_keywords = tuple([command_data.prefix] + command_data.aliases)
-    command_keywords = child_keywords if parent_keyword is None else tuple((pkey, ckey) for pkey in parent_keyword for ckey in child_keywords)
-    command_list[name] = on_message(command(*command_keywords,force_whitespace=True),block=True)
+    command_keywords = [command_data.prefix] + command_data.aliases
+    command_list[name], node = dispatcher.register(name, command_keywords, parent_node)
     if len(command_data.subcommands) > 0:
         for subcommand_name, subcommand_data in command_data.subcommands.items():
-            subcommand_list = get_command_from_data(name + "." + subcommand_name, subcommand_data, priority - 1, command_keywords)
+            subcommand_list = get_command_from_data(name + "." + subcommand_name, subcommand_data, priority - 1, node)
             command_list.update(subcommand_list)
     return command_list
 